@@ -0,0 +1,3 @@
+"""
+Benchmark suite which runs the sync against local NetBox and Zabbix stand-ins.
+"""
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# pylint: disable=too-many-locals
+"""
+Benchmark of the sync against local NetBox and Zabbix stand-ins.
+The stand-ins are seeded with a synthetic inventory after which the sync
+is run several times. The first run creates all hosts, before every next
+run a percentage of the Zabbix hosts is changed (drift).
+
+Usage: python3 -m benchmark --scale 10k --drift 5 -- -w 8
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from ast import literal_eval
+from datetime import datetime
+from os import environ, path
+from time import perf_counter
+from benchmark.inventory import SCALES, drift, seed
+from benchmark.standins import NetBoxData, ZabbixData, netbox_standin, zabbix_standin
+
+REPO = path.dirname(path.dirname(path.abspath(__file__)))
+# Config used for all benchmarks, can be changed with --set
+CONFIG = {"sync_vms": True, "inventory_mode": "manual", "inventory_sync": True,
+          "create_journal": True, "incremental_state_file": "incremental_state.json",
+          "metrics_json": "metrics.json"}
+
+
+def run_sync(workdir, env, config, args, name):
+    """
+    Runs the sync once in a separate process.
+    OUTPUT: dictionary with the wall time, peak RSS, exit code and phase durations
+    """
+    spec_file = path.join(workdir, f"{name}.spec.json")
+    result_file = path.join(workdir, f"{name}.result.json")
+    with open(spec_file, "w", encoding="utf-8") as file:
+        json.dump({"config": config, "args": args, "result": result_file}, file)
+    # The output of the sync is only shown when it fails
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as output:
+        process = subprocess.run([sys.executable, "-m", "benchmark.worker", spec_file],
+                                 cwd=workdir, env=dict(environ, PYTHONPATH=REPO, **env),
+                                 stdout=output, stderr=subprocess.STDOUT, check=False)
+        if process.returncode or not path.exists(result_file):
+            output.seek(0)
+            print("".join(output.readlines()[-20:]), file=sys.stderr)
+            sys.exit(f"Benchmark run {name} failed.")
+    with open(result_file, encoding="utf-8") as file:
+        result = json.load(file)
+    metrics_file = path.join(workdir, config.get("metrics_json") or "")
+    if config.get("metrics_json") and path.isfile(metrics_file):
+        with open(metrics_file, encoding="utf-8") as file:
+            metrics = json.load(file)
+        result.update({"phases": metrics["phases"], "outcomes": metrics["hosts"]})
+    return result
+
+
+def compare(results, baseline_file):
+    """Prints the difference between these results and a previous benchmark"""
+    with open(baseline_file, encoding="utf-8") as file:
+        baseline = {run["name"]: run for run in json.load(file)["runs"]}
+    print(f"Compared to {baseline_file}:")
+    for run in results["runs"]:
+        old = baseline.get(run["name"])
+        if not old:
+            continue
+        for key in ("wall_seconds", "hosts_per_second", "peak_rss_mb", "api_calls"):
+            change = ((run[key] - old[key]) / old[key] * 100) if old[key] else 0
+            print(f"  {run['name']:<8} {key:<17} {old[key]:>10} -> {run[key]:>10} "
+                  f"({change:+.1f}%)")
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark the sync against "
+                                     "local NetBox and Zabbix stand-ins.")
+    parser.add_argument("--scale", choices=SCALES, default="1k",
+                        help="Size of the synthetic inventory. Defaults to 1k.")
+    parser.add_argument("--devices", type=int, help="Override the number of devices.")
+    parser.add_argument("--vms", type=int, help="Override the number of VMs.")
+    parser.add_argument("--drift", type=int, default=5,
+                        help="Percentage of Zabbix hosts changed before every "
+                        "run after the first. Defaults to 5.")
+    parser.add_argument("--runs", type=int, default=2,
+                        help="Number of sync runs. Defaults to 2.")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a config option, for instance --set "
+                        "zabbix_chunk_size=100.")
+    parser.add_argument("--output", help="JSON file for the results.")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare the results with a previous benchmark.")
+    parser.add_argument("sync_args", nargs="*",
+                        help="Arguments for netbox_zabbix_sync.py, after --.")
+    arguments = parser.parse_args()
+    inventory = dict(SCALES[arguments.scale])
+    if arguments.devices is not None:
+        inventory["devices"] = arguments.devices
+    if arguments.vms is not None:
+        inventory["vms"] = arguments.vms
+    config = dict(CONFIG)
+    for item in arguments.set:
+        key, value = item.split("=", 1)
+        config[key] = literal_eval(value)
+    netbox_data, zabbix_data = NetBoxData(), ZabbixData()
+    netbox, zabbix = netbox_standin(netbox_data).start(), zabbix_standin(zabbix_data).start()
+    start = perf_counter()
+    seed(netbox_data, zabbix_data, **inventory)
+    print(f"Seeded {inventory['devices']} device(s) and {inventory['vms']} VM(s) "
+          f"in {perf_counter() - start:.1f}s.")
+    hosts = inventory["devices"] + (inventory["vms"] if config.get("sync_vms") else 0)
+    env = {"NETBOX_HOST": netbox.url, "NETBOX_TOKEN": "benchmark",
+           "ZABBIX_HOST": f"{zabbix.url}/api_jsonrpc.php", "ZABBIX_TOKEN": "benchmark"}
+    results = {"started": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "platform": platform.platform(),
+               "scale": arguments.scale, "inventory": inventory, "drift": arguments.drift,
+               "config": config, "args": arguments.sync_args, "runs": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for run in range(arguments.runs):
+            name = "initial" if run == 0 else f"resync-{run}"
+            changed = drift(zabbix_data, arguments.drift, run) if run else 0
+            netbox.stats.clear()
+            zabbix.stats.clear()
+            result = run_sync(workdir, env, config, arguments.sync_args, name)
+            result.update({
+                "name": name, "drifted_hosts": changed, "hosts": hosts,
+                "hosts_per_second": round(hosts / result["wall_seconds"], 1),
+                "zabbix_hosts": len(zabbix_data.hosts),
+                "api_calls": sum(netbox.stats.values()) + sum(zabbix.stats.values()),
+                "netbox_calls": dict(sorted(netbox.stats.items())),
+                "zabbix_calls": dict(sorted(zabbix.stats.items()))})
+            results["runs"].append(result)
+            print(f"{name}: {result['wall_seconds']}s, {result['hosts_per_second']} "
+                  f"hosts/s, {result['api_calls']} API call(s), peak RSS "
+                  f"{result['peak_rss_mb']} MiB, exit code {result['exit_code']}.")
+    netbox.stop()
+    zabbix.stop()
+    output = arguments.output or (f"benchmark-{arguments.scale}-"
+                                  f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}.")
+    if arguments.compare:
+        compare(results, arguments.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Synthetic NetBox / Zabbix inventories for the benchmark stand-ins.
+"""
+import random
+from benchmark.standins import Ref
+
+# Inventory sizes for the seed function
+SCALES = {
+    "1k": {"devices": 1000, "vms": 200, "templates": 1000, "hostgroups": 1000,
+           "sites": 50, "region_depth": 3},
+    "10k": {"devices": 10000, "vms": 2000, "templates": 2000, "hostgroups": 5000,
+            "sites": 250, "region_depth": 4},
+    "100k": {"devices": 100000, "vms": 20000, "templates": 5000, "hostgroups": 10000,
+             "sites": 1000, "region_depth": 5},
+}
+STATUSES = [("active", "Active")] * 16 + [("offline", "Offline"), ("planned", "Planned"),
+                                          ("decommissioning", "Decommissioning")]
+
+
+def _status(rng, decommission=True):
+    value, label = rng.choice(STATUSES if decommission else STATUSES[:-1])
+    return {"value": value, "label": label}
+
+
+def _tree(nb, endpoint, prefix, depth, fanout):
+    """Build a nested region / site-group tree. Names repeat across branches."""
+    leaves = []
+    level = [None]
+    for lvl in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                name = f"{prefix}-L{lvl}-{i}"
+                if parent is None:
+                    name = f"{prefix}-{i}"
+                slug = f"{name.lower()}-{len(nb.tables[endpoint])}"
+                obj = nb.add(endpoint, {"name": name, "slug": slug,
+                                        "parent": Ref(endpoint, parent) if parent else None})
+                next_level.append(obj["id"])
+        level = next_level
+    leaves.extend(level)
+    return leaves
+
+
+def seed(nb, zbx, devices=1000, vms=0, templates=100, hostgroups=100, sites=50,
+         region_depth=3, chassis_pct=5, seed_value=1):
+    """Fill the NetBox and Zabbix stand-ins with a synthetic inventory"""
+    # pylint: disable=too-many-arguments, too-many-locals, too-many-positional-arguments
+    rng = random.Random(seed_value)
+    nb.add("extras/custom-fields", {"name": "zabbix_hostid", "type": "text",
+                                    "content_type": Ref("core/object-types", 23)})
+    nb.add("extras/custom-fields", {"name": "zabbix_template", "type": "text",
+                                    "content_type": Ref("core/object-types", 24)})
+    template_names = [f"Template {i}" for i in range(templates)]
+    for name in template_names:
+        zbx.add_template(name)
+    for i in range(hostgroups):
+        zbx.add_group(f"Unrelated group {i}")
+    for i in range(3):
+        zbx.add_proxy(f"proxy-{i}")
+        zbx.add_proxy(f"proxygroup-{i}", group=True)
+    regions = _tree(nb, "dcim/regions", "Region", region_depth, 3)
+    groups = _tree(nb, "dcim/site-groups", "Group", 2, 3)
+    tenant_groups = [nb.add("tenancy/tenant-groups", {"name": f"TG{i}", "slug": f"tg{i}"})["id"]
+                     for i in range(3)]
+    tenants = [nb.add("tenancy/tenants", {"name": f"Tenant{i}", "slug": f"tenant{i}",
+                                          "group": Ref("tenancy/tenant-groups",
+                                                       rng.choice(tenant_groups))})["id"]
+               for i in range(10)]
+    site_ids = [nb.add("dcim/sites", {"name": f"Site{i}", "slug": f"site{i}",
+                                      "region": Ref("dcim/regions", rng.choice(regions)),
+                                      "group": Ref("dcim/site-groups", rng.choice(groups)),
+                                      "tenant": Ref("tenancy/tenants", rng.choice(tenants))}
+                       )["id"] for i in range(sites)]
+    manufacturers = [nb.add("dcim/manufacturers", {"name": f"Vendor{i}",
+                                                   "slug": f"vendor{i}"})["id"] for i in range(5)]
+    device_types = [nb.add("dcim/device-types", {
+        "model": f"Model{i}", "slug": f"model{i}",
+        "manufacturer": Ref("dcim/manufacturers", rng.choice(manufacturers)),
+        "custom_fields": {"zabbix_template": rng.choice(template_names)}})["id"]
+                    for i in range(20)]
+    roles = [nb.add("dcim/device-roles", {"name": f"Role{i}", "slug": f"role{i}"})["id"]
+             for i in range(8)]
+    platforms = [nb.add("dcim/platforms", {"name": f"Platform{i}", "slug": f"platform{i}"})["id"]
+                 for i in range(4)]
+    # SNMP devices of two roles, with a proxy per platform. The devices
+    # below the first top level region use a different SNMP community.
+    snmp_roles = [Ref("dcim/device-roles", role) for role in roles[:2]]
+    _context(nb, "SNMP", 1000, {"zabbix": {"interface_type": 2,
+                                           "snmp": {"version": 2, "community": "public"}}},
+             roles=snmp_roles)
+    for i, platform in enumerate(platforms):
+        _context(nb, f"SNMP proxy {i}", 1100, {"zabbix": {"proxy": f"proxy-{i % 3}"}},
+                 roles=snmp_roles, platforms=[Ref("dcim/platforms", platform)])
+    _context(nb, "SNMP community", 1200, {"zabbix": {"snmp": {"community": "region"}}},
+             roles=snmp_roles, regions=[Ref("dcim/regions", min(nb.tables["dcim/regions"]))])
+    _context(nb, "Retired", 100, {"zabbix": {"interface_type": 2}}, is_active=False)
+    for i in range(devices):
+        ip = nb.add("ipam/ip-addresses", {"address": f"10.{i // 65536}.{i // 256 % 256}."
+                                                     f"{i % 256}/16", "family": 4})
+        nb.add("dcim/devices", {
+            "name": f"device-{i}", "status": _status(rng),
+            "site": Ref("dcim/sites", rng.choice(site_ids)),
+            "role": Ref("dcim/device-roles", rng.choice(roles)),
+            "device_type": Ref("dcim/device-types", rng.choice(device_types)),
+            "tenant": Ref("tenancy/tenants", rng.choice(tenants)),
+            "platform": Ref("dcim/platforms", rng.choice(platforms)),
+            "location": None, "rack": None, "virtual_chassis": None,
+            "primary_ip": Ref("ipam/ip-addresses", ip["id"]),
+            "oob_ip": None, "asset_tag": None, "serial": f"SN{i:08d}",
+            "comments": "", "latitude": None, "longitude": None,
+            "custom_fields": {"zabbix_hostid": None}, "tags": []})
+    _chassis(nb, rng, devices * chassis_pct // 100)
+    clusters = []
+    if vms:
+        ctype = nb.add("virtualization/cluster-types", {"name": "VMware", "slug": "vmware"})
+        clusters = [nb.add("virtualization/clusters", {
+            "name": f"Cluster{i}", "type": Ref("virtualization/cluster-types", ctype["id"])})["id"]
+                    for i in range(5)]
+        # Templates of the VMs per cluster, the last cluster uses the cluster type
+        _context(nb, "VMware", 1000, {"zabbix": {"templates": [template_names[0]]}},
+                 cluster_types=[Ref("virtualization/cluster-types", ctype["id"])])
+        for cluster in clusters[:-1]:
+            _context(nb, f"Cluster {cluster}", 1000,
+                     {"zabbix": {"templates": [rng.choice(template_names)]}},
+                     clusters=[Ref("virtualization/clusters", cluster)])
+    for i in range(vms):
+        ip = nb.add("ipam/ip-addresses", {"address": f"172.16.{i // 256 % 256}.{i % 256}/16",
+                                          "family": 4})
+        nb.add("virtualization/virtual-machines", {
+            "name": f"vm-{i}", "status": _status(rng),
+            "site": Ref("dcim/sites", rng.choice(site_ids)),
+            "cluster": Ref("virtualization/clusters", rng.choice(clusters)),
+            "role": Ref("dcim/device-roles", rng.choice(roles)),
+            "tenant": Ref("tenancy/tenants", rng.choice(tenants)),
+            "platform": None, "primary_ip": Ref("ipam/ip-addresses", ip["id"]),
+            "custom_fields": {"zabbix_hostid": None}, "tags": []})
+
+
+def _context(nb, name, weight, data, is_active=True, **assigned):
+    """Add a config context which is assigned to the given objects"""
+    return nb.add("extras/config-contexts", {"name": name, "weight": weight,
+                                             "is_active": is_active, "data": data,
+                                             "tags": [], **assigned})
+
+
+def _chassis(nb, rng, count):
+    """Group pairs of devices into virtual chassis"""
+    device_ids = list(nb.tables["dcim/devices"])
+    rng.shuffle(device_ids)
+    for i in range(min(count, len(device_ids) // 2)):
+        master, member = device_ids[2 * i], device_ids[2 * i + 1]
+        chassis = nb.add("dcim/virtual-chassis", {"name": f"chassis-{i}",
+                                                  "master": Ref("dcim/devices", master)})
+        for device in (master, member):
+            nb.tables["dcim/devices"][device]["virtual_chassis"] = Ref("dcim/virtual-chassis",
+                                                                       chassis["id"])
+
+
+def drift(zbx, percentage, seed_value=2):
+    """Introduce out-of-band changes to a percentage of the Zabbix hosts"""
+    rng = random.Random(seed_value)
+    hosts = list(zbx.hosts.values())
+    changed = rng.sample(hosts, len(hosts) * percentage // 100)
+    templates = list(zbx.templates)
+    for host in changed:
+        kind = rng.choice(["status", "templates", "name", "proxy", "inventory"])
+        if kind == "status":
+            host["status"] = "1" if host["status"] == "0" else "0"
+        elif kind == "templates":
+            host["templates"] = [rng.choice(templates)]
+        elif kind == "name":
+            zbx.rename(host, host["host"] + "-renamed")
+        elif kind == "proxy":
+            host["proxyid"] = "1"
+            host["monitored_by"] = "1"
+        else:
+            host["inventory"]["serialno_a"] = "changed"
+    return len(changed)
@@ -0,0 +1,921 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name
+"""
+Lightweight local stand-ins for the NetBox REST API and the Zabbix JSON-RPC API.
+Both keep their data in memory and count every request per endpoint. Only the
+parts of the APIs which are used by the sync are implemented.
+"""
+import json
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class Ref():  # pylint: disable=too-few-public-methods
+    """Reference from one NetBox object to another"""
+    def __init__(self, endpoint, obj_id):
+        self.endpoint = endpoint
+        self.id = obj_id
+
+    def __repr__(self):
+        return f"Ref({self.endpoint}, {self.id})"
+
+
+# Fields (besides id, url and display) which NetBox includes in the
+# nested "brief" representation of an object.
+BRIEF_FIELDS = {
+    "dcim/device-types": ["manufacturer", "model", "slug"],
+    "dcim/virtual-chassis": ["name", "master"],
+    "ipam/ip-addresses": ["address", "family"],
+    "dcim/devices": ["name"],
+    "virtualization/virtual-machines": ["name"],
+}
+DEFAULT_BRIEF = ["name", "slug"]
+
+
+OBJECT_TYPES = {"virtual-machines": "virtualmachine", "device-types": "devicetype",
+                "virtual-chassis": "virtualchassis", "config-contexts": "configcontext",
+                "ip-addresses": "ipaddress", "device-roles": "devicerole"}
+
+
+def now():
+    """Current time in NetBox format"""
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+# Endpoints of which the objects have a rendered config context
+CONFIG_CONTEXT_ENDPOINTS = ("dcim/devices", "virtualization/virtual-machines")
+
+
+def deepmerge(original, new):
+    """Deep merge of two dictionaries, a port of utilities.utils.deepmerge of NetBox"""
+    merged = OrderedDict(original)
+    for key, val in new.items():
+        if key in original and isinstance(original[key], dict) and val and isinstance(val, dict):
+            merged[key] = deepmerge(original[key], val)
+        else:
+            merged[key] = val
+    return merged
+
+
+# Case insensitive text lookups of the REST API
+TEXT_LOOKUPS = {"ic": lambda value, expected: expected in value,
+                "ie": lambda value, expected: value == expected,
+                "isw": lambda value, expected: value.startswith(expected),
+                "iew": lambda value, expected: value.endswith(expected)}
+
+
+class NetBoxData():
+    """In-memory NetBox object store"""
+    def __init__(self, base_url="http://127.0.0.1", version="4.1"):
+        self.base_url = base_url
+        self.version = version
+        self.tables = defaultdict(dict)
+        self.lock = threading.RLock()
+        self.next_id = Counter()
+        # Largest page NetBox returns, like its MAX_PAGE_SIZE setting. 0 is unlimited.
+        self.max_page_size = 1000
+
+    def add(self, endpoint, obj):
+        """Add an object, assigning an ID when none is given"""
+        with self.lock:
+            if "id" not in obj:
+                self.next_id[endpoint] += 1
+                obj["id"] = self.next_id[endpoint]
+            else:
+                self.next_id[endpoint] = max(self.next_id[endpoint], obj["id"])
+            obj.setdefault("last_updated", now())
+            self.tables[endpoint][obj["id"]] = obj
+            return obj
+
+    def url(self, endpoint, obj_id=None):
+        """API URL of an endpoint or object"""
+        if obj_id is None:
+            return f"{self.base_url}/api/{endpoint}/"
+        return f"{self.base_url}/api/{endpoint}/{obj_id}/"
+
+    def resolve(self, ref):
+        """Returns the object a reference points to"""
+        return self.tables[ref.endpoint].get(ref.id)
+
+    def display(self, obj):
+        """Display value of an object"""
+        for key in ("name", "address", "model"):
+            if obj.get(key):
+                return str(obj[key])
+        return str(obj["id"])
+
+    def brief(self, ref):
+        """Nested representation of a referenced object"""
+        obj = self.resolve(ref)
+        if obj is None:
+            return None
+        out = {"id": obj["id"], "url": self.url(ref.endpoint, obj["id"]),
+               "display": self.display(obj)}
+        for field in BRIEF_FIELDS.get(ref.endpoint, DEFAULT_BRIEF):
+            if field in obj:
+                out[field] = self.render_value(obj[field], nested=True)
+        return out
+
+    def render_value(self, value, nested=False):
+        """Render a stored value for the API"""
+        if isinstance(value, Ref):
+            return self.brief(value)
+        if isinstance(value, list):
+            return [self.render_value(v, nested) for v in value]
+        if isinstance(value, dict):
+            return {k: self.render_value(v, nested) for k, v in value.items()}
+        return value
+
+    def render(self, endpoint, obj, exclude=()):
+        """Full representation of an object"""
+        out = {"id": obj["id"], "url": self.url(endpoint, obj["id"]),
+               "display": self.display(obj)}
+        for key, value in obj.items():
+            if key in exclude:
+                continue
+            out[key] = self.render_value(value)
+        if endpoint in CONFIG_CONTEXT_ENDPOINTS and "config_context" not in exclude:
+            out["config_context"] = self.config_context(obj)
+        return out
+
+    def ancestors(self, ref):
+        """IDs of a nested object, such as a region, and of all of its parents"""
+        ids = set()
+        obj = self.resolve(ref) if isinstance(ref, Ref) else None
+        while obj and obj["id"] not in ids:
+            ids.add(obj["id"])
+            parent = obj.get("parent")
+            obj = self.resolve(parent) if isinstance(parent, Ref) else None
+        return ids
+
+    def config_context(self, obj):
+        """
+        Renders the config context of a device or VM like NetBox does. All
+        active config contexts which are assigned to the object are merged
+        by weight and name, the local config context data is merged last.
+        """
+        def ids(ref):
+            return {ref.id} if isinstance(ref, Ref) else set()
+
+        def slugs(refs):
+            return {(self.resolve(ref) or {}).get("slug") for ref in refs or []
+                    if isinstance(ref, Ref)}
+        site = self.resolve(obj["site"]) if isinstance(obj.get("site"), Ref) else {}
+        tenant = self.resolve(obj["tenant"]) if isinstance(obj.get("tenant"), Ref) else {}
+        cluster = self.resolve(obj["cluster"]) if isinstance(obj.get("cluster"), Ref) else {}
+        values = {"regions": self.ancestors(site.get("region")),
+                  "site_groups": self.ancestors(site.get("group")),
+                  "sites": ids(obj.get("site")),
+                  "locations": self.ancestors(obj.get("location")),
+                  "device_types": ids(obj.get("device_type")),
+                  "roles": ids(obj.get("role")),
+                  "platforms": ids(obj.get("platform")),
+                  "cluster_types": ids(cluster.get("type")),
+                  "cluster_groups": ids(cluster.get("group")),
+                  "clusters": ids(obj.get("cluster")),
+                  "tenant_groups": self.ancestors(tenant.get("group")),
+                  "tenants": ids(obj.get("tenant")),
+                  "tags": slugs(obj.get("tags"))}
+        with self.lock:
+            contexts = list(self.tables["extras/config-contexts"].values())
+        data = {}
+        for context in sorted(contexts, key=lambda c: (c.get("weight", 1000), c["name"])):
+            # A criterion without assigned objects applies to all objects
+            if context.get("is_active", True) and all(
+                    (slugs(assigned) if criterion == "tags" else
+                     {ref.id for ref in assigned}) & values[criterion]
+                    for criterion, assigned in context.items()
+                    if criterion in values and assigned):
+                data = deepmerge(data, context.get("data") or {})
+        if obj.get("local_context_data"):
+            data = deepmerge(data, obj["local_context_data"])
+        return data
+
+    def matches(self, obj, key, values):
+        """Check a single query filter against an object"""
+        # pylint: disable=too-many-return-statements, too-many-branches
+        if key == "time_after":
+            key = "time__gte"
+        negate = key.endswith("__n")
+        key = key.removesuffix("__n")
+        field, _, lookup = key.partition("__")
+        # Text lookups such as name__ic and their negation name__nic
+        if lookup.removeprefix("n") in TEXT_LOOKUPS and isinstance(obj.get(field), str):
+            hit = any(TEXT_LOOKUPS[lookup.removeprefix("n")](obj[field].lower(), value.lower())
+                      for value in values)
+            return hit != lookup.startswith("n")
+        if key.endswith(("__gte", "__gt", "__lte", "__lt")):
+            field, op = key.rsplit("__", 1)
+            current = obj.get(field)
+            if current is None:
+                return False
+            value = values[0]
+            return {"gte": current >= value, "gt": current > value,
+                    "lte": current <= value, "lt": current < value}[op]
+        field = key[:-3] if key.endswith("_id") and key != "id" else key
+        current = obj.get(field)
+        if field == "id" or key.endswith("_id"):
+            wanted = {int(v) for v in values if v.isdigit()}
+            if isinstance(current, list):
+                hit = any(isinstance(c, Ref) and c.id in wanted for c in current)
+            elif isinstance(current, Ref):
+                hit = current.id in wanted
+            else:
+                hit = current in wanted
+            return hit != negate
+        if "null" in values and negate:
+            return current not in (None, "")
+        if field not in obj:
+            # Unknown filters are ignored, just like NetBox ignores
+            # filters it does not know about.
+            return True
+        candidates = set()
+        for item in current if isinstance(current, list) else [current]:
+            if isinstance(item, Ref):
+                ref_obj = self.resolve(item) or {}
+                candidates.update(str(ref_obj.get(k)) for k in ("slug", "name"))
+            elif isinstance(item, dict):
+                candidates.update(str(item.get(k)) for k in ("value", "label"))
+            else:
+                candidates.add(str(item))
+        hit = bool(candidates.intersection(values))
+        return hit != negate
+
+    def query(self, endpoint, params):
+        """Returns all objects from an endpoint matching the query"""
+        skip = {"limit", "offset", "exclude", "brief", "ordering", "format"}
+        with self.lock:
+            if "id" in params:
+                # Avoid a full table scan for the bulk lookups of related objects
+                table = self.tables[endpoint]
+                ids = {int(v) for v in params["id"] if v.isdigit()}
+                objects = [table[obj_id] for obj_id in ids if obj_id in table]
+            else:
+                objects = list(self.tables[endpoint].values())
+        for key, values in params.items():
+            if key in skip or key == "id":
+                continue
+            objects = [o for o in objects if self.matches(o, key, values)]
+        return sorted(objects, key=lambda o: o["id"])
+
+    def update(self, endpoint, obj_id, data):
+        """Partial update of an object"""
+        with self.lock:
+            obj = self.tables[endpoint].get(obj_id)
+            if obj is None:
+                return None
+            for key, value in data.items():
+                if key == "custom_fields":
+                    obj.setdefault("custom_fields", {}).update(value)
+                else:
+                    obj[key] = value
+            obj["last_updated"] = now()
+            self.log_change(endpoint, obj_id)
+            return obj
+
+    def log_change(self, endpoint, obj_id):
+        """Record an object change in the changelog"""
+        app, name = endpoint.split("/")
+        obj_type = f"{app}.{OBJECT_TYPES.get(name, name.rstrip('s').replace('-', ''))}"
+        self.add("core/object-changes", {"time": now(), "action": {"value": "update"},
+                                         "changed_object_type": obj_type,
+                                         "changed_object_id": obj_id})
+
+
+# GraphQL list queries and the endpoint they read from
+GRAPHQL_LISTS = {"device_list": "dcim/devices",
+                 "virtual_machine_list": "virtualization/virtual-machines"}
+GRAPHQL_TOKEN = re.compile(r'"[^"]*"|[{}()\[\]:,]|[\w.-]+')
+# Fields which are returned as a single JSON value
+GRAPHQL_SCALARS = ("custom_fields", "config_context", "local_context_data")
+# Lookups of NetBox 4.3 GraphQL filters
+GRAPHQL_LOOKUPS = {
+    "exact": lambda value, expected: value == expected,
+    "in_list": lambda value, expected: value in [str(item) for item in expected],
+    "i_exact": lambda value, expected: value.lower() == expected.lower(),
+    "i_contains": lambda value, expected: expected.lower() in value.lower(),
+    "i_starts_with": lambda value, expected: value.lower().startswith(expected.lower()),
+    "i_ends_with": lambda value, expected: value.lower().endswith(expected.lower()),
+    "regex": lambda value, expected: re.search(expected, value) is not None,
+    "i_regex": lambda value, expected: re.search(expected, value, re.I) is not None}
+
+
+class GraphQLError(Exception):
+    """Invalid GraphQL query"""
+
+
+class GraphQL():
+    """
+    Resolves the small subset of NetBox GraphQL used by the sync:
+    list queries with filters, pagination and nested selections.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.tokens = []
+        self.pos = 0
+
+    def next(self, expected=None):
+        """Returns the next token"""
+        token = self.tokens[self.pos]
+        self.pos += 1
+        if expected and token != expected:
+            raise GraphQLError(f"Expected {expected}, got {token}")
+        return token
+
+    def peek(self):
+        """Returns the next token without consuming it"""
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def value(self):
+        """Parses an argument value"""
+        token = self.next()
+        if token == "{":
+            obj = {}
+            while self.peek() != "}":
+                key = self.next()
+                self.next(":")
+                obj[key] = self.value()
+                if self.peek() == ",":
+                    self.next()
+            self.next("}")
+            return obj
+        if token == "[":
+            items = []
+            while self.peek() != "]":
+                items.append(self.value())
+                if self.peek() == ",":
+                    self.next()
+            self.next("]")
+            return items
+        if token.startswith('"'):
+            return token[1:-1]
+        return int(token) if token.isdigit() else token
+
+    def selection(self):
+        """Parses a selection set into a list of (name, arguments, selection)"""
+        self.next("{")
+        fields = []
+        while self.peek() != "}":
+            name, args, sub = self.next(), {}, None
+            if self.peek() == "(":
+                self.next()
+                while self.peek() != ")":
+                    key = self.next()
+                    self.next(":")
+                    args[key] = self.value()
+                    if self.peek() == ",":
+                        self.next()
+                self.next(")")
+            if self.peek() == "{":
+                sub = self.selection()
+            fields.append((name, args, sub))
+        self.next("}")
+        return fields
+
+    def resolve(self, obj, selection):
+        """Resolves a selection set for a single object"""
+        out = {}
+        for name, _, sub in selection:
+            if name == "id":
+                out[name] = str(obj["id"])
+                continue
+            if name in ("primary_ip4", "primary_ip6"):
+                value = obj.get("primary_ip")
+                target = self.data.resolve(value) if isinstance(value, Ref) else None
+                if target and f"ip{target['family']}" != name[-3:]:
+                    target = None
+                out[name] = self.resolve(target, sub) if target else None
+                continue
+            if name == "config_context":
+                out[name] = self.data.config_context(obj)
+                continue
+            if name not in obj:
+                raise GraphQLError(f"Cannot query field '{name}'.")
+            value = obj[name]
+            if name == "status" and isinstance(value, dict):
+                out[name] = value["value"]
+            elif name in GRAPHQL_SCALARS or not sub:
+                out[name] = value if not isinstance(value, Ref) else str(value.id)
+            elif isinstance(value, Ref):
+                target = self.data.resolve(value)
+                out[name] = self.resolve(target, sub) if target else None
+            else:
+                out[name] = None
+        return out
+
+    def filter_match(self, obj, filters):
+        """
+        Checks the filter of a list query against an object. Lookup based
+        filters are used by NetBox 4.3 and newer, older versions use the
+        names of the REST filters.
+        """
+        for key, value in filters.items():
+            if key == "NOT":
+                if self.filter_match(obj, value):
+                    return False
+            elif isinstance(value, dict):
+                if not self.lookup_match(obj.get(key), value):
+                    return False
+            elif not self.data.matches(obj, key, [str(item) for item in (
+                    value if isinstance(value, list) else [value])]):
+                return False
+        return True
+
+    def lookup_match(self, current, lookups):
+        """Checks the lookups of a NetBox 4.3 filter against a field value"""
+        for lookup, expected in lookups.items():
+            if lookup not in GRAPHQL_LOOKUPS:
+                # Lookups on a related object
+                refs = current if isinstance(current, list) else [current]
+                related = [self.data.resolve(ref) for ref in refs if isinstance(ref, Ref)]
+                if not any(obj and self.lookup_match(obj.get(lookup), expected)
+                           for obj in related):
+                    return False
+            elif current is None or not GRAPHQL_LOOKUPS[lookup](str(current), expected):
+                return False
+        return True
+
+    def execute(self, query):
+        """Executes a query and returns the GraphQL response"""
+        self.tokens = GRAPHQL_TOKEN.findall(query)
+        self.pos = 0
+        try:
+            if self.peek() == "query":
+                self.next()
+            result = {}
+            for name, args, sub in self.selection():
+                if name not in GRAPHQL_LISTS:
+                    raise GraphQLError(f"Cannot query field '{name}'.")
+                with self.data.lock:
+                    objects = sorted(self.data.tables[GRAPHQL_LISTS[name]].values(),
+                                     key=lambda o: o["id"])
+                filters = args.get("filters", {})
+                objects = [o for o in objects if self.filter_match(o, filters)]
+                pagination = args.get("pagination", {})
+                offset = pagination.get("offset", 0)
+                limit = pagination.get("limit") or len(objects)
+                # Pages are limited like the REST API, so the loaders can not
+                # rely on getting the number of objects they asked for
+                if self.data.max_page_size:
+                    limit = min(limit, self.data.max_page_size)
+                result[name] = [self.resolve(o, sub) for o in objects[offset:offset + limit]]
+            return {"data": result}
+        except (GraphQLError, IndexError) as e:
+            return {"data": None, "errors": [{"message": str(e)}]}
+
+
+class NetBoxHandler(BaseHTTPRequestHandler):
+    """Request handler for the NetBox stand-in"""
+    server_version = "NetBoxStandin/1.0"
+    data = None
+    stats = Counter()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        return
+
+    def _send(self, status, body=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("API-Version", self.data.version)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        path = parts.path.strip("/").split("/")
+        params = parse_qs(parts.query, keep_blank_values=True)
+        if path[0] == "api":
+            path = path[1:]
+        endpoint, obj_id = None, None
+        if len(path) >= 2:
+            endpoint = f"{path[0]}/{path[1]}"
+        if len(path) >= 3 and path[2].isdigit():
+            obj_id = int(path[2])
+        return endpoint, obj_id, params, path
+
+    def _count(self, endpoint, obj_id):
+        kind = "detail" if obj_id is not None else "list"
+        with self.data.lock:
+            self.stats[f"{self.command} {endpoint or '/'} ({kind})"] += 1
+
+    def do_GET(self):
+        """Handle GET requests"""
+        endpoint, obj_id, params, path = self._route()
+        self._count(endpoint, obj_id)
+        if not path or path == [""]:
+            return self._send(200, {})
+        if path == ["status"]:
+            return self._send(200, {"netbox-version": self.data.version})
+        exclude = params.get("exclude", [""])[0].split(",")
+        if obj_id is not None:
+            obj = self.data.tables[endpoint].get(obj_id)
+            if obj is None:
+                return self._send(404, {"detail": "Not found."})
+            return self._send(200, self.data.render(endpoint, obj, exclude))
+        objects = self.data.query(endpoint, params)
+        limit = int(params.get("limit", ["50"])[0] or 50)
+        offset = int(params.get("offset", ["0"])[0] or 0)
+        if self.data.max_page_size:
+            limit = min(limit or self.data.max_page_size, self.data.max_page_size)
+        limit = len(objects) if limit == 0 else limit
+        page = objects[offset:offset + limit]
+        next_url = None
+        if offset + limit < len(objects):
+            query = {k: v for k, v in params.items() if k not in ("limit", "offset")}
+            query_str = "&".join(f"{k}={v}" for k, vs in query.items() for v in vs)
+            next_url = (f"{self.data.url(endpoint)}?{query_str}&limit={limit}"
+                        f"&offset={offset + limit}")
+        return self._send(200, {"count": len(objects), "next": next_url,
+                                "previous": None,
+                                "results": [self.data.render(endpoint, o, exclude)
+                                            for o in page]})
+
+    def do_PATCH(self):
+        """Handle single and bulk PATCH requests"""
+        endpoint, obj_id, _, _ = self._route()
+        self._count(endpoint, obj_id)
+        body = self._body()
+        if obj_id is not None:
+            obj = self.data.update(endpoint, obj_id, body)
+            if obj is None:
+                return self._send(404, {"detail": "Not found."})
+            return self._send(200, self.data.render(endpoint, obj))
+        results = []
+        for item in body:
+            obj = self.data.update(endpoint, item.pop("id"), item)
+            if obj is None:
+                return self._send(400, {"detail": "Object not found."})
+            results.append(self.data.render(endpoint, obj))
+        return self._send(200, results)
+
+    def do_POST(self):
+        """Handle single and bulk object creation"""
+        endpoint, obj_id, _, path = self._route()
+        if path == ["graphql"]:
+            with self.data.lock:
+                self.stats["POST graphql"] += 1
+            return self._send(200, GraphQL(self.data).execute(self._body()["query"]))
+        self._count(endpoint, obj_id)
+        body = self._body()
+        items = body if isinstance(body, list) else [body]
+        created = [self.data.render(endpoint, self.data.add(endpoint, dict(item)))
+                   for item in items]
+        return self._send(201, created if isinstance(body, list) else created[0])
+
+
+class ZabbixData():
+    """In-memory Zabbix object store"""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, version="7.0.0"):
+        self.version = version
+        self.lock = threading.RLock()
+        self.hosts = {}
+        self.groups = {}
+        self.templates = {}
+        self.proxies = {}
+        self.proxygroups = {}
+        # Indexes to keep lookups fast with large inventories
+        self.names = {}
+        self.interfaces = {}
+        self.ids = Counter()
+
+    def new_id(self, kind):
+        """Generate a new object ID"""
+        self.ids[kind] += 1
+        return str(self.ids[kind])
+
+    def add_group(self, name):
+        """Add a hostgroup"""
+        groupid = self.new_id("group")
+        self.groups[groupid] = {"groupid": groupid, "name": name}
+        return groupid
+
+    def add_template(self, name):
+        """Add a template"""
+        templateid = self.new_id("template")
+        self.templates[templateid] = {"templateid": templateid, "name": name}
+        return templateid
+
+    def rename(self, host, name):
+        """Changes the technical name of a host"""
+        if self.names.get(host["host"]) == host["hostid"]:
+            del self.names[host["host"]]
+        host["host"] = name
+        self.names[name] = host["hostid"]
+
+    def add_proxy(self, name, group=False):
+        """Add a proxy or proxy group"""
+        if group:
+            proxyid = self.new_id("proxygroup")
+            self.proxygroups[proxyid] = {"proxy_groupid": proxyid, "name": name}
+        else:
+            proxyid = self.new_id("proxy")
+            self.proxies[proxyid] = {"proxyid": proxyid, "name": name}
+        return proxyid
+
+
+class ZabbixError(Exception):
+    """Error returned as a JSON-RPC error object"""
+
+
+def _ids(items, key):
+    """Converts a list of objects / IDs into a list of IDs"""
+    if isinstance(items, dict):
+        items = [items]
+    return [str(i[key]) if isinstance(i, dict) else str(i) for i in items or []]
+
+
+def _select(obj, fields):
+    """Mimic the Zabbix output parameter"""
+    if fields in (None, "extend"):
+        return dict(obj)
+    return {k: v for k, v in obj.items() if k in fields}
+
+
+class ZabbixAPIStandin():
+    """Implementation of the Zabbix API methods used by the sync"""
+    HOST_FIELDS = ("hostid", "host", "name", "status", "description", "inventory_mode",
+                   "proxyid", "proxy_groupid", "monitored_by")
+
+    def __init__(self, data):
+        self.data = data
+
+    def call(self, method, params):
+        """Dispatch a JSON-RPC method"""
+        func = getattr(self, method.replace(".", "_"), None)
+        if func is None:
+            raise ZabbixError(f"Incorrect method \"{method}\".")
+        with self.data.lock:
+            return func(params)
+
+    def apiinfo_version(self, _):
+        """apiinfo.version"""
+        return self.data.version
+
+    def user_checkAuthentication(self, _):
+        """user.checkAuthentication"""
+        return {"userid": "1"}
+
+    def user_login(self, _):
+        """user.login"""
+        return "standin-session"
+
+    def user_logout(self, _):
+        """user.logout"""
+        return True
+
+    def hostgroup_get(self, params):
+        """hostgroup.get"""
+        groups = list(self.data.groups.values())
+        names = (params.get("filter") or {}).get("name")
+        if names is not None:
+            names = names if isinstance(names, list) else [names]
+            groups = [g for g in groups if g["name"] in names]
+        return [_select(g, params.get("output")) for g in groups]
+
+    def hostgroup_create(self, params):
+        """hostgroup.create"""
+        items = params if isinstance(params, list) else [params]
+        existing = {g["name"] for g in self.data.groups.values()}
+        for item in items:
+            if item["name"] in existing:
+                raise ZabbixError(f"Host group \"{item['name']}\" already exists.")
+        return {"groupids": [self.data.add_group(i["name"]) for i in items]}
+
+    def template_get(self, params):
+        """template.get"""
+        return [_select(t, params.get("output")) for t in self.data.templates.values()]
+
+    def proxy_get(self, params):
+        """proxy.get"""
+        return [_select(p, params.get("output")) for p in self.data.proxies.values()]
+
+    def proxygroup_get(self, params):
+        """proxygroup.get"""
+        return [_select(p, params.get("output")) for p in self.data.proxygroups.values()]
+
+    def _render_host(self, host, params):
+        out = _select({k: host[k] for k in self.HOST_FIELDS}, params.get("output"))
+        if "selectInterfaces" in params:
+            out["interfaces"] = [_select(i, params["selectInterfaces"])
+                                 for i in host["interfaces"]]
+        for key, name in (("selectGroups", "groups"), ("selectHostGroups", "hostgroups")):
+            if key in params:
+                out[name] = [{"groupid": g} for g in host["groups"]]
+        if "selectParentTemplates" in params:
+            out["parentTemplates"] = [_select(self.data.templates[t],
+                                              params["selectParentTemplates"])
+                                      for t in host["templates"]]
+        if "selectInventory" in params:
+            inv = host["inventory"]
+            if host["inventory_mode"] == "-1":
+                out["inventory"] = []
+            else:
+                out["inventory"] = {k: inv.get(k, "") for k in params["selectInventory"]}
+        return out
+
+    def host_get(self, params):
+        """host.get"""
+        hosts = self.data.hosts
+        host_filter = dict(params.get("filter") or {})
+        if "host" in host_filter:
+            names = host_filter.pop("host")
+            names = names if isinstance(names, list) else [names]
+            hosts = {self.data.names[name]: self.data.hosts[self.data.names[name]]
+                     for name in names if name in self.data.names}
+        if "hostids" in params:
+            ids = set(_ids(params["hostids"], "hostid"))
+            hosts = {i: hosts[i] for i in ids if i in hosts}
+        hosts = list(hosts.values())
+        for key, values in host_filter.items():
+            values = {str(v) for v in (values if isinstance(values, list) else [values])}
+            hosts = [h for h in hosts if str(h.get(key)) in values]
+        return [self._render_host(h, params) for h in hosts]
+
+    def _apply(self, host, params):
+        """Apply host properties to a host"""
+        if "host" in params:
+            self.data.rename(host, str(params["host"]))
+        for key in ("name", "description", "proxyid", "proxy_groupid"):
+            if key in params:
+                host[key] = str(params[key])
+        for key in ("status", "inventory_mode", "monitored_by"):
+            if key in params:
+                host[key] = str(params[key])
+        if "groups" in params:
+            host["groups"] = _ids(params["groups"], "groupid")
+        if "templates_clear" in params:
+            clear = set(_ids(params["templates_clear"], "templateid"))
+            host["templates"] = [t for t in host["templates"] if t not in clear]
+        if "templates" in params:
+            host["templates"] = _ids(params["templates"], "templateid")
+        if "inventory" in params and params["inventory"]:
+            host["inventory"].update(params["inventory"])
+        if not host["name"]:
+            host["name"] = host["host"]
+
+    def _check_unique(self, params, hostid=None):
+        if "host" not in params:
+            return
+        other = self.data.names.get(params["host"])
+        if other is not None and other != hostid:
+            raise ZabbixError(f"Host with the same name \"{params['host']}\""
+                                  " already exists.")
+
+    def host_create(self, params):
+        """host.create"""
+        items = params if isinstance(params, list) else [params]
+        seen = set()
+        for item in items:
+            self._check_unique(item)
+            if item["host"] in seen:
+                raise ZabbixError(f"Host with the same name \"{item['host']}\""
+                                  " already exists.")
+            seen.add(item["host"])
+            for group in _ids(item.get("groups"), "groupid"):
+                if group not in self.data.groups:
+                    raise ZabbixError("No permissions to referred object or it"
+                                      " does not exist!")
+        hostids = []
+        for item in items:
+            hostid = self.data.new_id("host")
+            host = {"hostid": hostid, "host": item["host"], "name": "", "status": "0",
+                    "description": "", "inventory_mode": "-1", "proxyid": "0",
+                    "proxy_groupid": "0", "monitored_by": "0", "groups": [],
+                    "templates": [], "inventory": {}, "interfaces": []}
+            self._apply(host, item)
+            for interface in item.get("interfaces", []):
+                iface = {k: str(v) for k, v in interface.items() if k != "details"}
+                iface["details"] = dict(interface.get("details") or {}) or []
+                iface["interfaceid"] = self.data.new_id("interface")
+                host["interfaces"].append(iface)
+                self.data.interfaces[iface["interfaceid"]] = iface
+            self.data.hosts[hostid] = host
+            hostids.append(hostid)
+        return {"hostids": hostids}
+
+    def host_update(self, params):
+        """host.update"""
+        items = params if isinstance(params, list) else [params]
+        for item in items:
+            if str(item.get("hostid")) not in self.data.hosts:
+                raise ZabbixError("No permissions to referred object or it does not exist!")
+            self._check_unique(item, str(item["hostid"]))
+        for item in items:
+            self._apply(self.data.hosts[str(item["hostid"])], item)
+        return {"hostids": [str(i["hostid"]) for i in items]}
+
+    def host_massupdate(self, params):
+        """host.massupdate"""
+        hostids = _ids(params.get("hosts"), "hostid")
+        for hostid in hostids:
+            if hostid not in self.data.hosts:
+                raise ZabbixError("No permissions to referred object or it does not exist!")
+        changes = {k: v for k, v in params.items() if k != "hosts"}
+        for hostid in hostids:
+            self._apply(self.data.hosts[hostid], changes)
+        return {"hostids": hostids}
+
+    def host_delete(self, params):
+        """host.delete"""
+        hostids = _ids(params, "hostid")
+        for hostid in hostids:
+            if hostid not in self.data.hosts:
+                raise ZabbixError("No permissions to referred object or it does not exist!")
+        for hostid in hostids:
+            host = self.data.hosts.pop(hostid)
+            self.data.names.pop(host["host"], None)
+            for interface in host["interfaces"]:
+                self.data.interfaces.pop(interface["interfaceid"], None)
+        return {"hostids": hostids}
+
+    def hostinterface_update(self, params):
+        """hostinterface.update"""
+        items = params if isinstance(params, list) else [params]
+        for item in items:
+            interface = self.data.interfaces[str(item["interfaceid"])]
+            for key, value in item.items():
+                if key == "details":
+                    if not isinstance(interface["details"], dict):
+                        interface["details"] = {}
+                    interface["details"].update({k: str(v) for k, v in value.items()})
+                elif key != "interfaceid":
+                    interface[key] = str(value)
+        return {"interfaceids": [str(i["interfaceid"]) for i in items]}
+
+
+class ZabbixHandler(BaseHTTPRequestHandler):
+    """Request handler for the Zabbix stand-in"""
+    server_version = "ZabbixStandin/1.0"
+    api = None
+    stats = Counter()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        return
+
+    def do_POST(self):
+        """Handle a JSON-RPC request"""
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length))
+        with self.api.data.lock:
+            self.stats[request["method"]] += 1
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            response["result"] = self.api.call(request["method"], request.get("params"))
+        except (ZabbixError, KeyError, TypeError, ValueError) as e:
+            response["error"] = {"code": -32602, "message": "Invalid params.",
+                                 "data": str(e)}
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class Standin():
+    """Runs a stand-in HTTP server in a background thread"""
+    def __init__(self, handler, **attrs):
+        self.stats = Counter()
+        handler_cls = type(handler.__name__, (handler,), dict(attrs, stats=self.stats))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        """Base URL of the server"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Start serving requests"""
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def netbox_standin(data):
+    """Create a NetBox stand-in server for the given data"""
+    server = Standin(NetBoxHandler, data=data)
+    data.base_url = server.url
+    return server
+
+
+def zabbix_standin(data):
+    """Create a Zabbix stand-in server for the given data"""
+    return Standin(ZabbixHandler, api=ZabbixAPIStandin(data))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Runs a single sync in a separate process so that the wall time and peak
+memory usage of the sync are measured without the stand-in servers.
+The run is described by a JSON file with the config overrides, the
+command line arguments and the path where the result is written.
+"""
+import json
+import resource
+import runpy
+import sys
+import types
+from os import path
+from time import perf_counter
+
+REPO = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def load_config(overrides):
+    """Loads config.py.example with overrides as the config module"""
+    config = types.ModuleType("config")
+    with open(path.join(REPO, "config.py.example"), encoding="utf-8") as file:
+        exec(compile(file.read(), "config.py", "exec"), config.__dict__)  # pylint: disable=exec-used
+    config.__dict__.update(overrides)
+    sys.modules["config"] = config
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def main(spec_file):
+    """Runs the sync described in the spec file"""
+    with open(spec_file, encoding="utf-8") as file:
+        spec = json.load(file)
+    load_config(spec["config"])
+    sys.path.insert(0, REPO)
+    sys.argv = ["netbox_zabbix_sync.py"] + spec["args"]
+    exit_code = 0
+    start = perf_counter()
+    try:
+        runpy.run_path(path.join(REPO, "netbox_zabbix_sync.py"), run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    wall = perf_counter() - start
+    with open(spec["result"], "w", encoding="utf-8") as file:
+        json.dump({"wall_seconds": round(wall, 3), "peak_rss_mb": peak_rss_mb(),
+                   "exit_code": exit_code}, file)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, too-many-instance-attributes, duplicate-code
+"""
+Asynchronous sync engine. All NetBox and Zabbix read requests are sent
+using asynchronous HTTP clients so that many requests can be in flight
+at the same time. The per host decisions are made by the regular sync
+functions which run in worker threads and reach Zabbix through the same
+asynchronous client.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from os import sys
+import aiohttp
+from zabbix_utils import AsyncZabbixAPI, APIRequestError, ProcessingError
+from modules.bulk import (HostCleanupBatch, HostCreateBatch, HostUpdateBatch,
+                          HostnameIndex, host_get_parameters)
+from modules.context import SyncContext
+from modules.exceptions import SyncExternalError
+from modules.config_context import ConfigContexts, without_config_context
+from modules.incremental import IncrementalSync, DEVICE, VM
+from modules.inventory import InventoryMap
+from modules.fingerprint import linked_hostids
+from modules.metrics import Metrics, netbox_endpoint_name
+from modules.prefetch import DEVICE_RELATIONS, VM_RELATIONS
+from modules.tools import chunks, convert_recordset, proxy_prepper
+from modules.options import apply_defaults
+try:
+    apply_defaults()
+    from config import (
+        nb_device_filter, nb_vm_filter,
+        sync_vms,
+        inventory_sync,
+        inventory_map,
+        zabbix_chunk_size,
+        zabbix_create_chunk_size,
+        device_cf,
+        netbox_page_size,
+        local_config_context
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+           "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(0)
+
+# Number of worker threads for the hosts when --workers is not set. The
+# Zabbix and NetBox requests of the hosts are sent by the event loop, so
+# the hosts can be processed by more threads than the threaded sync uses.
+DEFAULT_WORKERS = 8
+
+
+def query_parameters(filters):
+    """
+    Converts a NetBox filter dictionary to a list of query parameters.
+    List values are converted to a parameter per value.
+    """
+    params = []
+    for key, value in filters.items():
+        for item in value if isinstance(value, (list, tuple, set)) else [value]:
+            params.append((key, str(item)))
+    return params
+
+
+class AsyncNetBox():
+    """
+    Minimal asynchronous NetBox REST client.
+    INPUT: aiohttp session, pynetbox API class, semaphore, page size and Metrics class
+    """
+
+    def __init__(self, session, netbox, semaphore, page_size, metrics):
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.session = session
+        self.metrics = metrics
+        self.url = netbox.base_url.rstrip("/")
+        self.headers = {"Accept": "application/json"}
+        if netbox.token:
+            self.headers["Authorization"] = f"Token {netbox.token}"
+        self.semaphore = semaphore
+        self.page_size = page_size
+
+    async def get(self, path, params=None):
+        """GET request to the NetBox API. Returns the JSON body and the headers."""
+        async with self.semaphore:
+            return await self.metrics.measure_async(
+                "netbox", f"GET {netbox_endpoint_name(path)}",
+                self.request(path, params))
+
+    async def request(self, path, params=None):
+        """Sends a GET request and returns the JSON body and the headers"""
+        async with self.session.get(f"{self.url}/{path}", params=params,
+                                    headers=self.headers) as resp:
+            if resp.status >= 400:
+                raise SyncExternalError(f"NetBox returned HTTP {resp.status} "
+                                        f"for {path}: {await resp.text()}")
+            return await resp.json(), resp.headers
+
+    async def version(self):
+        """Returns the NetBox API version"""
+        _, headers = await self.get("")
+        return headers.get("API-Version", "")
+
+    async def all(self, endpoint, filters=None):
+        """
+        Gets all objects from a NetBox endpoint.
+        The first page returns the total count after which
+        all other pages are requested at the same time.
+        NetBox limits the page size to its MAX_PAGE_SIZE, so the
+        other pages use the size of the first page which is returned.
+        """
+        params = query_parameters(filters or {})
+        first, _ = await self.get(f"{endpoint}/", params + [("limit", self.page_size),
+                                                             ("offset", 0)])
+        results = list(first["results"])
+        page_size = len(results)
+        if page_size and first["count"] > page_size:
+            pages = await asyncio.gather(*[
+                self.get(f"{endpoint}/", params + [("limit", page_size),
+                                                   ("offset", offset)])
+                for offset in range(page_size, first["count"], page_size)])
+            for page, _ in pages:
+                results.extend(page["results"])
+        return results
+
+    async def by_id(self, endpoint, ids):
+        """Gets NetBox objects by ID. Returns a dictionary with the ID as key."""
+        objects = {}
+        pages = await asyncio.gather(*[
+            self.get(f"{endpoint}/", [("id", i) for i in chunk] + [("limit", len(chunk))])
+            for chunk in chunks(sorted(ids), 100)])
+        for page, _ in pages:
+            for obj in page["results"]:
+                objects[obj["id"]] = obj
+        return objects
+
+    async def expand(self, objects, relations):
+        """
+        Replaces the nested representation of related objects with the
+        full object. This prevents pynetbox from requesting every related
+        object separately when attributes such as site.region are used.
+        """
+        for field, endpoint in relations.items():
+            ids = {obj[field]["id"] for obj in objects if isinstance(obj.get(field), dict)}
+            if not ids:
+                continue
+            related = await self.by_id(endpoint, ids)
+            for obj in objects:
+                if isinstance(obj.get(field), dict) and obj[field]["id"] in related:
+                    obj[field] = related[obj[field]["id"]]
+
+
+class BlockingZabbixAPI():
+    """
+    Synchronous facade for the asynchronous Zabbix client.
+    Used by code running in worker threads, API calls are
+    executed on the event loop of the async engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @property
+    def version(self):
+        """Zabbix API version"""
+        return self.engine.zabbix.version
+
+    def __getattr__(self, name):
+        return BlockingAPIObject(name, self.engine)
+
+
+class BlockingAPIObject():
+    """Zabbix API object of the BlockingZabbixAPI facade"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+
+    def __getattr__(self, method):
+        def func(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(
+                self.engine.zabbix_call(self.name, method, *args, **kwargs),
+                self.engine.loop)
+            return future.result()
+        return func
+
+
+class AsyncSyncEngine():
+    """
+    Runs the sync using asynchronous NetBox and Zabbix clients.
+    INPUT: pynetbox API class, SSL context, maximum number of requests
+    in flight, number of worker threads (DEFAULT_WORKERS when not set),
+    logger and Metrics class.
+    """
+
+    def __init__(self, netbox, ssl_context, request_limit, workers=None, logger=None,
+                 metrics=None):
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.netbox = netbox
+        self.ssl_context = ssl_context
+        self.request_limit = max(1, request_limit)
+        self.workers = max(1, workers if workers else DEFAULT_WORKERS)
+        self.logger = logger if logger else getLogger(__name__)
+        self.metrics = metrics if metrics else Metrics(self.logger)
+        self.semaphore = None
+        self.zabbix = None
+        self.zabbix_session = None
+        self.loop = None
+
+    async def zabbix_call(self, obj, method, *args, **kwargs):
+        """Executes a Zabbix API call while respecting the request limit"""
+        async with self.semaphore:
+            return await self.metrics.measure_async(
+                "zabbix", f"{obj}.{method}",
+                getattr(getattr(self.zabbix, obj), method)(*args, **kwargs))
+
+    async def timed(self, phase, coroutine):
+        """Measures the duration of a phase of the sync"""
+        with self.metrics.phase(phase):
+            return await coroutine
+
+    async def connect_zabbix(self, url, token=None, user=None, password=None):
+        """Connect to the Zabbix API"""
+        # Zabbix uses its own session with the configured SSL context, which
+        # is also used by the blocking request that checks the Zabbix version.
+        self.zabbix_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+            ssl=self.ssl_context, limit=self.request_limit))
+        self.zabbix = await asyncio.to_thread(AsyncZabbixAPI, url,
+                                              client_session=self.zabbix_session)
+        if token:
+            await self.zabbix.login(token=token)
+        else:
+            await self.zabbix.login(user=user, password=password)
+
+    async def get_zabbix_data(self):
+        """Gets all hostgroups, templates and proxies from Zabbix"""
+        version_7 = str(self.zabbix.version).startswith('7')
+        proxy_name = "name" if version_7 else "host"
+        requests = [self.zabbix_call("hostgroup", "get", output=['groupid', 'name']),
+                    self.zabbix_call("template", "get", output=['templateid', 'name']),
+                    self.zabbix_call("proxy", "get", output=['proxyid', proxy_name])]
+        if version_7:
+            requests.append(self.zabbix_call("proxygroup", "get",
+                                             output=["proxy_groupid", "name"]))
+        results = await asyncio.gather(*requests)
+        groups, templates, proxies = results[:3]
+        proxygroups = results[3] if version_7 else []
+        # Sanitize proxy data
+        if proxy_name == "host":
+            for proxy in proxies:
+                proxy['name'] = proxy.pop('host')
+        return groups, templates, proxy_prepper(proxies, proxygroups)
+
+    async def get_zabbix_hosts(self, hostids):
+        """Gets the Zabbix data of all linked hosts using concurrent chunked calls"""
+        hostids = sorted({str(hostid) for hostid in hostids if hostid})
+        parameters = host_get_parameters(inventory_map.values())
+        pages = await asyncio.gather(*[
+            self.zabbix_call("host", "get", hostids=chunk, **parameters)
+            for chunk in chunks(hostids, zabbix_chunk_size)])
+        return {str(host["hostid"]): host for page in pages for host in page}
+
+    async def get_objects(self, client, endpoint, base_filter, ids=None):
+        """
+        Gets all NetBox objects which match the filter.
+        Only the objects with the given IDs are requested when IDs are set.
+        """
+        if ids is None:
+            return await client.all(endpoint, base_filter)
+        pages = await asyncio.gather(*[client.all(endpoint, nb_filter) for nb_filter
+                                       in IncrementalSync.filters(base_filter, ids)])
+        return [obj for page in pages for obj in page]
+
+    async def get_config_contexts(self, client):
+        """Gets all config contexts and the objects which are needed to evaluate them"""
+        config_contexts = ConfigContexts(await client.all("extras/config-contexts"),
+                                         self.logger)
+        paths = sorted(config_contexts.tables)
+        tables = await asyncio.gather(*[client.all(path) for path in paths])
+        for path, objects in zip(paths, tables):
+            config_contexts.add_table(path, objects)
+        return config_contexts
+
+    async def get_netbox_data(self, client, incremental=None, shard=None,
+                              device_relations=None):
+        """Gets all devices, VMs, regions and site groups from NetBox"""
+        # pylint: disable=too-many-locals
+        device_ids, vm_ids = None, None
+        if incremental and not incremental.full:
+            device_ids, vm_ids = incremental.device_ids, incremental.vm_ids
+        # Config contexts are evaluated locally instead of being rendered by NetBox
+        device_filter, vm_filter = nb_device_filter, nb_vm_filter
+        if local_config_context:
+            device_filter = without_config_context(nb_device_filter)
+            vm_filter = without_config_context(nb_vm_filter)
+        devices, vms, site_groups, regions, version, config_contexts = await asyncio.gather(
+            self.get_objects(client, "dcim/devices", device_filter, device_ids),
+            self.get_objects(client, "virtualization/virtual-machines", vm_filter, vm_ids)
+            if sync_vms else asyncio.sleep(0, []),
+            client.all("dcim/site-groups"),
+            client.all("dcim/regions"),
+            client.version(),
+            self.get_config_contexts(client) if local_config_context
+            else asyncio.sleep(0, None))
+        # Hostgroups of the devices and VMs of other shards are created by the first shard
+        other_devices, other_vms = [], []
+        if shard:
+            other_devices, other_vms = shard.others(devices, DEVICE), shard.others(vms, VM)
+            devices, vms = shard.select(devices, DEVICE), shard.select(vms, VM)
+        await asyncio.gather(client.expand(devices + other_devices,
+                                           device_relations or DEVICE_RELATIONS),
+                             client.expand(vms + other_vms, VM_RELATIONS))
+        # Convert all objects to pynetbox records
+        records = {}
+        for name, objects, endpoint in (
+                ("devices", devices, self.netbox.dcim.devices),
+                ("vms", vms, self.netbox.virtualization.virtual_machines),
+                ("other_devices", other_devices, self.netbox.dcim.devices),
+                ("other_vms", other_vms, self.netbox.virtualization.virtual_machines),
+                ("site_groups", site_groups, self.netbox.dcim.site_groups),
+                ("regions", regions, self.netbox.dcim.regions)):
+            records[name] = [endpoint.return_obj(obj, self.netbox, endpoint)
+                             for obj in objects]
+        if config_contexts:
+            for name in ("devices", "vms", "other_devices", "other_vms"):
+                config_contexts.apply(records[name])
+        return records, version
+
+    async def run_hosts(self, sync_function, nb_objects, context, pool):
+        """Runs the sync function for all NetBox objects in the worker threads"""
+        await asyncio.gather(*[self.loop.run_in_executor(pool, sync_function,
+                                                         nb_obj, context)
+                               for nb_obj in nb_objects])
+
+    async def prepare(self, session, zabbix_settings, incremental=None, fingerprints=None,
+                      shard=None):
+        """
+        Connects to Zabbix and gets all NetBox and Zabbix data.
+        Returns the SyncContext which is shared by all hosts during this run.
+        """
+        # pylint: disable=too-many-arguments, too-many-positional-arguments, too-many-locals
+        try:
+            await self.connect_zabbix(**zabbix_settings)
+            # The inventory_map is compiled once, its related objects are prefetched
+            inventory = InventoryMap(inventory_map if inventory_sync else {}, self.logger)
+            client = AsyncNetBox(session, self.netbox, self.semaphore, netbox_page_size,
+                                 self.metrics)
+            (records, nb_version), (groups, templates, proxies) = await asyncio.gather(
+                self.timed("netbox_fetch", self.get_netbox_data(
+                    client, incremental, shard,
+                    {**DEVICE_RELATIONS, **inventory.relations})),
+                self.timed("zabbix_fetch", self.get_zabbix_data()))
+            hosts = await self.timed("zabbix_fetch", self.get_zabbix_hosts(
+                linked_hostids(records["devices"], records["vms"], fingerprints)))
+        except (aiohttp.ClientError, APIRequestError, ProcessingError) as e:
+            raise SyncExternalError(f"Unable to get data for the async sync: {e}") from e
+        self.logger.debug(f"Async engine: got {len(records['devices'])} device(s), "
+                          f"{len(records['vms'])} VM(s) and {len(hosts)} Zabbix host(s).")
+        zabbix = BlockingZabbixAPI(self)
+        context = SyncContext(zabbix, self.netbox.extras.journal_entries, nb_version,
+                              convert_recordset(records["site_groups"]),
+                              convert_recordset(records["regions"]),
+                              groups, templates, proxies)
+        context.hosts = hosts
+        context.update_batch = HostUpdateBatch(context, zabbix_chunk_size, self.logger)
+        context.hostnames = HostnameIndex(zabbix, zabbix_chunk_size, self.logger)
+        context.cleanup_batch = HostCleanupBatch(context, device_cf, zabbix_chunk_size,
+                                                 self.logger)
+        if zabbix_create_chunk_size:
+            context.create_batch = HostCreateBatch(context, device_cf,
+                                                   zabbix_create_chunk_size, self.logger)
+        context.incremental = incremental
+        context.fingerprints = fingerprints
+        context.shard = shard
+        context.metrics = self.metrics
+        context.inventory = inventory
+        return records, context
+
+    async def run(self, zabbix_settings, sync_vm, sync_device,
+                  incremental=None, fingerprints=None, shard=None, plan_hosts=None):
+        """
+        Runs the complete sync.
+        INPUT: dictionary with the Zabbix url, token, user and password,
+        the sync functions for a single VM and device and optionally
+        the IncrementalSync, FingerprintStore and Shard classes of this run
+        and a function which prepares the hostgroups and names of all hosts in advance.
+        """
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.loop = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.request_limit)
+        connector = aiohttp.TCPConnector(ssl=self.ssl_context, limit=self.request_limit)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            try:
+                records, context = await self.prepare(session, zabbix_settings,
+                                                      incremental, fingerprints, shard)
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    if plan_hosts:
+                        await self.timed("plan", self.loop.run_in_executor(
+                            pool, plan_hosts, records["devices"] + records["other_devices"],
+                            records["vms"] + records["other_vms"], context))
+                    await self.run_hosts(sync_vm, records["vms"], context, pool)
+                    await self.run_hosts(sync_device, records["devices"], context, pool)
+                    await self.timed("cleanup", self.loop.run_in_executor(
+                        pool, context.cleanup_batch.flush))
+                    if context.create_batch:
+                        await self.timed("create", self.loop.run_in_executor(
+                            pool, context.create_batch.flush))
+                    await self.timed("zabbix_update", self.loop.run_in_executor(
+                        pool, context.update_batch.flush))
+            finally:
+                await self.disconnect_zabbix()
+
+    async def disconnect_zabbix(self):
+        """Logs out of Zabbix, also when the sync failed"""
+        try:
+            if self.zabbix:
+                await self.zabbix.logout()
+        except (aiohttp.ClientError, APIRequestError, ProcessingError) as e:
+            self.logger.warning(f"Unable to log out of Zabbix: {e}")
+        finally:
+            if self.zabbix_session:
+                await self.zabbix_session.close()
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Bulk Zabbix operations. Used to process many hosts with a
+limited amount of API calls instead of one API call per host.
+"""
+from json import dumps
+from logging import getLogger
+from threading import Lock
+from pynetbox.core.query import RequestError as NBRequestError
+from zabbix_utils import APIRequestError
+from modules.exceptions import SyncError
+from modules.metrics import CREATED, DELETED, ERRORED, UPDATED
+from modules.tools import chunks
+
+
+def host_get_parameters(inventory_fields):
+    """
+    Returns the host.get parameters which are needed
+    to run a consistency check on a Zabbix host.
+    INPUT: list of Zabbix inventory fields
+    """
+    return {"selectInterfaces": ['type', 'ip', 'port', 'details', 'interfaceid'],
+            "selectGroups": ["groupid"],
+            "selectHostGroups": ["groupid"],
+            "selectParentTemplates": ["templateid"],
+            "selectInventory": list(inventory_fields)}
+
+
+def prefetch_zabbix_hosts(zabbix, hostids, inventory_fields, chunk_size, logger=None):
+    """
+    Gets the Zabbix host data of multiple hosts in chunked API calls.
+    INPUT: ZabbixAPI class, list of host IDs, list of inventory fields and chunk size
+    OUTPUT: dictionary with the host ID as key and the Zabbix host as value.
+            Returns None should Zabbix return an error.
+    """
+    logger = logger if logger else getLogger(__name__)
+    # Remove empty and duplicate IDs
+    hostids = sorted({str(hostid) for hostid in hostids if hostid})
+    parameters = host_get_parameters(inventory_fields)
+    hosts = {}
+    calls = 0
+    try:
+        for chunk in chunks(hostids, chunk_size):
+            for host in zabbix.host.get(hostids=chunk, **parameters):
+                hosts[str(host["hostid"])] = host
+            calls += 1
+    except APIRequestError as e:
+        logger.warning(f"Unable to prefetch Zabbix hosts, falling back to "
+                       f"a lookup per host. Zabbix returned {str(e)}.")
+        return None
+    logger.debug(f"Prefetched {len(hosts)} of {len(hostids)} Zabbix host(s) "
+                 f"using {calls} API call(s).")
+    return hosts
+
+
+class HostUpdateBatch():
+    """
+    Collects the host diffs of multiple hosts and pushes them to Zabbix
+    in a limited amount of API calls. Hosts which need exactly the same
+    proxy, status, hostgroup or template change are updated together
+    using host.massupdate. All other changes are sent using host.update
+    and hostinterface.update with an array of objects.
+    INPUT: SyncContext, maximum number of hosts per API call and logger
+    """
+    # host.update parameters which can be shared between hosts using host.massupdate.
+    # Parameters in the same tuple always change together.
+    SHARED_PARAMETERS = (("proxyid", "proxy_groupid", "proxy_hostid", "monitored_by"),
+                         ("status",),
+                         ("groups",),
+                         ("templates", "templates_clear"))
+
+    def __init__(self, context, chunk_size, logger=None):
+        self.context = context
+        self.zabbix = context.zabbix
+        self.chunk_size = chunk_size
+        self.logger = logger if logger else getLogger(__name__)
+        self.updates = []
+        # Hosts can be added from multiple worker threads
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.updates)
+
+    def add(self, host, diff):
+        """
+        Adds the changes of a host to the batch
+        INPUT: PhysicalDevice or VirtualMachine object and its HostDiff
+        """
+        if diff:
+            with self.lock:
+                self.updates.append((host, diff))
+
+    def _plan(self):
+        """
+        Splits all changes into shared changes which are grouped by the exact
+        change and the remaining host specific host.update parameters.
+        """
+        shared = {}
+        for host, diff in self.updates:
+            for parameters in self.SHARED_PARAMETERS:
+                change = {key: diff.host[key] for key in parameters if key in diff.host}
+                if change:
+                    key = dumps(change, sort_keys=True, default=str)
+                    shared.setdefault(key, (change, []))[1].append((host, diff))
+        host_params = {id(diff): diff.host_parameters() for _, diff in self.updates}
+        mass_updates = []
+        # Only use host.massupdate when multiple hosts share the same change
+        for change, members in shared.values():
+            if len(members) < 2:
+                continue
+            mass_updates.append((change, members))
+            # Remove the shared change from the host specific parameters
+            for _, diff in members:
+                for key in change:
+                    host_params[id(diff)].pop(key)
+        # Host ID is always present, only update hosts with other parameters left
+        host_updates = [(host, diff, host_params[id(diff)]) for host, diff in self.updates
+                        if len(host_params[id(diff)]) > 1]
+        return mass_updates, host_updates
+
+    def _call(self, method, members, *args, **kwargs):
+        """
+        Executes a batched API call. Should Zabbix return an error
+        then all changes of these hosts are pushed one host at a time,
+        so that a single failing host does not affect the other hosts.
+        Returns a set with the diffs which have been handled per host.
+        """
+        try:
+            method(*args, **kwargs)
+            return set()
+        except APIRequestError as e:
+            self.logger.warning(f"Batched update of {len(members)} host(s) failed: {str(e)}. "
+                                "Retrying the update per host.")
+        handled = set()
+        for host, diff in members:
+            try:
+                host.updateZabbixHost(diff)
+            except SyncError:
+                # The error has already been logged by the host
+                host_failed(self.context, host, UPDATED, None, self.logger)
+            # Either updated or failed, host does not need further processing
+            handled.add(id(diff))
+        return handled
+
+    def flush(self):
+        """
+        Pushes all collected changes to Zabbix.
+        Returns the number of API calls used.
+        """
+        if not self.updates:
+            return 0
+        mass_updates, host_updates = self._plan()
+        handled = set()
+        calls = 0
+        for change, members in mass_updates:
+            members = [member for member in members if id(member[1]) not in handled]
+            for chunk in chunks(members, self.chunk_size):
+                handled |= self._call(self.zabbix.host.massupdate, chunk,
+                                      hosts=[{"hostid": diff.hostid} for _, diff in chunk],
+                                      **change)
+                calls += 1
+        host_updates = [update for update in host_updates if id(update[1]) not in handled]
+        for chunk in chunks(host_updates, self.chunk_size):
+            handled |= self._call(self.zabbix.host.update,
+                                  [(host, diff) for host, diff, _ in chunk],
+                                  *[params for _, _, params in chunk])
+            calls += 1
+        interface_updates = [(host, diff) for host, diff in self.updates
+                             if diff.interface and id(diff) not in handled]
+        for chunk in chunks(interface_updates, self.chunk_size):
+            handled |= self._call(self.zabbix.hostinterface.update, chunk,
+                                  *[diff.interface for _, diff in chunk])
+            calls += 1
+        # Log and journal all hosts which have been updated by the batched calls
+        for host, diff in self.updates:
+            if id(diff) not in handled:
+                host.logUpdate(diff)
+        # Number of API calls needed when updating one host at a time
+        single_calls = sum(bool(diff.host) + bool(diff.interface) for _, diff in self.updates)
+        self.logger.info(f"Updated {len(self.updates)} host(s) using {calls} batched "
+                         f"API call(s) instead of {single_calls}. "
+                         f"Saved {single_calls - calls} API call(s).")
+        self.updates = []
+        return calls
+
+
+class HostnameIndex():
+    """
+    Names of Zabbix hosts which have been checked in advance, so that
+    new hosts do not need a host.get call each to check if their name
+    is already in use. Names are either host names or visible names and are
+    compared exactly, like the filter of host.get.
+    INPUT: ZabbixAPI class, maximum number of names per API call and logger
+    """
+
+    # Zabbix host fields which are checked
+    FIELDS = ("host", "name")
+
+    def __init__(self, zabbix, chunk_size, logger=None):
+        self.zabbix = zabbix
+        self.chunk_size = chunk_size
+        self.logger = logger if logger else getLogger(__name__)
+        # Names per field which have been checked and which are in use
+        self.checked = {field: set() for field in self.FIELDS}
+        self.existing = {field: set() for field in self.FIELDS}
+        self.lock = Lock()
+
+    def check(self, names):
+        """
+        Checks which names are in use in Zabbix using chunked host.get calls.
+        Names which could not be checked are checked per host later on.
+        INPUT: list of (field, name) tuples
+        OUTPUT: list of (field, name) tuples which are in use
+        """
+        calls = 0
+        in_use = []
+        for field in self.FIELDS:
+            pending = sorted({name for name_field, name in names if name_field == field}
+                             - self.checked[field])
+            for chunk in chunks(pending, self.chunk_size):
+                try:
+                    hosts = self.zabbix.host.get(filter={field: chunk}, output=[field])
+                except APIRequestError as e:
+                    self.logger.warning(f"Unable to check the names of new hosts, falling "
+                                        f"back to a check per host. Zabbix returned {str(e)}.")
+                    return in_use
+                calls += 1
+                found = {host[field] for host in hosts}
+                with self.lock:
+                    self.checked[field].update(chunk)
+                    self.existing[field].update(found)
+                in_use += [(field, name) for name in chunk if name in found]
+        if calls:
+            self.logger.debug(f"Checked the names of {len(names)} new host(s) using "
+                              f"{calls} API call(s), {len(in_use)} name(s) already in use.")
+        return in_use
+
+    def exists(self, field, name):
+        """
+        Returns True when a name is in use, False when it is not
+        and None when the name has not been checked in advance.
+        """
+        with self.lock:
+            if name in self.existing[field]:
+                return True
+            return False if name in self.checked[field] else None
+
+    def add(self, field, name):
+        """Marks a name as in use after a host has been created"""
+        with self.lock:
+            self.checked[field].add(name)
+            self.existing[field].add(name)
+
+
+def create_zabbix_hostgroups(zabbix, names, context, chunk_size, logger=None):
+    """
+    Creates Zabbix hostgroups using hostgroup.create with an array of groups.
+    Should a batched call fail then the groups of that call are created one
+    at a time. A group which has been created by another process in the
+    meantime is looked up instead. New groups are added to the SyncContext.
+    INPUT: ZabbixAPI class, names of the missing hostgroups, SyncContext,
+    maximum number of groups per API call and logger
+    OUTPUT: list of the created hostgroups and list of error messages
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    logger = logger if logger else getLogger(__name__)
+    created = []
+    errors = []
+    for chunk in chunks(names, chunk_size):
+        single = chunk
+        if len(chunk) > 1:
+            try:
+                groupids = zabbix.hostgroup.create(*[{"name": name} for name in chunk])
+                single = []
+            except APIRequestError as e:
+                logger.warning(f"Batched creation of {len(chunk)} hostgroup(s) failed: "
+                               f"{str(e)}. Retrying the creation per hostgroup.")
+            if not single:
+                for name, groupid in zip(chunk, groupids["groupids"]):
+                    created.append({"groupid": groupid, "name": name})
+        for name in single:
+            try:
+                groupid = zabbix.hostgroup.create(name=name)["groupids"][0]
+                created.append({"groupid": groupid, "name": name})
+            except APIRequestError as e:
+                # The group could have been created by another process
+                group = zabbix.hostgroup.get(filter={"name": name},
+                                             output=["groupid", "name"])
+                if group:
+                    context.add_group(group[0])
+                    continue
+                msg = f"Hostgroup '{name}': unable to create. Zabbix returned {str(e)}."
+                logger.error(msg)
+                errors.append(msg)
+    for group in created:
+        logger.info(f"Hostgroup '{group['name']}': created in Zabbix.")
+        context.add_group(group)
+    return created, errors
+
+
+def host_failed(context, host, outcome, message, logger):
+    """
+    Handles a host of a batch which could not be processed.
+    INPUT: SyncContext, host, outcome with which the host was counted,
+    error message or None when the error has already been logged and logger
+    """
+    if message:
+        logger.error(message)
+    # The host was counted with the expected outcome when it was added to the batch
+    context.metrics.host(outcome, -1)
+    context.metrics.host(ERRORED)
+    if context.incremental:
+        context.incremental.retry(host.nb_object_type, host.nb.id)
+
+
+def store_host_ids(hosts, custom_field, chunk_size, logger):
+    """
+    Stores the Zabbix host ID of multiple hosts in NetBox using a bulk
+    PATCH request per NetBox endpoint. Hosts without Zabbix host ID are unlinked.
+    Should a bulk request fail then the objects of that request are saved one by one.
+    OUTPUT: number of API calls used
+    """
+    endpoints = {}
+    for host in hosts:
+        host.nb.custom_fields[custom_field] = int(host.zabbix_id) if host.zabbix_id else None
+        endpoint = host.nb.endpoint
+        endpoints.setdefault(endpoint.url, (endpoint, []))[1].append(host)
+    calls = 0
+    for endpoint, members in endpoints.values():
+        for chunk in chunks(members, chunk_size):
+            calls += 1
+            try:
+                endpoint.update([{"id": host.nb.id,
+                                  "custom_fields": {custom_field:
+                                                    host.nb.custom_fields[custom_field]}}
+                                 for host in chunk])
+                continue
+            except NBRequestError as e:
+                logger.warning(f"Bulk update of {len(chunk)} NetBox object(s) failed: "
+                               f"{str(e)}. Retrying the update per object.")
+            calls += len(chunk)
+            for host in chunk:
+                try:
+                    host.nb.save()
+                except NBRequestError as e:
+                    logger.error(f"Host {host.name}: unable to store the Zabbix host ID "
+                                 f"{host.zabbix_id} in NetBox: {str(e)}")
+    return calls
+
+
+def create_journal_entries(journals, entries, chunk_size, logger):
+    """
+    Creates NetBox journal entries using a bulk POST request per chunk.
+    INPUT: NetBox journal class, list of journal entries, chunk size and logger
+    OUTPUT: number of API calls used
+    """
+    calls = 0
+    for chunk in chunks(entries, chunk_size):
+        calls += 1
+        try:
+            journals.create(chunk)
+        except NBRequestError as e:
+            logger.warning(f"Unable to create {len(chunk)} journal entries: NB returned {e}")
+    return calls
+
+
+class HostCreateBatch():
+    """
+    Collects new hosts and creates them in Zabbix using host.create with an
+    array of hosts. The new Zabbix host IDs are stored in NetBox using a bulk
+    PATCH request per NetBox endpoint instead of saving each object.
+    Should a batched call fail then the hosts of that call are handled one
+    at a time, so that a single failing host does not affect the other hosts.
+    INPUT: SyncContext, name of the host ID custom field in NetBox,
+    maximum number of hosts per API call and logger
+    """
+
+    def __init__(self, context, custom_field, chunk_size, logger=None):
+        self.context = context
+        self.custom_field = custom_field
+        self.chunk_size = max(1, chunk_size)
+        self.logger = logger if logger else getLogger(__name__)
+        self.hosts = []
+        # Hosts can be added from multiple worker threads
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def add(self, host, create_data):
+        """
+        Adds a new host to the batch
+        INPUT: PhysicalDevice or VirtualMachine object and its host.create parameters
+        """
+        with self.lock:
+            self.hosts.append((host, create_data))
+
+    def _create(self, chunk):
+        """
+        Creates a chunk of hosts in Zabbix.
+        OUTPUT: list of the hosts which have been created and number of API calls used
+        """
+        try:
+            hostids = self.context.zabbix.host.create(*[data for _, data in chunk])["hostids"]
+            for (host, _), hostid in zip(chunk, hostids):
+                host.zabbix_id = hostid
+            return [host for host, _ in chunk], 1
+        except APIRequestError as e:
+            self.logger.warning(f"Batched creation of {len(chunk)} host(s) failed: {str(e)}. "
+                                "Retrying the creation per host.")
+        created = []
+        for host, create_data in chunk:
+            try:
+                host.zabbix_id = self.context.zabbix.host.create(**create_data)["hostids"][0]
+                created.append(host)
+            except APIRequestError as e:
+                host_failed(self.context, host, CREATED, f"Host {host.name}: Couldn't create. "
+                            f"Zabbix returned {str(e)}.", self.logger)
+        return created, 1 + len(chunk)
+
+    def flush(self):
+        """
+        Creates all collected hosts in Zabbix and links them in NetBox.
+        Returns the number of API calls used.
+        """
+        if not self.hosts:
+            return 0
+        created = []
+        calls = 0
+        for chunk in chunks(self.hosts, self.chunk_size):
+            chunk_created, chunk_calls = self._create(chunk)
+            created += chunk_created
+            calls += chunk_calls
+        calls += store_host_ids(created, self.custom_field, self.chunk_size, self.logger)
+        entries = []
+        for host in created:
+            msg = f"Host {host.name}: Created host in Zabbix."
+            self.logger.info(msg)
+            if host.journal:
+                entries.append(host.journal_entry("success", msg))
+        calls += create_journal_entries(self.context.journals, entries,
+                                        self.chunk_size, self.logger)
+        # Creating a single host takes a host.create call, a NetBox save and a journal entry
+        single_calls = len(self.hosts) * 2 + len(entries)
+        self.logger.info(f"Created {len(created)} of {len(self.hosts)} host(s) using "
+                         f"{calls} API call(s) instead of {single_calls}.")
+        self.hosts = []
+        return calls
+
+
+class HostCleanupBatch():
+    """
+    Collects hosts which have been removed in NetBox and deletes them from Zabbix
+    using host.delete with an array of host IDs. Hosts which no longer exist in
+    Zabbix are only unlinked. The host ID custom fields are cleared using a bulk
+    PATCH request per NetBox endpoint and the journal entries are created in bulk.
+    INPUT: SyncContext, name of the host ID custom field in NetBox,
+    maximum number of hosts per API call and logger
+    """
+
+    def __init__(self, context, custom_field, chunk_size, logger=None):
+        self.context = context
+        self.custom_field = custom_field
+        self.chunk_size = max(1, chunk_size)
+        self.logger = logger if logger else getLogger(__name__)
+        self.hosts = []
+        # Hosts can be added from multiple worker threads
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def add(self, host):
+        """
+        Adds a removed host to the batch
+        INPUT: PhysicalDevice or VirtualMachine object with a Zabbix host ID
+        """
+        with self.lock:
+            self.hosts.append(host)
+
+    def _existing(self):
+        """
+        Checks which of the collected hosts exist in Zabbix.
+        OUTPUT: set of existing host IDs, or None should Zabbix return
+        an error, and number of API calls used
+        """
+        hostids = sorted({str(host.zabbix_id) for host in self.hosts})
+        existing = set()
+        calls = 0
+        try:
+            for chunk in chunks(hostids, self.chunk_size):
+                calls += 1
+                existing.update(str(host["hostid"]) for host in
+                                self.context.zabbix.host.get(hostids=chunk, output=["hostid"]))
+        except APIRequestError as e:
+            for host in self.hosts:
+                host_failed(self.context, host, DELETED, f"Host {host.name}: Zabbix "
+                            f"returned the following error: {str(e)}.", self.logger)
+            return None, calls
+        return existing, calls
+
+    def _delete(self, chunk):
+        """
+        Deletes a chunk of hosts from Zabbix.
+        OUTPUT: list of the hosts which have been deleted and number of API calls used
+        """
+        try:
+            self.context.zabbix.host.delete(*[str(host.zabbix_id) for host in chunk])
+            return chunk, 1
+        except APIRequestError as e:
+            self.logger.warning(f"Batched deletion of {len(chunk)} host(s) failed: {str(e)}. "
+                                "Retrying the deletion per host.")
+        deleted = []
+        for host in chunk:
+            try:
+                self.context.zabbix.host.delete(str(host.zabbix_id))
+                deleted.append(host)
+            except APIRequestError as e:
+                host_failed(self.context, host, DELETED, f"Host {host.name}: Zabbix "
+                            f"returned the following error: {str(e)}.", self.logger)
+        return deleted, 1 + len(chunk)
+
+    def flush(self):
+        """
+        Deletes all collected hosts from Zabbix and unlinks them in NetBox.
+        Returns the number of API calls used.
+        """
+        if not self.hosts:
+            return 0
+        existing, calls = self._existing()
+        if existing is None:
+            self.hosts = []
+            return calls
+        missing = [host for host in self.hosts if str(host.zabbix_id) not in existing]
+        deleted = []
+        # Delete every Zabbix host only once, even when it is linked to multiple objects
+        to_delete = list({str(host.zabbix_id): host for host in self.hosts
+                          if str(host.zabbix_id) in existing}.values())
+        for chunk in chunks(to_delete, self.chunk_size):
+            chunk_deleted, chunk_calls = self._delete(chunk)
+            deleted += chunk_deleted
+            calls += chunk_calls
+        deleted_ids = {str(host.zabbix_id) for host in deleted}
+        deleted = [host for host in self.hosts if str(host.zabbix_id) in deleted_ids]
+        messages = {}
+        for host in missing:
+            messages[host] = (f"Host {host.name}: was already deleted from Zabbix."
+                              " Removed link in NetBox.")
+        for host in deleted:
+            messages[host] = f"Host {host.name}: Deleted host from Zabbix."
+        for host in messages:
+            host.zabbix_id = None
+        calls += store_host_ids(list(messages), self.custom_field,
+                                self.chunk_size, self.logger)
+        entries = []
+        for host, msg in messages.items():
+            self.logger.info(msg)
+            if host.journal:
+                entries.append(host.journal_entry("warning", "Deleted host from Zabbix"))
+        calls += create_journal_entries(self.context.journals, entries,
+                                        self.chunk_size, self.logger)
+        # Removing a single host takes a host.get, host.delete, NetBox save and journal entry
+        single_calls = len(self.hosts) * 2 + len(deleted) + len(entries)
+        self.logger.info(f"Removed {len(messages)} of {len(self.hosts)} host(s) using "
+                         f"{calls} API call(s) instead of {single_calls}.")
+        self.hosts = []
+        return calls
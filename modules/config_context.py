@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Local evaluation of NetBox config contexts. Rendering the config context
+is one of the most expensive parts of a NetBox device or VM request, as
+NetBox merges all applicable config contexts for every object. Devices
+and VMs are requested without the config context instead and the config
+contexts are loaded once and assigned locally, using the same assignment
+rules, weights and merge order as NetBox. Only the "zabbix" key of the
+config context is evaluated, which is the only key used by this script.
+"""
+from copy import deepcopy
+from logging import getLogger
+from pynetbox.core.response import Record
+from modules.prefetch import netbox_endpoint
+
+# Key of the config context which is evaluated
+ZABBIX_KEY = "zabbix"
+# Assignment criteria of a config context
+CRITERIA = ("regions", "site_groups", "sites", "locations", "device_types", "roles",
+            "platforms", "cluster_types", "cluster_groups", "clusters", "tenant_groups",
+            "tenants", "tags")
+# Objects which are needed to evaluate a criterion, per REST path. Nested
+# objects match a config context which is assigned to one of their parents.
+TABLES = {"regions": "dcim/regions",
+          "site_groups": "dcim/site-groups",
+          "locations": "dcim/locations",
+          "tenant_groups": "tenancy/tenant-groups",
+          "cluster_types": "virtualization/clusters",
+          "cluster_groups": "virtualization/clusters"}
+# Query parameter which stops NetBox from rendering the config context
+EXCLUDE_FILTER = {"exclude": "config_context"}
+
+
+def deepmerge(original, new):
+    """
+    Merges two dictionaries just like NetBox does when rendering a config context.
+    Nested dictionaries are merged, all other values of the new dictionary are used.
+    """
+    merged = dict(original)
+    for key, value in new.items():
+        if key in original and isinstance(original[key], dict) and value and \
+                isinstance(value, dict):
+            merged[key] = deepmerge(original[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _value(obj, field):
+    """
+    Returns a field of a pynetbox record or dictionary. Fields which are not
+    present are not loaded by pynetbox, which would request the full object.
+    """
+    if isinstance(obj, Record):
+        return vars(obj).get(field)
+    return obj.get(field) if isinstance(obj, dict) else None
+
+
+def _object_id(obj, field):
+    """Returns the ID of a related object or None when it is not set"""
+    return _value(_value(obj, field), "id")
+
+
+def _tag_slug(tag):
+    """Returns the slug of a tag, which is a nested object or a slug"""
+    return tag if isinstance(tag, str) else _value(tag, "slug")
+
+
+def without_config_context(nb_filter):
+    """Returns a NetBox filter which excludes the config context of each object"""
+    return {**nb_filter, **EXCLUDE_FILTER}
+
+
+class ConfigContexts():
+    """
+    Active config contexts of a single run.
+    INPUT: list of dictionaries with all config contexts as returned by the
+    NetBox API and logger. Objects of the REST paths in tables have to be
+    added with add_table before config contexts are evaluated.
+    """
+
+    def __init__(self, contexts, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        # Config contexts in the order in which NetBox merges them. Contexts
+        # without Zabbix data can not change the result and are left out.
+        self.contexts = []
+        for context in sorted((context for context in contexts if context.get("is_active", True)),
+                              key=lambda context: (context.get("weight", 1000),
+                                                   context.get("name", ""))):
+            data = context.get("data") or {}
+            if ZABBIX_KEY not in data:
+                continue
+            criteria = {}
+            for criterion in CRITERIA:
+                assigned = context.get(criterion) or []
+                if assigned:
+                    criteria[criterion] = frozenset(
+                        _tag_slug(item) if criterion == "tags" else _value(item, "id")
+                        for item in assigned)
+            self.contexts.append((criteria, {ZABBIX_KEY: data[ZABBIX_KEY]}))
+        # Criterion and REST path of the objects which are needed to evaluate the contexts
+        self.tables = {TABLES[criterion] for criteria, _ in self.contexts
+                       for criterion in criteria if criterion in TABLES}
+        # IDs of each nested object and all of its parents, per REST path
+        self.ancestors = {}
+        # Type and group of each cluster, clusters of devices are nested objects
+        self.clusters = {}
+        # Merged config context per unique set of assignments
+        self.merged = {}
+
+    def add_table(self, path, objects):
+        """
+        Adds the objects of a REST path which is needed to evaluate the contexts.
+        INPUT: REST path such as dcim/regions and list of dictionaries
+        """
+        if path == "virtualization/clusters":
+            self.clusters = {cluster["id"]: (_object_id(cluster, "type"),
+                                             _object_id(cluster, "group"))
+                             for cluster in objects}
+            return
+        parents = {obj["id"]: _object_id(obj, "parent") for obj in objects}
+        ancestors = {}
+        for obj_id in parents:
+            chain = []
+            current = obj_id
+            # Walk up the tree, a loop in the tree data is stopped as well
+            while current is not None and current not in chain:
+                chain.append(current)
+                current = parents.get(current)
+            ancestors[obj_id] = frozenset(chain)
+        self.ancestors[path] = ancestors
+
+    def nested(self, path, obj_id):
+        """Returns the ID of a nested object and the IDs of all of its parents"""
+        if obj_id is None:
+            return frozenset()
+        return self.ancestors.get(path, {}).get(obj_id, frozenset((obj_id,)))
+
+    def assignments(self, nb_obj):
+        """
+        Returns the values of a device or VM for every assignment criterion.
+        OUTPUT: tuple with a frozenset per criterion in CRITERIA
+        """
+        site = _value(nb_obj, "site")
+        tenant = _value(nb_obj, "tenant")
+        cluster_id = _object_id(nb_obj, "cluster")
+        cluster_type, cluster_group = self.clusters.get(cluster_id, (None, None))
+        # Devices use device_role up to NetBox 3
+        role_id = _object_id(nb_obj, "role") or _object_id(nb_obj, "device_role")
+        values = {"regions": self.nested("dcim/regions", _object_id(site, "region")),
+                  "site_groups": self.nested("dcim/site-groups", _object_id(site, "group")),
+                  "sites": {_value(site, "id")},
+                  "locations": self.nested("dcim/locations", _object_id(nb_obj, "location")),
+                  "device_types": {_object_id(nb_obj, "device_type")},
+                  "roles": {role_id},
+                  "platforms": {_object_id(nb_obj, "platform")},
+                  "cluster_types": {cluster_type},
+                  "cluster_groups": {cluster_group},
+                  "clusters": {cluster_id},
+                  "tenant_groups": self.nested("tenancy/tenant-groups",
+                                               _object_id(tenant, "group")),
+                  "tenants": {_value(tenant, "id")},
+                  "tags": {_tag_slug(tag) for tag in _value(nb_obj, "tags") or []}}
+        return tuple(frozenset(values[criterion]) - {None} for criterion in CRITERIA)
+
+    def merge(self, assignments):
+        """Merges all config contexts which apply to a set of assignments"""
+        if assignments not in self.merged:
+            values = dict(zip(CRITERIA, assignments))
+            merged = {}
+            for criteria, data in self.contexts:
+                # A criterion without assigned objects applies to all objects
+                if all(assigned & values[criterion] for criterion, assigned
+                       in criteria.items()):
+                    merged = deepmerge(merged, data)
+            self.merged[assignments] = merged
+        return self.merged[assignments]
+
+    def config_context(self, nb_obj):
+        """
+        Returns the config context of a device or VM. The local config
+        context data of the object takes precedence over all config contexts.
+        Every object gets its own copy, the merged config contexts are shared
+        by all objects with the same assignments.
+        """
+        merged = self.merge(self.assignments(nb_obj))
+        local_data = _value(nb_obj, "local_context_data")
+        if isinstance(local_data, dict) and ZABBIX_KEY in local_data:
+            merged = deepmerge(merged, {ZABBIX_KEY: local_data[ZABBIX_KEY]})
+        return deepcopy(merged)
+
+    def apply(self, nb_objects):
+        """Sets the config context of NetBox devices or VMs"""
+        for nb_obj in nb_objects:
+            nb_obj.config_context = self.config_context(nb_obj)
+        self.logger.debug(f"Evaluated the config context of {len(nb_objects)} object(s) "
+                          f"locally with {len(self.contexts)} config context(s).")
+
+
+def load_config_contexts(netbox, logger=None):
+    """
+    Loads all config contexts and the objects which
+    are needed to evaluate them, using pynetbox.
+    OUTPUT: ConfigContexts class
+    """
+    contexts = ConfigContexts([dict(record) for record in netbox.extras.config_contexts.all()],
+                              logger)
+    for path in sorted(contexts.tables):
+        contexts.add_table(path, [dict(record) for record
+                                  in netbox_endpoint(netbox, path).all()])
+    return contexts
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# pylint: disable=too-many-instance-attributes
+"""
+Module that holds the data which is shared by all hosts during a sync.
+"""
+from threading import Lock
+from modules.metrics import Metrics
+from modules.tools import build_path_index
+
+
+class SyncContext():
+    """
+    Shared NetBox and Zabbix data of a single sync run.
+    Hostgroups, templates and proxies are indexed by name so that
+    each host can look them up without going through the full lists.
+    INPUT: ZabbixAPI class, NetBox journal class, NetBox version,
+    NetBox site groups and regions, Zabbix hostgroups, templates and
+    the proxy list as returned by proxy_prepper.
+    """
+
+    def __init__(self, zabbix, journals, nb_version, site_groups, regions,
+                 groups, templates, proxies):
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.zabbix = zabbix
+        self.journals = journals
+        self.nb_version = nb_version
+        # Path of parent names of each site group and region, keyed by ID
+        self.site_group_paths = build_path_index(site_groups)
+        self.region_paths = build_path_index(regions)
+        self.groups = groups
+        self.templates = templates
+        self.proxies = proxies
+        self.group_index = {group["name"]: group["groupid"] for group in groups}
+        self.template_index = {template["name"]: template["templateid"]
+                               for template in templates}
+        self.proxy_index = {}
+        for proxy in proxies:
+            # The first proxy with a name is used, just like a linear search would
+            self.proxy_index.setdefault((proxy["type"], proxy["name"]), proxy)
+        # Hostgroups are shared between hosts which can be processed in parallel.
+        # Used so that the same group is never created twice.
+        self.hostgroup_lock = Lock()
+        # Zabbix data of hosts which has been fetched in advance
+        self.hosts = None
+        # Collects host changes, hosts are updated directly when not set
+        self.update_batch = None
+        # Collects new hosts, hosts are created directly when not set
+        self.create_batch = None
+        # Collects removed hosts, hosts are deleted directly when not set
+        self.cleanup_batch = None
+        # Names of new hosts which have been checked in advance
+        self.hostnames = None
+        # Optional IncrementalSync, FingerprintStore and Shard of this run
+        self.incremental = None
+        self.fingerprints = None
+        self.shard = None
+        # Compiled inventory_map (InventoryMap) of this run
+        self.inventory = None
+        # Metrics of this run
+        self.metrics = Metrics()
+        # Values which are shared by many hosts, such as the
+        # templates of a device type, per cache name and key
+        self.cache = {}
+
+    def group_id(self, name):
+        """Returns the ID of a Zabbix hostgroup or None when it does not exist"""
+        return self.group_index.get(name)
+
+    def add_group(self, group):
+        """Adds a newly created Zabbix hostgroup"""
+        self.groups.append(group)
+        self.group_index[group["name"]] = group["groupid"]
+
+    def cached(self, cache, key, resolve):
+        """
+        Returns a value from a per-run cache. The value is resolved and cached
+        when the key is not cached yet. Empty values and values of which the
+        resolve function raises an exception are not cached, so that errors
+        are still reported for each host. The hit rate of each cache is
+        reported in the metrics of the run.
+        INPUT: name of the cache, hashable key and function which resolves the value
+        """
+        values = self.cache.setdefault(cache, {})
+        if key in values:
+            self.metrics.cache(cache, True)
+            return values[key]
+        self.metrics.cache(cache, False)
+        value = resolve()
+        if value:
+            values[key] = value
+        return value
+
+    def invalidate(self, *caches):
+        """
+        Removes all values of one or more per-run caches, so
+        that the values are resolved again when they are needed.
+        """
+        for cache in caches:
+            self.cache.pop(cache, None)
+
+    def template_id(self, name):
+        """Returns the ID of a Zabbix template or None when it does not exist"""
+        return self.template_index.get(name)
+
+    def proxy(self, proxy_type, name):
+        """
+        Returns a proxy or proxy group or None when it does not exist
+        INPUT: proxy type ("proxy" or "proxy_group") and name
+        """
+        return self.proxy_index.get((proxy_type, name))
@@ -3,6 +3,7 @@
 """
 Device specific handeling for NetBox to Zabbix
 """
+from json import dumps
 from os import sys
 from re import search
 from logging import getLogger
@@ -10,7 +11,12 @@ from zabbix_utils import APIRequestError
 from modules.exceptions import (SyncInventoryError, TemplateError, SyncExternalError,
                                 InterfaceConfigError, JournalError)
 from modules.interface import ZabbixInterface
-from modules.hostgroups import Hostgroup
+from modules.hostgroups import Hostgroup, hostgroup_paths
+from modules.hostdiff import HostDiff
+from modules.bulk import create_zabbix_hostgroups, host_get_parameters
+from modules.fingerprint import host_fingerprint
+from modules.incremental import DEVICE
+from modules.inventory import InventoryMap
 try:
     from config import (
         template_cf, device_cf,
@@ -27,10 +33,13 @@ except ModuleNotFoundError:
 
 class PhysicalDevice():
     # pylint: disable=too-many-instance-attributes, too-many-arguments, too-many-positional-arguments
+    # pylint: disable=too-many-public-methods
     """
     Represents Network device.
     INPUT: (NetBox device class, ZabbixAPI class, journal flag, NB journal class)
     """
+    # NetBox object type, used to identify the host in the fingerprint store
+    nb_object_type = DEVICE
 
     def __init__(self, nb, zabbix, nb_journal_class, nb_version, journal=None, logger=None):
         self.nb = nb
@@ -53,6 +62,9 @@ class PhysicalDevice():
         self.nb_journals = nb_journal_class
         self.inventory_mode = -1
         self.inventory = {}
+        # Hash of the desired Zabbix state and the FingerprintStore
+        self.fingerprint = None
+        self.fingerprints = None
         self.logger = logger if logger else getLogger(__name__)
         self._setBasics()
 
@@ -97,8 +109,12 @@ class PhysicalDevice():
         else:
             pass
 
-    def set_hostgroup(self, hg_format, nb_site_groups, nb_regions):
-        """Set the hostgroup for this device"""
+    def set_hostgroup(self, hg_format, nb_site_groups, nb_regions, context=None):
+        """
+        Set the hostgroup for this device. The hostgroup is memoized in the
+        SyncContext when provided, hosts which share the objects used
+        in the hostgroup format share the generated hostgroup.
+        """
         # Create new Hostgroup instance
         hg = Hostgroup("dev", self.nb, self.nb_api_version, logger=self.logger,
                        nested_sitegroup_flag=traverse_site_groups,
@@ -106,31 +122,59 @@ class PhysicalDevice():
                        nb_groups=nb_site_groups,
                        nb_regions=nb_regions)
         # Generate hostgroup based on hostgroup format
-        self.hostgroup = hg.generate(hg_format)
+        if not context:
+            self.hostgroup = hg.generate(hg_format)
+            return
+        self.hostgroup = context.cached("hostgroups", hg.key(hg_format),
+                                        lambda: hg.generate(hg_format))
 
-    def set_template(self, prefer_config_context, overrule_custom):
-        """ Set Template """
-        self.zbx_template_names = None
+    def set_template(self, prefer_config_context, overrule_custom, context=None):
+        """
+        Set Template. The templates are cached per device type and
+        config context in the SyncContext when provided.
+        """
+        if not context:
+            self.zbx_template_names = self._template_names(prefer_config_context,
+                                                           overrule_custom)
+            return True
+        key = (self.nb.device_type.id, prefer_config_context, overrule_custom,
+               self.templates_context_key() if prefer_config_context or overrule_custom
+               else None)
+        self.zbx_template_names = context.cached(
+            "templates", key,
+            lambda: self._template_names(prefer_config_context, overrule_custom))
+        return True
+
+    def _template_names(self, prefer_config_context, overrule_custom):
+        """Returns the template names from the config context or device type"""
         # Gather templates ONLY from the device specific context
         if prefer_config_context:
             try:
-                self.zbx_template_names = self.get_templates_context()
+                return self.get_templates_context()
             except TemplateError as e:
                 self.logger.warning(e)
-            return True
+            return None
         # Gather templates from the custom field but overrule
         # them should there be any device specific templates
         if overrule_custom:
+            template_names = None
             try:
-                self.zbx_template_names = self.get_templates_context()
+                template_names = self.get_templates_context()
             except TemplateError:
                 pass
-            if not self.zbx_template_names:
-                self.zbx_template_names = self.get_templates_cf()
-            return True
+            return template_names or self.get_templates_cf()
         # Gather templates ONLY from the custom field
-        self.zbx_template_names = self.get_templates_cf()
-        return True
+        return self.get_templates_cf()
+
+    def templates_context_key(self):
+        """
+        Returns a stable representation of the templates in the
+        config context, used as key for the template cache
+        """
+        zabbix = self.config_context.get("zabbix") if self.config_context else None
+        if not isinstance(zabbix, dict):
+            return None
+        return dumps(zabbix.get("templates"), sort_keys=True, default=str)
 
     def get_templates_cf(self):
         """ Get template from custom field """
@@ -161,8 +205,12 @@ class PhysicalDevice():
             return [self.config_context["zabbix"]["templates"]]
         return self.config_context["zabbix"]["templates"]
 
-    def set_inventory(self, nbdevice):
-        """ Set host inventory """
+    def set_inventory(self, nbdevice, context=None):
+        """
+        Set host inventory
+        INPUT: pynetbox record and optionally the SyncContext
+        with the compiled inventory_map of this run
+        """
         # Set inventory mode. Default is disabled (see class init function).
         if inventory_mode == "disabled":
             if inventory_sync:
@@ -180,29 +228,12 @@ class PhysicalDevice():
         self.inventory = {}
         if inventory_sync and self.inventory_mode in [0,1]:
             self.logger.debug(f"Host {self.name}: Starting inventory mapper")
-            # Let's build an inventory dict for each property in the inventory_map
-            for nb_inv_field, zbx_inv_field in inventory_map.items():
-                field_list = nb_inv_field.split("/") # convert str to list based on delimiter
-                # start at the base of the dict...
-                value = nbdevice
-                # ... and step through the dict till we find the needed value
-                for item in field_list:
-                    value = value[item] if value else None
-                # Check if the result is usable and expected
-                # We want to apply any int or float 0 values,
-                # even if python thinks those are empty.
-                if ((value and isinstance(value, int | float | str )) or
-                     (isinstance(value, int | float) and int(value) ==0)):
-                    self.inventory[zbx_inv_field] = str(value)
-                elif not value:
-                    # empty value should just be an empty string for API compatibility
-                    self.logger.debug(f"Host {self.name}: NetBox inventory lookup for "
-                                      f"'{nb_inv_field}' returned an empty value")
-                    self.inventory[zbx_inv_field] = ""
-                else:
-                    # Value is not a string or numeral, probably not what the user expected.
-                    self.logger.error(f"Host {self.name}: Inventory lookup for '{nb_inv_field}'"
-                                      " returned an unexpected type: it will be skipped.")
+            # The inventory_map is compiled once per run,
+            # unless this host is synced without a SyncContext
+            inventory = context.inventory if context else None
+            if inventory is None:
+                inventory = InventoryMap(inventory_map, self.logger)
+            self.inventory = inventory.inventory(nbdevice, self.name)
             self.logger.debug(f"Host {self.name}: Inventory mapping complete. "
                             f"Mapped {len(list(filter(None, self.inventory.values())))} field(s)")
         return True
@@ -245,10 +276,10 @@ class PhysicalDevice():
         self.logger.debug(f"Host {self.name} is non-primary cluster member.")
         return False
 
-    def zbxTemplatePrepper(self, templates):
+    def zbxTemplatePrepper(self, context):
         """
         Returns Zabbix template IDs
-        INPUT: list of templates from Zabbix
+        INPUT: SyncContext with the templates from Zabbix
         OUTPUT: True
         """
         # Check if there are templates defined
@@ -256,42 +287,44 @@ class PhysicalDevice():
             e = f"Host {self.name}: No templates found"
             self.logger.info(e)
             raise SyncInventoryError()
-        # Set variable to empty list
-        self.zbx_templates = []
+        # Template IDs are resolved once for each set of template names
+        self.zbx_templates = list(context.cached(
+            "template_ids", tuple(self.zbx_template_names),
+            lambda: self._template_ids(context)))
+        return True
+
+    def _template_ids(self, context):
+        """Returns the Zabbix template IDs and names of the template names"""
+        templates = []
         # Go through all templates definded in NetBox
         for nb_template in self.zbx_template_names:
-            template_match = False
-            # Go through all templates found in Zabbix
-            for zbx_template in templates:
-                # If the template names match
-                if zbx_template['name'] == nb_template:
-                    # Set match variable to true, add template details
-                    # to class variable and return debug log
-                    template_match = True
-                    self.zbx_templates.append({"templateid": zbx_template['templateid'],
-                                               "name": zbx_template['name']})
-                    e = f"Host {self.name}: found template {zbx_template['name']}"
-                    self.logger.debug(e)
+            templateid = context.template_id(nb_template)
+            if templateid:
+                # Add template details to class variable and return debug log
+                templates.append({"templateid": templateid,
+                                  "name": nb_template})
+                e = f"Host {self.name}: found template {nb_template}"
+                self.logger.debug(e)
             # Return error should the template not be found in Zabbix
-            if not template_match:
+            else:
                 e = (f"Unable to find template {nb_template} "
                     f"for host {self.name} in Zabbix. Skipping host...")
                 self.logger.warning(e)
                 raise SyncInventoryError(e)
+        return templates
 
-    def setZabbixGroupID(self, groups):
+    def setZabbixGroupID(self, context):
         """
         Sets Zabbix group ID as instance variable
-        INPUT: list of hostgroups
+        INPUT: SyncContext with the hostgroups from Zabbix
         OUTPUT: True / False
         """
-        # Go through all groups
-        for group in groups:
-            if group['name'] == self.hostgroup:
-                self.group_id = group['groupid']
-                e = f"Host {self.name}: matched group {group['name']}"
-                self.logger.debug(e)
-                return True
+        groupid = context.group_id(self.hostgroup)
+        if groupid:
+            self.group_id = groupid
+            e = f"Host {self.name}: matched group {self.hostgroup}"
+            self.logger.debug(e)
+            return True
         return False
 
     def cleanup(self):
@@ -324,16 +357,27 @@ class PhysicalDevice():
         self.nb.custom_fields[device_cf] = None
         self.nb.save()
 
-    def _zabbixHostnameExists(self):
+    def hostname(self):
+        """
+        Returns the Zabbix field which identifies this host and its value,
+        the visible name is used for hosts with special characters.
+        """
+        if not self.use_visible_name:
+            return ("host", self.name)
+        return ("name", self.visible_name)
+
+    def _zabbixHostnameExists(self, context=None):
         """
         Checks if hostname exists in Zabbix.
+        Uses the HostnameIndex of the context when the name has been checked in advance.
         """
         # Validate the hostname or visible name field
-        if not self.use_visible_name:
-            zbx_filter = {'host': self.name}
-        else:
-            zbx_filter = {'name': self.visible_name}
-        host = self.zabbix.host.get(filter=zbx_filter, output=[])
+        field, name = self.hostname()
+        if context and context.hostnames:
+            exists = context.hostnames.exists(field, name)
+            if exists is not None:
+                return exists
+        host = self.zabbix.host.get(filter={field: name}, output=[])
         return bool(host)
 
     def setInterfaceDetails(self):
@@ -358,12 +402,12 @@ class PhysicalDevice():
             self.logger.warning(message)
             raise SyncInventoryError(message) from e
 
-    def setProxy(self, proxy_list):
+    def setProxy(self, context):
         """
         Sets proxy or proxy group if this
         value has been defined in config context
 
-        input: List of all proxies and proxy groups in standardized format
+        input: SyncContext with all proxies and proxy groups in standardized format
         """
         # check if the key Zabbix is defined in the config context
         if not "zabbix" in self.nb.config_context:
@@ -382,167 +426,202 @@ class PhysicalDevice():
             # Check if the key exists in NetBox CC
             if proxy_type in self.nb.config_context["zabbix"]:
                 proxy_name = self.nb.config_context["zabbix"][proxy_type]
-                # go through all proxies
-                for proxy in proxy_list:
-                    # If the proxy does not match the type, ignore and continue
-                    if not proxy["type"] == proxy_type:
-                        continue
-                    # If the proxy name matches
-                    if proxy["name"] == proxy_name:
-                        self.logger.debug(f"Host {self.name}: using {proxy['type']}"
-                                          f" {proxy_name}")
-                        self.zbxproxy = proxy
-                        return True
+                # Lookup the proxy by type and name
+                proxy = context.proxy(proxy_type, proxy_name)
+                if proxy:
+                    self.logger.debug(f"Host {self.name}: using {proxy['type']}"
+                                      f" {proxy_name}")
+                    self.zbxproxy = proxy
+                    return True
                 self.logger.warning(f"Host {self.name}: unable to find proxy {proxy_name}")
         return False
 
-    def createInZabbix(self, groups, templates, proxies,
+    def createInZabbix(self, context,
                        description="Host added by NetBox sync script."):
         """
         Creates Zabbix host object with parameters from NetBox object.
+        The host is added to the create batch of the context when set.
+        INPUT: SyncContext
+        OUTPUT: True when the host has been created or added to the create batch
         """
         # Check if hostname is already present in Zabbix
-        if not self._zabbixHostnameExists():
-            # Set group and template ID's for host
-            if not self.setZabbixGroupID(groups):
-                e = (f"Unable to find group '{self.hostgroup}' "
-                     f"for host {self.name} in Zabbix.")
-                self.logger.warning(e)
-                raise SyncInventoryError(e)
-            self.zbxTemplatePrepper(templates)
-            templateids = []
-            for template in self.zbx_templates:
-                templateids.append({'templateid': template['templateid']})
-            # Set interface, group and template configuration
-            interfaces = self.setInterfaceDetails()
-            groups = [{"groupid": self.group_id}]
-            # Set Zabbix proxy if defined
-            self.setProxy(proxies)
-            # Set basic data for host creation
-            create_data = {"host": self.name,
-                            "name": self.visible_name,
-                            "status": self.zabbix_state,
-                            "interfaces": interfaces,
-                            "groups": groups,
-                            "templates": templateids,
-                            "description": description,
-                            "inventory_mode": self.inventory_mode,
-                            "inventory": self.inventory
-                            }
-            # If a Zabbix proxy or Zabbix Proxy group has been defined
-            if self.zbxproxy:
-                # If a lower version than 7 is used, we can assume that
-                # the proxy is a normal proxy and not a proxy group
-                if not str(self.zabbix.version).startswith('7'):
-                    create_data["proxy_hostid"] = self.zbxproxy["id"]
-                else:
-                    # Configure either a proxy or proxy group
-                    create_data[self.zbxproxy["idtype"]] = self.zbxproxy["id"]
-                    create_data["monitored_by"] = self.zbxproxy["monitored_by"]
-            # Add host to Zabbix
-            try:
-                host = self.zabbix.host.create(**create_data)
-                self.zabbix_id = host["hostids"][0]
-            except APIRequestError as e:
-                e = f"Host {self.name}: Couldn't create. Zabbix returned {str(e)}."
-                self.logger.error(e)
-                raise SyncExternalError(e) from None
-            # Set NetBox custom field to hostID value.
-            self.nb.custom_fields[device_cf] = int(self.zabbix_id)
-            self.nb.save()
-            msg = f"Host {self.name}: Created host in Zabbix."
-            self.logger.info(msg)
-            self.create_journal_entry("success", msg)
-        else:
+        if self._zabbixHostnameExists(context):
             e = f"Host {self.name}: Unable to add to Zabbix. Host already present."
             self.logger.warning(e)
+            return False
+        create_data = self.create_parameters(context, description)
+        # Other NetBox objects with the same name are reported as already present
+        if context.hostnames:
+            context.hostnames.add(*self.hostname())
+        if context.create_batch is not None:
+            context.create_batch.add(self, create_data)
+            return True
+        # Add host to Zabbix
+        try:
+            host = self.zabbix.host.create(**create_data)
+            self.zabbix_id = host["hostids"][0]
+        except APIRequestError as e:
+            e = f"Host {self.name}: Couldn't create. Zabbix returned {str(e)}."
+            self.logger.error(e)
+            raise SyncExternalError(e) from None
+        # Set NetBox custom field to hostID value.
+        self.nb.custom_fields[device_cf] = int(self.zabbix_id)
+        self.nb.save()
+        self.logCreate()
+        return True
 
-    def createZabbixHostgroup(self, hostgroups):
+    def create_parameters(self, context, description):
         """
-        Creates Zabbix host group based on hostgroup format.
-        Creates multiple when using a nested format.
+        Returns the host.create parameters of this host.
+        INPUT: SyncContext and host description
         """
-        final_data = []
-        # Check if the hostgroup is in a nested format and check each parent
-        for pos in range(len(self.hostgroup.split('/'))):
-            zabbix_hg = self.hostgroup.rsplit('/', pos)[0]
-            if self.lookupZabbixHostgroup(hostgroups, zabbix_hg):
-                # Hostgroup already exists
-                continue
-            # Create new group
-            try:
-                # API call to Zabbix
-                groupid = self.zabbix.hostgroup.create(name=zabbix_hg)
-                e = f"Hostgroup '{zabbix_hg}': created in Zabbix."
-                self.logger.info(e)
-                # Add group to final data
-                final_data.append({'groupid': groupid["groupids"][0], 'name': zabbix_hg})
-            except APIRequestError as e:
-                msg = f"Hostgroup '{zabbix_hg}': unable to create. Zabbix returned {str(e)}."
-                self.logger.error(msg)
-                raise SyncExternalError(msg) from e
-        return final_data
+        # Set group and template ID's for host
+        if not self.setZabbixGroupID(context):
+            e = (f"Unable to find group '{self.hostgroup}' "
+                 f"for host {self.name} in Zabbix.")
+            self.logger.warning(e)
+            raise SyncInventoryError(e)
+        self.zbxTemplatePrepper(context)
+        templateids = []
+        for template in self.zbx_templates:
+            templateids.append({'templateid': template['templateid']})
+        # Set interface, group and template configuration
+        interfaces = self.setInterfaceDetails()
+        groups = [{"groupid": self.group_id}]
+        # Set Zabbix proxy if defined
+        self.setProxy(context)
+        # Set basic data for host creation
+        create_data = {"host": self.name,
+                        "name": self.visible_name,
+                        "status": self.zabbix_state,
+                        "interfaces": interfaces,
+                        "groups": groups,
+                        "templates": templateids,
+                        "description": description,
+                        "inventory_mode": self.inventory_mode,
+                        "inventory": self.inventory
+                        }
+        # If a Zabbix proxy or Zabbix Proxy group has been defined
+        if self.zbxproxy:
+            # If a lower version than 7 is used, we can assume that
+            # the proxy is a normal proxy and not a proxy group
+            if not str(self.zabbix.version).startswith('7'):
+                create_data["proxy_hostid"] = self.zbxproxy["id"]
+            else:
+                # Configure either a proxy or proxy group
+                create_data[self.zbxproxy["idtype"]] = self.zbxproxy["id"]
+                create_data["monitored_by"] = self.zbxproxy["monitored_by"]
+        return create_data
 
-    def lookupZabbixHostgroup(self, group_list, lookup_group):
-        """
-        Function to check if a hostgroup
-        exists in a list of Zabbix hostgroups
-        INPUT: Group list and group lookup
-        OUTPUT: Boolean
+    def logCreate(self):
+        """Logs and journals the creation of this host"""
+        msg = f"Host {self.name}: Created host in Zabbix."
+        self.logger.info(msg)
+        self.create_journal_entry("success", msg)
+
+    def createZabbixHostgroup(self, context):
         """
-        for group in group_list:
-            if group["name"] == lookup_group:
-                return True
-        return False
+        Creates Zabbix host group based on hostgroup format.
+        Creates multiple when using a nested format.
+        New groups are added to the SyncContext and returned.
+        """
+        # When sharding, the hostgroups are created by the first shard
+        if context.shard and not context.shard.creates_groups:
+            return context.shard.wait_for_group(self.zabbix, self.hostgroup, context)
+        # The hostgroup and each parent when the hostgroup is in a nested format
+        names = hostgroup_paths(self.hostgroup)
+        # Usually all groups have been created in advance
+        if all(context.group_id(name) for name in names):
+            return []
+        # Hostgroups are shared between hosts which can be processed in parallel.
+        # Lock the groups so that the same group is never created twice.
+        with context.hostgroup_lock:
+            missing = [name for name in names if not context.group_id(name)]
+            final_data, errors = create_zabbix_hostgroups(self.zabbix, missing, context,
+                                                          len(missing), self.logger)
+        if errors:
+            raise SyncExternalError(errors[0])
+        return final_data
 
-    def updateZabbixHost(self, **kwargs):
+    def updateZabbixHost(self, diff):
         """
-        Updates Zabbix host with given parameters.
-        INPUT: Key word arguments for Zabbix host object.
+        Updates Zabbix host with all changes from a host diff.
+        Uses a single host.update call and at most one hostinterface.update call.
+        INPUT: HostDiff object
         """
+        if not diff:
+            return False
         try:
-            self.zabbix.host.update(hostid=self.zabbix_id, **kwargs)
+            if diff.host:
+                self.zabbix.host.update(**diff.host_parameters())
+            if diff.interface:
+                self.zabbix.hostinterface.update(diff.interface)
         except APIRequestError as e:
             e = (f"Host {self.name}: Unable to update. "
                  f"Zabbix returned the following error: {str(e)}.")
             self.logger.error(e)
             raise SyncExternalError(e) from None
-        self.logger.info(f"Updated host {self.name} with data {kwargs}.")
-        self.create_journal_entry("info", "Updated host in Zabbix with latest NB data.")
+        self.logUpdate(diff)
+        return True
 
-    def ConsistencyCheck(self, groups, templates, proxies, proxy_power, create_hostgroups):
+    def logUpdate(self, diff):
+        """
+        Logs a succesfull host update and creates a single
+        journal entry which summarises all changes.
+        INPUT: HostDiff object
+        """
+        self.logger.info(f"Updated host {self.name} with data {diff.host} "
+                         f"and interface data {diff.interface}.")
+        self.create_journal_entry("info", "Updated host in Zabbix with latest NB data: "
+                                          f"{diff.summary()}.")
+        if self.fingerprint:
+            self.fingerprints.store(self)
+
+    def ConsistencyCheck(self, context, proxy_power, create_hostgroups):
         # pylint: disable=too-many-branches, too-many-statements
         """
         Checks if Zabbix object is still valid with NetBox parameters.
-        """
+        All changes are collected and pushed to Zabbix at once.
+        The SyncContext provides the Zabbix hostgroups, templates and proxies and
+        optionally the prefetched Zabbix hosts (when not set, the host is fetched
+        from Zabbix), a HostUpdateBatch (when set, the changes are added to the
+        batch instead of being pushed to Zabbix directly) and a FingerprintStore
+        (hosts of which the desired state has not changed are not checked).
+        OUTPUT: True when changes were found for the host
+        """
+        fingerprints = context.fingerprints
+        zabbix_hosts = context.hosts
         # If group is found or if the hostgroup is nested
-        if not self.setZabbixGroupID(groups) or len(self.hostgroup.split('/')) > 1:
+        if not self.setZabbixGroupID(context) or len(self.hostgroup.split('/')) > 1:
             if create_hostgroups:
-                # Script is allowed to create a new hostgroup
-                new_groups = self.createZabbixHostgroup(groups)
-                for group in new_groups:
-                    # Add all new groups to the list of groups
-                    groups.append(group)
+                # Script is allowed to create a new hostgroup.
+                # New groups are added to the context.
+                self.createZabbixHostgroup(context)
             # check if the initial group was not already found (and this is a nested folder check)
             if not self.group_id:
                 # Function returns true / false but also sets GroupID
-                if not self.setZabbixGroupID(groups) and not create_hostgroups:
+                if not self.setZabbixGroupID(context) and not create_hostgroups:
                     e = (f"Host {self.name}: different hostgroup is required but "
                         "unable to create hostgroup without generation permission.")
                     self.logger.warning(e)
                     raise SyncInventoryError(e)
         # Prepare templates and proxy config
-        self.zbxTemplatePrepper(templates)
-        self.setProxy(proxies)
-        # Get host object from Zabbix
-        host = self.zabbix.host.get(filter={'hostid': self.zabbix_id},
-                                    selectInterfaces=['type', 'ip',
-                                                      'port', 'details',
-                                                      'interfaceid'],
-                                    selectGroups=["groupid"],
-                                    selectHostGroups=["groupid"],
-                                    selectParentTemplates=["templateid"],
-                                    selectInventory=list(inventory_map.values()))
+        self.zbxTemplatePrepper(context)
+        self.setProxy(context)
+        # Skip the Zabbix checks when the desired state has not changed
+        if fingerprints is not None:
+            self.fingerprints = fingerprints
+            self.fingerprint = host_fingerprint(self, proxy_power)
+            if fingerprints.unchanged(self):
+                self.logger.debug(f"Host {self.name}: desired state unchanged, "
+                                  "skipping consistency check.")
+                return False
+        # Get host object from the prefetched hosts or from Zabbix
+        if zabbix_hosts is not None and str(self.zabbix_id) in zabbix_hosts:
+            host = [zabbix_hosts[str(self.zabbix_id)]]
+        else:
+            host = self.zabbix.host.get(filter={'hostid': self.zabbix_id},
+                                        **host_get_parameters(inventory_map.values()))
         if len(host) > 1:
             e = (f"Got {len(host)} results for Zabbix hosts "
                  f"with ID {self.zabbix_id} - hostname {self.name}.")
@@ -555,12 +634,14 @@ class PhysicalDevice():
             self.logger.error(e)
             raise SyncInventoryError(e)
         host = host[0]
+        # Collect all changes for this host
+        diff = HostDiff(self.zabbix_id, self.name)
         if host["host"] == self.name:
             self.logger.debug(f"Host {self.name}: hostname in-sync.")
         else:
             self.logger.warning(f"Host {self.name}: hostname OUT of sync. "
                                 f"Received value: {host['host']}")
-            self.updateZabbixHost(host=self.name)
+            diff.add("hostname", host=self.name)
         # Execute check depending on wether the name is special or not
         if self.use_visible_name:
             if host["name"] == self.visible_name:
@@ -568,7 +649,7 @@ class PhysicalDevice():
             else:
                 self.logger.warning(f"Host {self.name}: visible name OUT of sync."
                                     f" Received value: {host['name']}")
-                self.updateZabbixHost(name=self.visible_name)
+                diff.add("visible name", name=self.visible_name)
 
         # Check if the templates are in-sync
         if not self.zbx_template_comparer(host["parentTemplates"]):
@@ -578,8 +659,12 @@ class PhysicalDevice():
             for template in self.zbx_templates:
                 templateids.append({'templateid': template['templateid']})
             # Update Zabbix with NB templates and clear any old / lost templates
-            self.updateZabbixHost(templates_clear=host["parentTemplates"],
-                                      templates=templateids)
+            nb_templateids = {template['templateid'] for template in self.zbx_templates}
+            diff.add("templates", templates_clear=[template for template
+                                                   in host["parentTemplates"]
+                                                   if template['templateid']
+                                                   not in nb_templateids],
+                     templates=templateids)
         else:
             self.logger.debug(f"Host {self.name}: template(s) in-sync.")
 
@@ -593,13 +678,13 @@ class PhysicalDevice():
                 break
         else:
             self.logger.warning(f"Host {self.name}: hostgroup OUT of sync.")
-            self.updateZabbixHost(groups={'groupid': self.group_id})
+            diff.add("hostgroup", groups={'groupid': self.group_id})
 
         if int(host["status"]) == self.zabbix_state:
             self.logger.debug(f"Host {self.name}: status in-sync.")
         else:
             self.logger.warning(f"Host {self.name}: status OUT of sync.")
-            self.updateZabbixHost(status=str(self.zabbix_state))
+            diff.add("status", status=str(self.zabbix_state))
         # Check if a proxy has been defined
         if self.zbxproxy:
             # Check if proxy or proxy group is defined
@@ -614,13 +699,13 @@ class PhysicalDevice():
                 self.logger.warning(f"Host {self.name}: proxy OUT of sync.")
                 # Zabbix <= 6 patch
                 if not str(self.zabbix.version).startswith('7'):
-                    self.updateZabbixHost(proxy_hostid=self.zbxproxy['id'])
+                    diff.add("proxy", proxy_hostid=self.zbxproxy['id'])
                 # Zabbix 7+
                 else:
                     # Prepare data structure for updating either proxy or group
                     update_data = {self.zbxproxy["idtype"]: self.zbxproxy["id"],
                                    "monitored_by": self.zbxproxy['monitored_by']}
-                    self.updateZabbixHost(**update_data)
+                    diff.add("proxy", **update_data)
         else:
             # No proxy is defined in NetBox
             proxy_set = False
@@ -634,13 +719,13 @@ class PhysicalDevice():
                 self.logger.warning(f"Host {self.name}: no proxy is configured in NetBox "
                                     "but is configured in Zabbix. Removing proxy config in Zabbix")
                 if "proxy_hostid" in host and bool(host["proxy_hostid"]):
-                    self.updateZabbixHost(proxy_hostid=0)
+                    diff.add("proxy", proxy_hostid=0)
                 # Zabbix 7 proxy
                 elif "proxyid" in host and bool(host["proxyid"]):
-                    self.updateZabbixHost(proxyid=0, monitored_by=0)
+                    diff.add("proxy", proxyid=0, monitored_by=0)
                 # Zabbix 7 proxy group
                 elif "proxy_groupid" in host and bool(host["proxy_groupid"]):
-                    self.updateZabbixHost(proxy_groupid=0, monitored_by=0)
+                    diff.add("proxy", proxy_groupid=0, monitored_by=0)
             # Checks if a proxy has been defined in Zabbix and if proxy_power config has been set
             if proxy_set and not proxy_power:
                 # Display error message
@@ -655,14 +740,19 @@ class PhysicalDevice():
             self.logger.debug(f"Host {self.name}: inventory_mode in-sync.")
         else:
             self.logger.warning(f"Host {self.name}: inventory_mode OUT of sync.")
-            self.updateZabbixHost(inventory_mode=str(self.inventory_mode))
+            diff.add("inventory_mode", inventory_mode=str(self.inventory_mode))
         if inventory_sync and self.inventory_mode in [0,1]:
-            # Check host inventory mapping
-            if host['inventory'] == self.inventory:
-                self.logger.debug(f"Host {self.name}: inventory in-sync.")
-            else:
+            # Check host inventory mapping. Zabbix returns an empty list
+            # instead of a dictionary when the inventory is disabled.
+            zbx_inventory = host['inventory'] if isinstance(host['inventory'], dict) else {}
+            # Only send the inventory fields which have been changed
+            inventory = {field: value for field, value in self.inventory.items()
+                         if zbx_inventory.get(field) != value}
+            if inventory:
                 self.logger.warning(f"Host {self.name}: inventory OUT of sync.")
-                self.updateZabbixHost(inventory=self.inventory)
+                diff.add("inventory", inventory=inventory)
+            else:
+                self.logger.debug(f"Host {self.name}: inventory in-sync.")
 
         # If only 1 interface has been found
         # pylint: disable=too-many-nested-blocks
@@ -701,33 +791,46 @@ class PhysicalDevice():
                 # If interface updates have been found: push to Zabbix
                 self.logger.warning(f"Host {self.name}: Interface OUT of sync.")
                 if "type" in updates:
-                    # Changing interface type not supported. Raise exception.
+                    # Changing interface type not supported. Push all other
+                    # changes to Zabbix and raise exception.
+                    self.fingerprint = None
+                    self.updateZabbixHost(diff)
                     e = (f"Host {self.name}: changing interface type to "
                          f"{str(updates['type'])} is not supported.")
                     self.logger.error(e)
                     raise InterfaceConfigError(e)
                 # Set interfaceID for Zabbix config
-                updates["interfaceid"] = host["interfaces"][0]['interfaceid']
-                try:
-                    # API call to Zabbix
-                    self.zabbix.hostinterface.update(updates)
-                    e = f"Host {self.name}: solved interface conflict."
-                    self.logger.info(e)
-                    self.create_journal_entry("info", e)
-                except APIRequestError as e:
-                    msg = f"Zabbix returned the following error: {str(e)}."
-                    self.logger.error(msg)
-                    raise SyncExternalError(msg) from e
+                diff.add_interface(host["interfaces"][0]['interfaceid'], updates)
             else:
                 # If no updates are found, Zabbix interface is in-sync
                 e = f"Host {self.name}: interface in-sync."
                 self.logger.debug(e)
         else:
+            # Push all other changes to Zabbix before raising the exception
+            self.fingerprint = None
+            self.updateZabbixHost(diff)
             e = (f"Host {self.name} has unsupported interface configuration."
                  f" Host has total of {len(host['interfaces'])} interfaces. "
                  "Manual interfention required.")
             self.logger.error(e)
             raise SyncInventoryError(e)
+        # Host is in-sync, the fingerprint of updated hosts is stored after the update
+        if not diff and self.fingerprint:
+            self.fingerprints.store(self)
+        # Push all changes to Zabbix or leave them to the update batch
+        if context.update_batch is not None:
+            context.update_batch.add(self, diff)
+        else:
+            self.updateZabbixHost(diff)
+        return bool(diff)
+
+    def journal_entry(self, severity, message):
+        """Returns a NetBox journal entry for this host"""
+        return {"assigned_object_type": "dcim.device",
+                "assigned_object_id": self.id,
+                "kind": severity,
+                "comments": message
+                }
 
     def create_journal_entry(self, severity, message):
         """
@@ -739,13 +842,8 @@ class PhysicalDevice():
             if severity not in ["info", "success", "warning", "danger"]:
                 self.logger.warning(f"Value {severity} not valid for NB journal entries.")
                 return False
-            journal = {"assigned_object_type": "dcim.device",
-                       "assigned_object_id": self.id,
-                       "kind": severity,
-                       "comments": message
-                       }
             try:
-                self.nb_journals.create(journal)
+                self.nb_journals.create(self.journal_entry(severity, message))
                 self.logger.debug(f"Host {self.name}: Created journal entry in NetBox")
                 return True
             except JournalError(e) as e:
@@ -759,26 +857,10 @@ class PhysicalDevice():
         Compares the NetBox and Zabbix templates with each other.
         Should there be a mismatch then the function will return false
 
-        INPUT: list of NB and ZBX templates
+        INPUT: list of ZBX templates
         OUTPUT: Boolean True/False
         """
-        succesfull_templates = []
-        # Go through each NetBox template
-        for nb_tmpl in self.zbx_templates:
-            # Go through each Zabbix template
-            for pos, zbx_tmpl in enumerate(tmpls_from_zabbix):
-                # Check if template IDs match
-                if nb_tmpl["templateid"] == zbx_tmpl["templateid"]:
-                    # Templates match. Remove this template from the Zabbix templates
-                    # and add this NB template to the list of successfull templates
-                    tmpls_from_zabbix.pop(pos)
-                    succesfull_templates.append(nb_tmpl)
-                    self.logger.debug(f"Host {self.name}: template "
-                                      f"{nb_tmpl['name']} is present in Zabbix.")
-                    break
-        if len(succesfull_templates) == len(self.zbx_templates) and len(tmpls_from_zabbix) == 0:
-            # All of the NetBox templates have been confirmed as successfull
-            # and the ZBX template list is empty. This means that
-            # all of the templates match.
-            return True
-        return False
+        # Templates match when both sides contain exactly the same template IDs
+        nb_templateids = {tmpl["templateid"] for tmpl in self.zbx_templates}
+        zbx_templateids = {tmpl["templateid"] for tmpl in tmpls_from_zabbix}
+        return nb_templateids == zbx_templateids
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, too-many-instance-attributes, duplicate-code
+"""
+Local fingerprint store. Keeps a hash of the desired Zabbix state of each
+host so that hosts which have not changed in NetBox can skip the
+consistency check and the Zabbix API calls it requires.
+"""
+import json
+import sqlite3
+from hashlib import sha256
+from logging import getLogger
+from os import sys
+from threading import Lock
+from modules.incremental import DEVICE, VM
+try:
+    from config import (
+        device_cf,
+        inventory_sync
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+          "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(1)
+
+
+def host_fingerprint(host, proxy_power):
+    """
+    Returns a hash of the desired Zabbix state of a host.
+    INPUT: PhysicalDevice or VirtualMachine object with the hostgroup,
+    templates and proxy already resolved and the full proxy sync setting.
+    """
+    state = {"host": host.name,
+             "name": host.visible_name if host.use_visible_name else None,
+             "groupid": host.group_id,
+             "templates": sorted(template["templateid"] for template in host.zbx_templates),
+             "proxy": ([host.zbxproxy["idtype"], host.zbxproxy["id"]]
+                       if host.zbxproxy else None),
+             "proxy_power": proxy_power,
+             "status": host.zabbix_state,
+             "interface": host.setInterfaceDetails(),
+             "inventory_mode": host.inventory_mode,
+             "inventory": host.inventory if inventory_sync else None}
+    return sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def linked_hostids(nb_devices, nb_vms, fingerprints=None):
+    """
+    Returns the Zabbix host IDs of all NetBox devices and VMs which are linked
+    to a Zabbix host. Hosts which are skipped by the fingerprint store are left out.
+    """
+    if fingerprints:
+        return (fingerprints.prefetch_ids(nb_devices, DEVICE) +
+                fingerprints.prefetch_ids(nb_vms, VM))
+    return [nb_obj.custom_fields.get(device_cf) for nb_obj in nb_devices + nb_vms]
+
+
+class FingerprintStore():
+    """
+    SQLite store with the desired state fingerprint and Zabbix host ID
+    of each NetBox object. A fraction of the hosts is always verified
+    against Zabbix so that changes made in Zabbix are reverted over time.
+    INPUT: path of the SQLite database, fraction of hosts to verify each run and logger
+    """
+
+    def __init__(self, db_path, verify_fraction, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS hosts (object_type TEXT, object_id INTEGER, "
+                        "hostid TEXT, fingerprint TEXT, PRIMARY KEY (object_type, object_id))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'run'").fetchone()
+        self.run = int(row[0]) + 1 if row else 0
+        # Verify every host once every <period> runs
+        self.period = max(1, round(1 / verify_fraction)) if verify_fraction > 0 else None
+        self.hosts = {(object_type, object_id): (hostid, fingerprint) for
+                      object_type, object_id, hostid, fingerprint in
+                      self.db.execute("SELECT object_type, object_id, hostid, fingerprint "
+                                      "FROM hosts")}
+        self.changed = {}
+        self.skipped = 0
+        self.lock = Lock()
+
+    def verify(self, object_id):
+        """Returns True when the host has to be verified against Zabbix this run"""
+        return bool(self.period) and object_id % self.period == self.run % self.period
+
+    def known(self, object_type, object_id, hostid):
+        """Returns True when a fingerprint of this host is known and does not need verification"""
+        stored = self.hosts.get((object_type, object_id))
+        return (bool(stored) and stored[0] == str(hostid)
+                and not self.verify(object_id))
+
+    def unchanged(self, host):
+        """
+        Returns True when the desired state of the host is unchanged
+        since the last successful check and the host does not need verification.
+        INPUT: PhysicalDevice or VirtualMachine object with its fingerprint set
+        """
+        if not self.known(host.nb_object_type, host.id, host.zabbix_id):
+            return False
+        if self.hosts[(host.nb_object_type, host.id)][1] != host.fingerprint:
+            return False
+        with self.lock:
+            self.skipped += 1
+        return True
+
+    def store(self, host):
+        """Stores the fingerprint of a host which is in-sync with Zabbix"""
+        with self.lock:
+            self.changed[(host.nb_object_type, host.id)] = (str(host.zabbix_id),
+                                                            host.fingerprint)
+
+    def prefetch_ids(self, nb_objects, object_type):
+        """
+        Returns the Zabbix host IDs of NetBox objects which are
+        likely to be checked against Zabbix during this run.
+        """
+        hostids = []
+        for nb_obj in nb_objects:
+            hostid = nb_obj.custom_fields.get(device_cf)
+            if hostid and not self.known(object_type, nb_obj.id, hostid):
+                hostids.append(hostid)
+        return hostids
+
+    def save(self):
+        """Writes all new fingerprints to the database"""
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO hosts VALUES (?, ?, ?, ?)",
+                                [key + value for key, value in self.changed.items()])
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('run', ?)", (str(self.run),))
+            self.db.commit()
+            self.logger.info(f"Fingerprint store: skipped {self.skipped} unchanged host(s), "
+                             f"stored {len(self.changed)} fingerprint(s).")
+            self.hosts.update(self.changed)
+            self.changed = {}
+
+    def close(self):
+        """Closes the database"""
+        self.db.close()
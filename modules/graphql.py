@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, duplicate-code
+"""
+GraphQL NetBox loader. Devices and VMs are requested with a single paginated
+GraphQL query which contains exactly the fields used by the sync, based on
+the active configuration. The results are converted to the format of the
+REST API so that they can be used as regular pynetbox records.
+"""
+import json
+from logging import getLogger
+from os import sys
+from modules.exceptions import SyncExternalError
+from modules.hostgroups import format_options_used
+from modules.incremental import DEVICE, VM
+from modules.prefetch import netbox_endpoint
+from modules.tools import chunks
+try:
+    from config import (
+        inventory_sync,
+        inventory_map,
+        hostgroup_format,
+        vm_hostgroup_format
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+          "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(1)
+
+# Fields which are used for every device and VM
+BASE_FIELDS = ["id", "name", "status", "custom_fields", "config_context",
+               "primary_ip4/address", "primary_ip6/address", "tenant/name"]
+# Fields used to generate the hostgroup. Only the fields of the
+# format options in the hostgroup format are requested.
+HOSTGROUP_FIELDS = {"region": "site/region/name",
+                    "site_group": "site/group/name",
+                    "site": "site/name",
+                    "role": "role/name",
+                    "tenant": "tenant/name",
+                    "tenant_group": "tenant/group/name",
+                    "platform": "platform/name"}
+DEVICE_HOSTGROUP_FIELDS = {"manufacturer": "device_type/manufacturer/name",
+                           "location": "location/name"}
+VM_HOSTGROUP_FIELDS = {"cluster": "cluster/name",
+                       "cluster_type": "cluster/type/name"}
+# Fields used for templates (template_cf) and virtual chassis. The manufacturer
+# is part of the error of a device type without template, whatever the hostgroup.
+DEVICE_FIELDS = ["device_type/model", "device_type/manufacturer/name",
+                 "device_type/custom_fields", "virtual_chassis/name",
+                 "virtual_chassis/master/id"]
+# Fields which are returned as a single value by GraphQL. Paths in the
+# inventory_map which go deeper are resolved locally.
+SCALAR_FIELDS = ("status", "custom_fields", "config_context", "local_context_data")
+# GraphQL queries and REST endpoints per object type
+QUERIES = {DEVICE: ("device_list", "dcim/devices"),
+           VM: ("virtual_machine_list", "virtualization/virtual-machines")}
+# Filters of NetBox 4.3 and newer use lookups instead of the REST filter names.
+# Text fields of which the REST filters can be converted to lookups.
+TEXT_FIELDS = ("name", "serial", "asset_tag", "description")
+# Related objects which are filtered by their slug or with <relation>_id
+RELATION_FIELDS = {"site": "site", "role": "role", "platform": "platform",
+                   "tenant": "tenant", "location": "location", "cluster": "cluster",
+                   "device_type": "device_type", "tag": "tags"}
+# REST lookup expressions and the matching GraphQL lookup
+TEXT_LOOKUPS = {"ic": "i_contains", "ie": "i_exact", "isw": "i_starts_with",
+                "iew": "i_ends_with", "regex": "regex", "iregex": "i_regex"}
+
+
+def field_paths(object_type):
+    """
+    Returns all field paths which are needed for
+    a device or VM with the active configuration.
+    """
+    if object_type == VM:
+        fields = {**HOSTGROUP_FIELDS, **VM_HOSTGROUP_FIELDS}
+        return BASE_FIELDS + [fields[option] for option
+                              in format_options_used("vm", vm_hostgroup_format)]
+    fields = {**HOSTGROUP_FIELDS, **DEVICE_HOSTGROUP_FIELDS}
+    paths = BASE_FIELDS + [fields[option] for option
+                           in format_options_used("dev", hostgroup_format)] + DEVICE_FIELDS
+    if inventory_sync:
+        for nb_inv_field in inventory_map:
+            items = nb_inv_field.split("/")
+            if items[0] == "primary_ip":
+                paths += ["/".join(["primary_ip4"] + items[1:]),
+                          "/".join(["primary_ip6"] + items[1:])]
+                continue
+            for depth, item in enumerate(items):
+                if item in SCALAR_FIELDS:
+                    items = items[:depth + 1]
+                    break
+            paths.append("/".join(items))
+    return paths
+
+
+def graphql_value(value):
+    """Renders a Python value as GraphQL input value"""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key}: {graphql_value(item)}"
+                               for key, item in value.items()) + "}"
+    if isinstance(value, list | tuple):
+        return "[" + ", ".join(graphql_value(item) for item in value) + "]"
+    return json.dumps(value)
+
+
+def lookup_filter(base_filter):
+    """
+    Converts a REST filter to the lookup based filter of NetBox 4.3 and newer.
+    OUTPUT: dictionary or None when the filter can not be converted
+    """
+    # pylint: disable=too-many-return-statements
+    converted = {}
+    negated = {}
+    for key, value in base_filter.items():
+        values = [str(item) for item in (value if isinstance(value, list | tuple)
+                                         else [value])]
+        field, _, lookup = key.partition("__")
+        # Negated lookups such as n and nic are converted to a NOT filter
+        negate = lookup == "n" or (lookup[:1] == "n" and lookup[1:] in TEXT_LOOKUPS)
+        if negate:
+            lookup = lookup[1:]
+        if field in TEXT_FIELDS:
+            if not lookup:
+                condition = {field: {"in_list": values}}
+            elif lookup in TEXT_LOOKUPS and len(values) == 1:
+                condition = {field: {TEXT_LOOKUPS[lookup]: values[0]}}
+            else:
+                return None
+        elif not lookup and field.removesuffix("_id") in RELATION_FIELDS:
+            relation = RELATION_FIELDS[field.removesuffix("_id")]
+            attribute = "id" if field.endswith("_id") else "slug"
+            condition = {relation: {attribute: {"in_list": values}}}
+        else:
+            return None
+        target = negated if negate else converted
+        # A field can only be used once on each side of the filter
+        if any(name in target for name in condition):
+            return None
+        target.update(condition)
+    if len(negated) > 1:
+        return None
+    if negated:
+        converted["NOT"] = negated
+    return converted
+
+
+def selection(paths):
+    """
+    Converts a list of field paths to a GraphQL selection set.
+    The ID of each related object is always requested.
+    """
+    tree = {}
+    for field_path in paths:
+        node = tree
+        for item in field_path.split("/"):
+            node = node.setdefault(item, {})
+
+    def render(node):
+        fields = []
+        for name, children in node.items():
+            if children:
+                children.setdefault("id", {})
+                fields.append(f"{name} {{{render(children)}}}")
+            else:
+                fields.append(name)
+        return " ".join(fields)
+    return render(tree)
+
+
+def rest_format(value):
+    """
+    Converts GraphQL output to the format of the REST API.
+    IDs are converted to integers, the status to a value and label
+    and the primary IP is set just like NetBox does by default.
+    """
+    if isinstance(value, list):
+        return [rest_format(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    obj = {}
+    for key, item in value.items():
+        if key == "id" and item is not None:
+            obj[key] = int(item)
+        elif key in ("custom_fields", "config_context", "local_context_data"):
+            obj[key] = item
+        elif key == "status" and isinstance(item, str):
+            # GraphQL only returns the value, custom labels are not available
+            status = item.lower().removeprefix("status_")
+            obj[key] = {"value": status, "label": status.replace("-", " ").capitalize()}
+        else:
+            obj[key] = rest_format(item)
+    if "primary_ip4" in obj or "primary_ip6" in obj:
+        obj["primary_ip"] = obj.get("primary_ip6") or obj.get("primary_ip4")
+    if "model" in obj:
+        obj["display"] = obj["model"]
+    return obj
+
+
+class GraphqlLoader():
+    """
+    Loads NetBox devices and VMs using the GraphQL API.
+    INPUT: pynetbox API class, NetBox version, page size and logger
+    """
+
+    def __init__(self, netbox, nb_version, page_size, logger=None):
+        if not nb_version or int(nb_version.split(".")[0]) < 4:
+            raise SyncExternalError("The GraphQL loader requires NetBox 4.0 or newer.")
+        self.netbox = netbox
+        self.nb_version = nb_version
+        self.page_size = max(1, page_size)
+        self.logger = logger if logger else getLogger(__name__)
+        self.url = netbox.base_url.rstrip("/").removesuffix("/api") + "/graphql/"
+        self.headers = {"Accept": "application/json",
+                        "Content-Type": "application/json"}
+        if netbox.token:
+            scheme = "Bearer" if netbox.token.startswith("nbt_") else "Token"
+            self.headers["Authorization"] = f"{scheme} {netbox.token}"
+
+    def query(self, query):
+        """Sends a GraphQL query to NetBox and returns the data"""
+        resp = self.netbox.http_session.post(self.url, headers=self.headers,
+                                             data=json.dumps({"query": query}))
+        if not resp.ok:
+            raise SyncExternalError(f"NetBox GraphQL returned HTTP {resp.status_code}: "
+                                    f"{resp.text}")
+        body = resp.json()
+        if body.get("errors"):
+            errors = "; ".join(error.get("message", "") for error in body["errors"])
+            raise SyncExternalError(f"NetBox GraphQL error: {errors}")
+        return body["data"]
+
+    def lookups(self):
+        """Returns True when NetBox uses lookup based GraphQL filters (4.3 and newer)"""
+        return tuple(int(part) for part in self.nb_version.split(".")[:2]) >= (4, 3)
+
+    def id_filter(self, ids):
+        """Returns the GraphQL filter for a list of IDs"""
+        id_list = [str(object_id) for object_id in ids]
+        return {"id": {"in_list": id_list} if self.lookups() else id_list}
+
+    def base_filter(self, base_filter):
+        """
+        Converts a REST filter to a GraphQL filter. Up to NetBox 4.2 the GraphQL
+        filters are generated from the REST filters and have the same names.
+        OUTPUT: dictionary or None when the filter can not be used with GraphQL
+        """
+        if self.lookups():
+            return lookup_filter(base_filter)
+        return {key: value if isinstance(value, bool) else
+                [str(item) for item in (value if isinstance(value, list | tuple) else [value])]
+                for key, value in base_filter.items()}
+
+    def paginate(self, list_name, fields, filters=None, total=None):
+        """
+        Requests all pages of a GraphQL list query. NetBox can return less
+        objects than requested (MAX_PAGE_SIZE), so a short first page is
+        followed by one more request and its length is used as page size.
+        INPUT: name of the list query, selection set, filter and
+        the maximum number of objects when it is known (ID filters)
+        OUTPUT: list of objects as returned by GraphQL
+        """
+        arguments = f"filters: {graphql_value(filters)}, " if filters else ""
+        page_size = min(self.page_size, total) if total else self.page_size
+        results = []
+        while True:
+            page = self.query(f"query {{{list_name}({arguments}pagination: {{offset: "
+                              f"{len(results)}, limit: {page_size}}}) {{{fields}}}}}"
+                              )[list_name]
+            first_page = not results
+            results.extend(page)
+            if not page or (len(page) < page_size and not first_page) or \
+                    (total and len(results) >= total):
+                return results
+            page_size = len(page)
+
+    def fetch(self, object_type, base_filter, ids=None):
+        """
+        Gets all devices or VMs which match the REST filter.
+        Only the objects with the given IDs are requested when IDs are set.
+        OUTPUT: list of pynetbox records
+        """
+        list_name, path = QUERIES[object_type]
+        endpoint = netbox_endpoint(self.netbox, path)
+        filters = self.base_filter(base_filter) if base_filter else {}
+        if filters is None:
+            # The filter can not be expressed in GraphQL, the
+            # matching objects are selected using their ID instead.
+            self.logger.debug(f"GraphQL: filter {base_filter} is not supported by GraphQL, "
+                              "selecting the matching objects using the REST API.")
+            matching = {record.id for record in endpoint.filter(brief=1, **base_filter)}
+            ids = sorted(matching if ids is None else matching.intersection(ids))
+            filters = {}
+        fields = selection(field_paths(object_type))
+        results = []
+        if ids is not None:
+            for chunk in chunks(sorted(ids), self.page_size):
+                results.extend(self.paginate(list_name, fields,
+                                             {**filters, **self.id_filter(chunk)}, len(chunk)))
+        else:
+            results = self.paginate(list_name, fields, filters)
+        self.logger.debug(f"GraphQL: got {len(results)} object(s) from {list_name}.")
+        return [endpoint.return_obj(rest_format(obj), self.netbox, endpoint)
+                for obj in results]
+
+    def devices(self, base_filter, ids=None):
+        """Gets all devices which match the filter"""
+        return self.fetch(DEVICE, base_filter, ids)
+
+    def vms(self, base_filter, ids=None):
+        """Gets all VMs which match the filter"""
+        return self.fetch(VM, base_filter, ids)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Module that collects the changes which are needed
+to bring a Zabbix host back in-sync with NetBox.
+"""
+
+
+class HostDiff():
+    """
+    Represents all changes for a single Zabbix host.
+    INPUT: Zabbix host ID and hostname
+    """
+
+    def __init__(self, hostid, name):
+        self.hostid = hostid
+        self.name = name
+        # Parameters for host.update
+        self.host = {}
+        # Parameters for hostinterface.update
+        self.interface = {}
+        # Names of the properties which are out of sync
+        self.changes = []
+
+    def __repr__(self):
+        return f"HostDiff for {self.name}: {self.summary()}"
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __bool__(self):
+        return bool(self.host or self.interface)
+
+    def add(self, change, **kwargs):
+        """
+        Adds host.update parameters to the diff.
+        INPUT: name of the changed property and host.update parameters
+        """
+        self.host.update(kwargs)
+        if change not in self.changes:
+            self.changes.append(change)
+
+    def add_interface(self, interfaceid, updates):
+        """
+        Adds hostinterface.update parameters to the diff.
+        INPUT: Zabbix interface ID and the changed interface parameters
+        """
+        self.interface = dict(updates, interfaceid=interfaceid)
+        if "interface" not in self.changes:
+            self.changes.append("interface")
+
+    def host_parameters(self):
+        """Returns the host.update parameters including the host ID"""
+        return dict(self.host, hostid=self.hostid)
+
+    def summary(self):
+        """Returns a readable summary of all changes"""
+        return ", ".join(self.changes) if self.changes else "no changes"
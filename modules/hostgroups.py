@@ -1,7 +1,99 @@
 """Module for all hostgroup related code"""
+from functools import lru_cache
 from logging import getLogger
 from modules.exceptions import HostgroupError
-from modules.tools import build_path
+
+# Default hostgroup format per object type
+DEFAULT_FORMATS = {"dev": "site/manufacturer/role", "vm": "cluster/role"}
+# Returned by a format option which is not available for a host,
+# the item is then looked up as custom field just like any unknown item
+NOT_AVAILABLE = object()
+
+
+def _object_id(obj):
+    """Returns the ID of a NetBox object or None when it is not set"""
+    return obj.id if obj else None
+
+
+def _role(hg):
+    """Returns the role of a host. Devices use device_role up to NetBox 3"""
+    if hg.type == "dev" and hg.nb_version.startswith(("2", "3")):
+        return hg.nb.device_role
+    return hg.nb.role
+
+
+def _site_parents(hg, nest_type, field):
+    """Returns the (nested) region or site group of the site of a host"""
+    if not hg.nb.site or not getattr(hg.nb.site, field):
+        return None
+    return hg.generate_parents(nest_type, getattr(hg.nb.site, field))
+
+
+# Format options per object type. Each option has a function which returns its
+# value and a function which returns the ID of the NetBox object that determines
+# the value. Hosts with the same IDs for all items of a format share the hostgroup.
+# Options are only evaluated when they are used in the hostgroup format.
+# Both functions return NOT_AVAILABLE when an option is not available for a host.
+COMMON_OPTIONS = {
+    "region": (lambda hg: _site_parents(hg, "region", "region"),
+               lambda hg: _object_id(hg.nb.site)),
+    "site_group": (lambda hg: _site_parents(hg, "site_group", "group"),
+                   lambda hg: _object_id(hg.nb.site)),
+    "role": (lambda hg: _role(hg).name if _role(hg) else None,
+             lambda hg: _object_id(_role(hg))),
+    "site": (lambda hg: hg.nb.site.name if hg.nb.site else None,
+             lambda hg: _object_id(hg.nb.site)),
+    "tenant": (lambda hg: str(hg.nb.tenant) if hg.nb.tenant else None,
+               lambda hg: _object_id(hg.nb.tenant)),
+    "tenant_group": (lambda hg: str(hg.nb.tenant.group) if hg.nb.tenant else None,
+                     lambda hg: _object_id(hg.nb.tenant)),
+    "platform": (lambda hg: hg.nb.platform.name if hg.nb.platform else None,
+                 lambda hg: _object_id(hg.nb.platform)),
+}
+FORMAT_OPTIONS = {
+    "dev": {**COMMON_OPTIONS,
+            "manufacturer": (lambda hg: hg.nb.device_type.manufacturer.name,
+                             lambda hg: _object_id(hg.nb.device_type)),
+            "location": (lambda hg: str(hg.nb.location) if hg.nb.location else None,
+                         lambda hg: _object_id(hg.nb.location))},
+    # A cluster is optional for VMs. Without a cluster the cluster
+    # options are looked up as custom field.
+    "vm": {**COMMON_OPTIONS,
+           "cluster": (lambda hg: hg.nb.cluster.name if hg.nb.cluster else NOT_AVAILABLE,
+                       lambda hg: hg.nb.cluster.id if hg.nb.cluster else NOT_AVAILABLE),
+           "cluster_type": (lambda hg: hg.nb.cluster.type.name if hg.nb.cluster
+                            else NOT_AVAILABLE,
+                            lambda hg: hg.nb.cluster.id if hg.nb.cluster else NOT_AVAILABLE)},
+}
+
+
+@lru_cache(maxsize=None)
+def compile_format(obj_type, hg_format=None):
+    """
+    Compiles a hostgroup format once for all hosts.
+    INPUT: object type ("vm" or "dev") and hostgroup format
+    OUTPUT: tuple with an item name and its format option for every item
+    in the format. The option is None for items which are custom fields.
+    """
+    options = FORMAT_OPTIONS[obj_type]
+    return tuple((item, options.get(item))
+                 for item in (hg_format or DEFAULT_FORMATS[obj_type]).split("/"))
+
+
+def format_options_used(obj_type, hg_format=None):
+    """Returns the names of the format options which are used in a hostgroup format"""
+    return [item for item, option in compile_format(obj_type, hg_format) if option]
+
+
+def hostgroup_paths(hostgroup):
+    """
+    Returns a nested hostgroup and all of its parents, parents first.
+    INPUT: hostgroup name such as "Europe/Amsterdam/Switches"
+    OUTPUT: ["Europe", "Europe/Amsterdam", "Europe/Amsterdam/Switches"]
+    """
+    parts = hostgroup.split("/")
+    return ["/".join(parts[:pos]) for pos in range(1, len(parts) + 1)]
+
 
 class Hostgroup():
     """Hostgroup class for devices and VM's
@@ -21,7 +113,6 @@ class Hostgroup():
         # Used for nested data objects
         self.set_nesting(nested_sitegroup_flag, nested_region_flag,
                          nb_groups, nb_regions)
-        self._set_format_options()
 
     def __str__(self):
         return f"Hostgroup for {self.type} {self.name}"
@@ -29,66 +120,54 @@ class Hostgroup():
     def __repr__(self):
         return self.__str__()
 
-    def _set_format_options(self):
+    @property
+    def format_options(self):
         """
-        Set all available variables
-        for hostgroup generation
+        All available variables for hostgroup generation.
+        Only used for troubleshooting, generate only evaluates
+        the variables which are used in the hostgroup format.
         """
         format_options = {}
-        # Set variables for both type of devices
-        if self.type in ("vm", "dev"):
-            # Role fix for NetBox <=3
-            role = None
-            if self.nb_version.startswith(("2", "3")) and self.type == "dev":
-                role = self.nb.device_role.name if self.nb.device_role else None
-            else:
-                role = self.nb.role.name if self.nb.role else None
-            # Add default formatting options
-            # Check if a site is configured. A site is optional for VMs
-            format_options["region"] = None
-            format_options["site_group"] = None
-            if self.nb.site:
-                if self.nb.site.region:
-                    format_options["region"] = self.generate_parents("region",
-                                                                     str(self.nb.site.region))
-                if self.nb.site.group:
-                    format_options["site_group"] = self.generate_parents("site_group",
-                                                                         str(self.nb.site.group))
-            format_options["role"] = role
-            format_options["site"] = self.nb.site.name if self.nb.site else None
-            format_options["tenant"] = str(self.nb.tenant) if self.nb.tenant else None
-            format_options["tenant_group"] = str(self.nb.tenant.group) if self.nb.tenant else None
-            format_options["platform"] = self.nb.platform.name if self.nb.platform else None
-        # Variables only applicable for devices
-        if self.type == "dev":
-            format_options["manufacturer"] = self.nb.device_type.manufacturer.name
-            format_options["location"] = str(self.nb.location) if self.nb.location else None
-        # Variables only applicable for VM's
-        if self.type == "vm":
-            # Check if a cluster is configured. Could also be configured in a site.
-            if self.nb.cluster:
-                format_options["cluster"] = self.nb.cluster.name
-                format_options["cluster_type"] = self.nb.cluster.type.name
-
-        self.format_options = format_options
+        for option_type, (value, _) in FORMAT_OPTIONS[self.type].items():
+            option_value = value(self)
+            if option_value is not NOT_AVAILABLE:
+                format_options[option_type] = option_value
+        return format_options
 
     def set_nesting(self, nested_sitegroup_flag, nested_region_flag,
                     nb_groups, nb_regions):
-        """Set nesting options for this Hostgroup"""
+        """
+        Set nesting options for this Hostgroup.
+        nb_groups and nb_regions are dictionaries with the NetBox ID
+        as key and the path of parent names as value.
+        """
         self.nested_objects = {"site_group": {"flag": nested_sitegroup_flag, "data": nb_groups},
                                "region": {"flag": nested_region_flag, "data": nb_regions}}
 
+    def key(self, hg_format=None):
+        """
+        Returns a key which identifies the generated hostgroup. Hosts with the
+        same key get the same hostgroup, so the hostgroup can be memoized.
+        Custom fields are part of the key with their value.
+        """
+        items = []
+        for item, option in compile_format(self.type, hg_format):
+            item_key = option[1](self) if option else NOT_AVAILABLE
+            if item_key is NOT_AVAILABLE:
+                # The item is a custom field
+                item_key = (("cf", str(self.nb.custom_fields[item]))
+                            if item in self.nb.custom_fields else None)
+            items.append(item_key)
+        return (self.type, hg_format, tuple(items))
+
     def generate(self, hg_format=None):
         """Generate hostgroup based on a provided format"""
-        # Set format to default in case its not specified
-        if not hg_format:
-            hg_format = "site/manufacturer/role" if self.type == "dev" else "cluster/role"
-        # Split all given names
         hg_output = []
-        hg_items = hg_format.split("/")
-        for hg_item in hg_items:
+        # Only the options which are used in the format are evaluated
+        for hg_item, option in compile_format(self.type, hg_format):
+            hostgroup_value = option[0](self) if option else NOT_AVAILABLE
             # Check if requested data is available as option for this host
-            if hg_item not in self.format_options:
+            if hostgroup_value is NOT_AVAILABLE:
                 # Check if a custom field exists with this name
                 cf_data = self.custom_field_lookup(hg_item)
                 # CF does not exist
@@ -103,7 +182,6 @@ class Hostgroup():
                 continue
             # Check if there is a value associated to the variable.
             # For instance, if a device has no location, do not use it with hostgroup calculation
-            hostgroup_value = self.format_options[hg_item]
             if hostgroup_value:
                 hg_output.append(hostgroup_value)
         # Check if the hostgroup is populated with at least one item.
@@ -149,15 +227,15 @@ class Hostgroup():
         """
         Generates parent objects to implement nested regions / nested site groups
         INPUT: nest_type to set which type of nesting is going to be processed
-        child_object: the name of the child object (for instance the last NB region)
+        child_object: the child object (for instance the last NB region)
         OUTPUT: STRING - Either the single child name or child and parents.
         """
         # Check if this type of nesting is supported.
         if not nest_type in self.nested_objects:
-            return child_object
-        # If the nested flag is True, perform parent calculation
-        if self.nested_objects[nest_type]["flag"]:
-            final_nested_object = build_path(child_object, self.nested_objects[nest_type]["data"])
-            return "/".join(final_nested_object)
+            return str(child_object)
+        # If the nested flag is True, lookup the precomputed path of parents
+        if self.nested_objects[nest_type]["flag"] and self.nested_objects[nest_type]["data"]:
+            return self.nested_objects[nest_type]["data"].get(child_object.id,
+                                                              str(child_object))
         # Nesting is not allowed for this object. Return child_object
-        return child_object
+        return str(child_object)
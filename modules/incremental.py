@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, too-many-instance-attributes, duplicate-code
+"""
+Incremental sync. Keeps track of the last successful run so that only
+NetBox devices and VMs which have changed since then are synced.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from os import path, replace, sys
+from threading import Lock
+from modules.tools import chunks
+from modules.options import apply_defaults
+try:
+    apply_defaults()
+    from config import (
+        incremental_state_file,
+        full_sync_interval
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+          "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(1)
+
+# Changes made during the previous run can be committed with a timestamp
+# just before the high-water mark, also covers small clock differences.
+OVERLAP = timedelta(minutes=5)
+# Maximum number of IDs in a single NetBox filter
+ID_CHUNK_SIZE = 100
+DEVICE = "dcim.device"
+VM = "virtualization.virtualmachine"
+# Related NetBox objects which influence the sync outcome and the
+# filter which is used to find the devices or VMs they affect.
+DEVICE_RELATIONS = {"dcim.devicetype": "device_type_id",
+                    "dcim.manufacturer": "manufacturer_id",
+                    "dcim.devicerole": "role_id",
+                    "dcim.platform": "platform_id",
+                    "dcim.site": "site_id",
+                    "dcim.sitegroup": "site_group_id",
+                    "dcim.region": "region_id",
+                    "dcim.location": "location_id",
+                    "dcim.virtualchassis": "virtual_chassis_id",
+                    "tenancy.tenant": "tenant_id",
+                    "tenancy.tenantgroup": "tenant_group_id"}
+VM_RELATIONS = {"virtualization.cluster": "cluster_id",
+                "virtualization.clustergroup": "cluster_group_id",
+                "virtualization.clustertype": "cluster_type_id",
+                "dcim.devicerole": "role_id",
+                "dcim.platform": "platform_id",
+                "dcim.site": "site_id",
+                "dcim.sitegroup": "site_group_id",
+                "dcim.region": "region_id",
+                "tenancy.tenant": "tenant_id",
+                "tenancy.tenantgroup": "tenant_group_id"}
+# Changes of these objects can affect any host, a full sync is required.
+FULL_SYNC_OBJECTS = ("extras.configcontext", "extras.customfield")
+
+
+class IncrementalSync():
+    """
+    Determines which NetBox devices and VMs need to be synced.
+    INPUT: pynetbox API class, NetBox version, path of the state file and logger
+    """
+
+    def __init__(self, netbox, nb_version, state_file=incremental_state_file, logger=None):
+        self.netbox = netbox
+        self.nb_version = nb_version
+        self.state_file = state_file
+        self.logger = logger if logger else getLogger(__name__)
+        self.started = datetime.now(timezone.utc)
+        self.since = None
+        self.full = True
+        self.device_ids = set()
+        self.vm_ids = set()
+        # Hosts which failed during this run, these are retried next run.
+        self.failed = {DEVICE: set(), VM: set()}
+        self.lock = Lock()
+        self.state = self.load()
+
+    def load(self):
+        """Loads the state of the previous run"""
+        if not path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Unable to read incremental state file "
+                                f"{self.state_file}: {e}. Running a full sync.")
+            return {}
+
+    def save(self):
+        """Stores the high-water mark after a successful run"""
+        state = {"last_run": self.started.isoformat(),
+                 "last_full": (self.started.isoformat() if self.full
+                               else self.state.get("last_full")),
+                 "retry": {key: sorted(ids) for key, ids in self.failed.items()}}
+        temp_file = f"{self.state_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        replace(temp_file, self.state_file)
+        self.logger.debug(f"Stored incremental state, high-water mark {state['last_run']}.")
+
+    def retry(self, object_type, object_id):
+        """Marks a device or VM as failed so that it is synced again next run"""
+        with self.lock:
+            self.failed[object_type].add(object_id)
+
+    def plan(self, force_full=False):
+        """
+        Determines if a full sync is required. If not then the
+        IDs of all changed devices and VMs are collected.
+        """
+        last_run = self.state.get("last_run")
+        last_full = self.state.get("last_full")
+        if force_full or not last_run or not last_full:
+            self.logger.info("Incremental sync: running a full sync.")
+            return
+        if self.started - datetime.fromisoformat(last_full) > timedelta(hours=full_sync_interval):
+            self.logger.info(f"Incremental sync: last full sync is older than "
+                             f"{full_sync_interval} hour(s), running a full sync.")
+            return
+        self.since = (datetime.fromisoformat(last_run) - OVERLAP).isoformat()
+        changes = self.object_changes()
+        full_objects = [object_type for object_type in changes if object_type in FULL_SYNC_OBJECTS]
+        if full_objects:
+            self.logger.info(f"Incremental sync: {', '.join(full_objects)} changed since "
+                             f"the last run, running a full sync.")
+            return
+        self.full = False
+        retry = self.state.get("retry", {})
+        self.device_ids = (self.updated(self.netbox.dcim.devices) | changes.get(DEVICE, set())
+                           | set(retry.get(DEVICE, []))
+                           | self.related(self.netbox.dcim.devices, DEVICE_RELATIONS, changes))
+        self.vm_ids = (self.updated(self.netbox.virtualization.virtual_machines)
+                       | changes.get(VM, set()) | set(retry.get(VM, []))
+                       | self.related(self.netbox.virtualization.virtual_machines,
+                                      VM_RELATIONS, changes))
+        self.add_ip_changes(changes.get("ipam.ipaddress", set()))
+        self.logger.info(f"Incremental sync: {len(self.device_ids)} device(s) and "
+                         f"{len(self.vm_ids)} VM(s) changed since {self.since}.")
+
+    def object_changes(self):
+        """
+        Gets all object changes since the previous run.
+        OUTPUT: dictionary with the object type as key and a set of IDs as value.
+        """
+        # The changelog has been moved to the core app in NetBox 4.1
+        major, minor = (int(part) for part in self.nb_version.split(".")[:2])
+        if (major, minor) >= (4, 1):
+            endpoint = self.netbox.core.object_changes
+        else:
+            endpoint = self.netbox.extras.object_changes
+        changes = {}
+        for change in endpoint.filter(time_after=self.since):
+            changes.setdefault(change.changed_object_type, set()).add(change.changed_object_id)
+        return changes
+
+    def updated(self, endpoint):
+        """Returns the IDs of all objects which have been updated since the previous run"""
+        return {obj.id for obj in endpoint.filter(last_updated__gte=self.since, brief=True)}
+
+    def related(self, endpoint, relations, changes):
+        """Returns the IDs of all objects which are linked to a changed related object"""
+        ids = set()
+        for object_type, nb_filter in relations.items():
+            for chunk in chunks(sorted(changes.get(object_type, [])), ID_CHUNK_SIZE):
+                ids |= {obj.id for obj in endpoint.filter(**{nb_filter: chunk}, brief=True)}
+        return ids
+
+    def add_ip_changes(self, ip_ids):
+        """Adds the devices and VMs of changed IP addresses"""
+        for chunk in chunks(sorted(ip_ids), ID_CHUNK_SIZE):
+            for ip in self.netbox.ipam.ip_addresses.filter(id=chunk):
+                interface = ip.assigned_object
+                if not interface:
+                    continue
+                if getattr(interface, "device", None):
+                    self.device_ids.add(interface.device.id)
+                elif getattr(interface, "virtual_machine", None):
+                    self.vm_ids.add(interface.virtual_machine.id)
+
+    @staticmethod
+    def filters(base_filter, ids):
+        """
+        Returns the NetBox filters to get the objects with the given IDs.
+        The configured filter is kept so that the sync scope does not change.
+        """
+        return [dict(base_filter, id=chunk) for chunk in chunks(sorted(ids), ID_CHUNK_SIZE)]
+
+    def devices(self, base_filter):
+        """Gets all changed NetBox devices"""
+        return [device for nb_filter in self.filters(base_filter, self.device_ids)
+                for device in self.netbox.dcim.devices.filter(**nb_filter)]
+
+    def vms(self, base_filter):
+        """Gets all changed NetBox VMs"""
+        return [vm for nb_filter in self.filters(base_filter, self.vm_ids)
+                for vm in self.netbox.virtualization.virtual_machines.filter(**nb_filter)]
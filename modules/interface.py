@@ -43,7 +43,10 @@ class ZabbixInterface():
         return False
 
     def set_snmp(self):
-        """ Check if interface is type SNMP """
+        """
+        Check if interface is type SNMP. The config context is not
+        changed, so the interface can be set more than once per host.
+        """
         # pylint: disable=too-many-branches
         if self.interface["type"] == 2:
             # Checks if SNMP settings are defined in NetBox
@@ -52,13 +55,13 @@ class ZabbixInterface():
                 self.interface["details"] = {}
                 # Checks if bulk config has been defined
                 if "bulk" in snmp:
-                    self.interface["details"]["bulk"] = str(snmp.pop("bulk"))
+                    self.interface["details"]["bulk"] = str(snmp["bulk"])
                 else:
                     # Fallback to bulk enabled if not specified
                     self.interface["details"]["bulk"] = "1"
                 # SNMP Version config is required in NetBox config context
                 if snmp.get("version"):
-                    self.interface["details"]["version"] = str(snmp.pop("version"))
+                    self.interface["details"]["version"] = str(snmp["version"])
                 else:
                     e = "SNMP version option is not defined."
                     raise InterfaceConfigError(e)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Compiled inventory_map. The map is validated once per run and each NetBox
+path is split into an accessor only once. Related objects of which a path
+uses more than the nested representation are prefetched in bulk instead
+of being loaded by pynetbox for each device. Problems with a path are
+reported once per run instead of once for every host. The path is still
+evaluated for every host, since the same map is used for devices and
+virtual machines and a path may only exist for some of them.
+"""
+from logging import getLogger
+from threading import Lock
+
+# Host inventory properties of Zabbix
+ZABBIX_INVENTORY_FIELDS = frozenset((
+    "type", "type_full", "name", "alias", "os", "os_full", "os_short",
+    "serialno_a", "serialno_b", "tag", "asset_tag", "macaddress_a", "macaddress_b",
+    "hardware", "hardware_full", "software", "software_full", "software_app_a",
+    "software_app_b", "software_app_c", "software_app_d", "software_app_e",
+    "contact", "location", "location_lat", "location_lon", "notes", "chassis",
+    "model", "hw_arch", "vendor", "contract_number", "installer_name",
+    "deployment_status", "url_a", "url_b", "url_c", "host_networks", "host_netmask",
+    "host_router", "oob_ip", "oob_netmask", "oob_router", "date_hw_purchase",
+    "date_hw_install", "date_hw_expiry", "date_hw_decomm", "site_address_a",
+    "site_address_b", "site_address_c", "site_city", "site_state", "site_country",
+    "site_zip", "site_rack", "site_notes", "poc_1_name", "poc_1_email",
+    "poc_1_phone_a", "poc_1_phone_b", "poc_1_cell", "poc_1_screen", "poc_1_notes",
+    "poc_2_name", "poc_2_email", "poc_2_phone_a", "poc_2_phone_b", "poc_2_cell",
+    "poc_2_screen", "poc_2_notes"))
+# Related objects of a device which can be prefetched and their REST path
+DEVICE_INVENTORY_RELATIONS = {"site": "dcim/sites",
+                              "tenant": "tenancy/tenants",
+                              "device_type": "dcim/device-types",
+                              "virtual_chassis": "dcim/virtual-chassis",
+                              "location": "dcim/locations",
+                              "rack": "dcim/racks",
+                              "platform": "dcim/platforms",
+                              "role": "dcim/device-roles",
+                              "cluster": "virtualization/clusters",
+                              "primary_ip": "ipam/ip-addresses",
+                              "primary_ip4": "ipam/ip-addresses",
+                              "primary_ip6": "ipam/ip-addresses",
+                              "oob_ip": "ipam/ip-addresses"}
+# Fields which are part of the nested representation of a related object
+NESTED_FIELDS = {"id", "url", "display", "name", "slug", "description", "_depth",
+                 # Device types, IP addresses and virtual chassis
+                 "model", "manufacturer", "address", "family", "master", "member_count"}
+# Errors of a path which does not exist for an object
+PATH_ERRORS = (AttributeError, KeyError, IndexError, TypeError)
+
+
+class InventoryMap():
+    """
+    Compiled inventory_map of a single run.
+    INPUT: dictionary with NetBox paths as key and Zabbix
+    inventory fields as value (the inventory_map) and logger
+    """
+
+    def __init__(self, inventory_map, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        # Tuples of the NetBox path, its items and the Zabbix inventory field
+        self.fields = []
+        # Related objects which are needed by the paths, with their REST path
+        self.relations = {}
+        # Paths and the kind of problem which has been reported during this run
+        self.reported = set()
+        self.lock = Lock()
+        for nb_inv_field, zbx_inv_field in (inventory_map or {}).items():
+            items = nb_inv_field.split("/")
+            if not all(item.strip() for item in items):
+                self.logger.error(f"Inventory: NetBox path '{nb_inv_field}' in the "
+                                  "inventory_map is not valid. It will be skipped.")
+                continue
+            if zbx_inv_field not in ZABBIX_INVENTORY_FIELDS:
+                self.logger.error(f"Inventory: '{zbx_inv_field}' in the inventory_map is "
+                                  "not a Zabbix inventory field. It will be skipped.")
+                continue
+            self.fields.append((nb_inv_field, tuple(items), zbx_inv_field))
+            # Paths which use more than the nested representation of a related object
+            relation = DEVICE_INVENTORY_RELATIONS.get(items[0])
+            if relation and (len(items) > 2 or
+                             (len(items) == 2 and items[1] not in NESTED_FIELDS)):
+                self.relations[items[0]] = relation
+
+    def __len__(self):
+        return len(self.fields)
+
+    def report(self, nb_inv_field, problem, message):
+        """Reports each kind of problem with a path once per run"""
+        with self.lock:
+            if (nb_inv_field, problem) in self.reported:
+                return
+            self.reported.add((nb_inv_field, problem))
+        self.logger.error(f"Inventory: {message}")
+
+    def inventory(self, nb_obj, name):
+        """
+        Returns the Zabbix inventory of a NetBox object.
+        INPUT: pynetbox record and the name of the host
+        OUTPUT: dictionary with the Zabbix inventory field as key
+        """
+        inventory = {}
+        for nb_inv_field, items, zbx_inv_field in self.fields:
+            # Start at the base of the object and step through
+            # the object till we find the needed value
+            value = nb_obj
+            try:
+                for item in items:
+                    value = value[item] if value else None
+            except PATH_ERRORS:
+                self.report(nb_inv_field, "path", f"lookup for '{nb_inv_field}' failed, the path "
+                            f"does not exist for host {name}. It will be skipped for "
+                            "every host without this path, this is only reported once.")
+                continue
+            # Check if the result is usable and expected
+            # We want to apply any int or float 0 values,
+            # even if python thinks those are empty.
+            if ((value and isinstance(value, int | float | str)) or
+                    (isinstance(value, int | float) and int(value) == 0)):
+                inventory[zbx_inv_field] = str(value)
+            elif not value:
+                # empty value should just be an empty string for API compatibility
+                self.logger.debug(f"Host {name}: NetBox inventory lookup for "
+                                  f"'{nb_inv_field}' returned an empty value")
+                inventory[zbx_inv_field] = ""
+            else:
+                # Value is not a string or numeral, probably not what the user expected.
+                self.report(nb_inv_field, "type", f"lookup for '{nb_inv_field}' returned an "
+                            f"unexpected type for host {name}: it will be skipped for "
+                            "every host with this type, this is only reported once.")
+        return inventory
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Run metrics. Measures the duration of each phase of the sync, the number
+and latency of NetBox and Zabbix API requests and the outcome of each host.
+The metrics of a run are written as Prometheus textfile collector file
+and as JSON summary so that a growing runtime can be noticed in time.
+"""
+import json
+import os
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging import getLogger
+from threading import Lock
+from time import perf_counter, time
+from urllib.parse import urlparse
+from zabbix_utils import APIRequestError, ProcessingError
+
+PREFIX = "netbox_zabbix_sync"
+# Upper bounds in seconds of the API request duration histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Outcome of a single host
+CREATED = "created"
+UPDATED = "updated"
+IN_SYNC = "in_sync"
+SKIPPED = "skipped"
+DELETED = "deleted"
+ERRORED = "errored"
+OUTCOMES = (CREATED, UPDATED, IN_SYNC, SKIPPED, DELETED, ERRORED)
+# REST path of a NetBox request without the ID of a single object
+ENDPOINT = re.compile(r"(?:^|/api/)(?P<endpoint>[\w-]+/[\w-]+)")
+
+
+def netbox_endpoint_name(url):
+    """
+    Returns the endpoint of a NetBox request, for instance dcim/devices
+    INPUT: full URL or path relative to the API root
+    """
+    url_path = urlparse(url).path
+    match = ENDPOINT.search(url_path)
+    if match:
+        return match.group("endpoint")
+    return "graphql" if "/graphql" in url_path else "/"
+
+
+def label_value(value):
+    """Escapes a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def labels(**items):
+    """Formats Prometheus labels"""
+    return ",".join(f'{key}="{label_value(value)}"' for key, value in items.items())
+
+
+def write_file(filename, content):
+    """Writes a file atomically so that a collector never reads a partial file"""
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(temporary, filename)
+
+
+class Stopwatch():
+    """
+    Measures the phases of a single host.
+    INPUT: Metrics class and the first phase
+    """
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.start = perf_counter()
+
+    def next(self, phase):
+        """Ends the current phase and starts the next phase"""
+        now = perf_counter()
+        self.metrics.add_phase(self.phase, now - self.start)
+        self.phase = phase
+        self.start = now
+
+    def stop(self, outcome):
+        """
+        Ends the current phase and counts the outcome of the host.
+        OUTPUT: the outcome
+        """
+        self.metrics.add_phase(self.phase, perf_counter() - self.start)
+        self.metrics.host(outcome)
+        return outcome
+
+
+class Metrics():
+    # pylint: disable=too-many-instance-attributes
+    """
+    Collects the metrics of a single run.
+    INPUT: logger
+    """
+
+    def __init__(self, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        self.started = time()
+        self.start = perf_counter()
+        self.lock = Lock()
+        # Total seconds and number of measurements per phase
+        self.phases = defaultdict(lambda: [0.0, 0])
+        # Number, total seconds, errors and bucket counts per API and method
+        self.requests = {}
+        self.hosts = Counter()
+        # Number of hits and misses per cache
+        self.caches = defaultdict(lambda: [0, 0])
+
+    @contextmanager
+    def phase(self, name):
+        """Measures the duration of a phase"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, perf_counter() - start)
+
+    def add_phase(self, name, seconds):
+        """Adds a measurement to a phase"""
+        with self.lock:
+            self.phases[name][0] += seconds
+            self.phases[name][1] += 1
+
+    def stopwatch(self, phase):
+        """Returns a Stopwatch to measure the phases of a single host"""
+        return Stopwatch(self, phase)
+
+    def host(self, outcome, count=1):
+        """Counts the outcome of a host"""
+        with self.lock:
+            self.hosts[outcome] += count
+
+    def cache(self, name, hit):
+        """Counts a cache lookup"""
+        with self.lock:
+            self.caches[name][0 if hit else 1] += 1
+
+    def request(self, api, method, seconds, error=False):
+        """Adds an API request"""
+        with self.lock:
+            stats = self.requests.setdefault((api, method), {
+                "count": 0, "seconds": 0.0, "errors": 0, "buckets": [0] * len(BUCKETS)})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["errors"] += int(error)
+            bucket = bisect_left(BUCKETS, seconds)
+            if bucket < len(BUCKETS):
+                stats["buckets"][bucket] += 1
+
+    def attach_netbox(self, netbox):
+        """Measures all requests made through the pynetbox session"""
+        netbox.http_session.hooks["response"].append(self.netbox_hook)
+
+    def netbox_hook(self, response, *args, **kwargs):
+        """Response hook for the requests session of pynetbox"""
+        # pylint: disable=unused-argument
+        self.request("netbox", f"{response.request.method} "
+                     f"{netbox_endpoint_name(response.request.url)}",
+                     response.elapsed.total_seconds(), response.status_code >= 400)
+
+    def attach_zabbix(self, zabbix):
+        """Measures all requests made through a ZabbixAPI class"""
+        send = zabbix.send_api_request
+
+        def send_api_request(method, params=None, need_auth=True):
+            start = perf_counter()
+            try:
+                response = send(method, params, need_auth)
+            except (APIRequestError, ProcessingError):
+                self.request("zabbix", method, perf_counter() - start, True)
+                raise
+            self.request("zabbix", method, perf_counter() - start)
+            return response
+        zabbix.send_api_request = send_api_request
+
+    async def measure_async(self, api, method, coroutine):
+        """Measures an API request of the asynchronous clients"""
+        start = perf_counter()
+        try:
+            result = await coroutine
+        except Exception:
+            self.request(api, method, perf_counter() - start, True)
+            raise
+        self.request(api, method, perf_counter() - start)
+        return result
+
+    def summary(self):
+        """Returns the metrics of this run as dictionary"""
+        with self.lock:
+            api = defaultdict(dict)
+            for (api_name, method), stats in sorted(self.requests.items()):
+                api[api_name][method] = {"count": stats["count"],
+                                         "errors": stats["errors"],
+                                         "seconds": round(stats["seconds"], 3)}
+            return {
+                "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                "duration_seconds": round(perf_counter() - self.start, 3),
+                "phases": {name: {"seconds": round(seconds, 3), "count": count}
+                           for name, (seconds, count) in self.phases.items()},
+                "hosts": {outcome: self.hosts[outcome] for outcome in OUTCOMES},
+                "caches": {name: {"hits": hits, "misses": misses,
+                                  "hit_rate": round(hits / (hits + misses), 3)}
+                           for name, (hits, misses) in self.caches.items()},
+                "api": dict(api)}
+
+    def prometheus(self):
+        """Returns the metrics of this run in the Prometheus text format"""
+        # pylint: disable=too-many-locals
+        summary = self.summary()
+        lines = [f"# HELP {PREFIX}_last_run_timestamp_seconds "
+                 "Unix time at which the last run finished.",
+                 f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge",
+                 f"{PREFIX}_last_run_timestamp_seconds {time():.3f}",
+                 f"# HELP {PREFIX}_duration_seconds Duration of the last run.",
+                 f"# TYPE {PREFIX}_duration_seconds gauge",
+                 f"{PREFIX}_duration_seconds {summary['duration_seconds']}",
+                 f"# HELP {PREFIX}_phase_seconds Time spent per phase, "
+                 "summed over all hosts for host phases.",
+                 f"# TYPE {PREFIX}_phase_seconds gauge"]
+        for name, phase in summary["phases"].items():
+            lines.append(f"{PREFIX}_phase_seconds{{{labels(phase=name)}}} {phase['seconds']}")
+        lines += [f"# HELP {PREFIX}_phase_count Number of measurements per phase.",
+                  f"# TYPE {PREFIX}_phase_count gauge"]
+        for name, phase in summary["phases"].items():
+            lines.append(f"{PREFIX}_phase_count{{{labels(phase=name)}}} {phase['count']}")
+        lines += [f"# HELP {PREFIX}_hosts Number of hosts per outcome.",
+                  f"# TYPE {PREFIX}_hosts gauge"]
+        for outcome, count in summary["hosts"].items():
+            lines.append(f"{PREFIX}_hosts{{{labels(outcome=outcome)}}} {count}")
+        lines += [f"# HELP {PREFIX}_cache_lookups Number of cache lookups per result.",
+                  f"# TYPE {PREFIX}_cache_lookups gauge"]
+        for name, cache in summary["caches"].items():
+            for result in ("hits", "misses"):
+                lines.append(f"{PREFIX}_cache_lookups{{{labels(cache=name, result=result)}}} "
+                             f"{cache[result]}")
+        lines += [f"# HELP {PREFIX}_api_request_duration_seconds "
+                  "Duration of the API requests per method.",
+                  f"# TYPE {PREFIX}_api_request_duration_seconds histogram"]
+        errors = []
+        with self.lock:
+            for (api, method), stats in sorted(self.requests.items()):
+                name = f"{PREFIX}_api_request_duration_seconds"
+                request_labels = labels(api=api, method=method)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{request_labels},le="{bound}"}} '
+                                 f'{cumulative}')
+                lines += [f'{name}_bucket{{{request_labels},le="+Inf"}} {stats["count"]}',
+                          f"{name}_sum{{{request_labels}}} {stats['seconds']:.6f}",
+                          f"{name}_count{{{request_labels}}} {stats['count']}"]
+                errors.append(f"{PREFIX}_api_request_errors{{{request_labels}}} "
+                              f"{stats['errors']}")
+        lines += [f"# HELP {PREFIX}_api_request_errors Failed API requests per method.",
+                  f"# TYPE {PREFIX}_api_request_errors gauge"] + errors
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Logs the phases and host outcomes of this run"""
+        summary = self.summary()
+        phases = ", ".join(f"{name} {phase['seconds']}s"
+                           for name, phase in summary["phases"].items())
+        hosts = ", ".join(f"{count} {outcome}" for outcome, count
+                          in summary["hosts"].items() if count)
+        caches = "".join(f" Cache {name}: {cache['hit_rate']:.1%} hit rate "
+                         f"({cache['hits']} of {cache['hits'] + cache['misses']})."
+                         for name, cache in summary["caches"].items())
+        self.logger.info(f"Metrics: run took {summary['duration_seconds']}s "
+                         f"({phases}). Hosts: {hosts or 'none'}.{caches}")
+
+    def write(self, textfile=None, json_file=None):
+        """Writes the Prometheus textfile and JSON summary when configured"""
+        self.report()
+        try:
+            if textfile:
+                write_file(textfile, self.prometheus())
+            if json_file:
+                write_file(json_file, json.dumps(self.summary(), indent=2) + "\n")
+        except OSError as e:
+            self.logger.warning(f"Unable to write metrics: {e}")
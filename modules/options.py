@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Optional config options. Options which have been added to config.py.example
+over time are not required in config.py: the default of an option which is
+missing is set on the config module, so that an existing config.py keeps
+working after an upgrade.
+"""
+from importlib import import_module
+
+# Default value of each optional option
+DEFAULTS = {"zabbix_chunk_size": 500,
+            "zabbix_create_chunk_size": 100,
+            "netbox_page_size": 1000,
+            "netbox_stream_queue": 2,
+            "local_config_context": False,
+            "incremental_state_file": "incremental_state.json",
+            "full_sync_interval": 24,
+            "webhook_debounce": 5,
+            "webhook_refresh_interval": 300,
+            "fingerprint_db": None,
+            "fingerprint_verify_fraction": 0.1,
+            "shard_group_timeout": 300,
+            "metrics_textfile": None,
+            "metrics_json": None}
+
+
+def apply_defaults():
+    """
+    Sets the default of every optional option which is missing in config.py.
+    Raises ModuleNotFoundError when there is no config.py.
+    """
+    config = import_module("config")
+    for name, value in DEFAULTS.items():
+        if not hasattr(config, name):
+            setattr(config, name, value)
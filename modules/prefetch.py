@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Bulk prefetching of related NetBox objects. pynetbox only receives the
+nested representation of related objects such as the site of a device.
+Attributes which are not part of that representation (site.region,
+device_type.custom_fields, virtual_chassis.master, ...) are loaded by
+pynetbox with a separate request per object. The related objects are
+fetched in bulk instead and attached to the devices and VMs.
+"""
+import re
+from collections import Counter
+from logging import getLogger
+from threading import Lock
+from urllib.parse import urlparse
+from pynetbox.core.response import Record
+from modules.tools import chunks
+
+# Related objects which are not completely included in a NetBox device or VM.
+DEVICE_RELATIONS = {"site": "dcim/sites",
+                    "tenant": "tenancy/tenants",
+                    "device_type": "dcim/device-types",
+                    "virtual_chassis": "dcim/virtual-chassis"}
+VM_RELATIONS = {"site": "dcim/sites",
+                "tenant": "tenancy/tenants",
+                "cluster": "virtualization/clusters"}
+# Maximum number of IDs in a single NetBox request
+ID_CHUNK_SIZE = 100
+# URL of a single NetBox object, which is what pynetbox requests on a lazy load
+DETAIL_URL = re.compile(r"^(?P<endpoint>.*/api/[\w-]+/[\w-]+)/\d+/?$")
+
+
+def netbox_endpoint(netbox, path):
+    """Returns the pynetbox endpoint of a REST path such as dcim/device-types"""
+    app, name = path.split("/")
+    return getattr(getattr(netbox, app), name.replace("-", "_"))
+
+
+def related_record(obj, field):
+    """
+    Returns a related object of a NetBox record or None when it is not set.
+    pynetbox returns its model class for fields which are missing
+    in the record, such as oob_ip on older NetBox versions.
+    """
+    value = getattr(obj, field, None)
+    return value if isinstance(value, Record) else None
+
+
+def prefetch_related(netbox, nb_objects, relations, logger=None, cache=None):
+    """
+    Replaces the nested related objects of NetBox devices or VMs
+    with the full objects, which are requested in bulk.
+    INPUT: pynetbox API class, list of pynetbox records, dictionary with
+    the field name and REST path of each relation, logger and optionally
+    a dictionary with objects which have already been fetched per REST path.
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    logger = logger if logger else getLogger(__name__)
+    cache = {} if cache is None else cache
+    for field, path in relations.items():
+        related = cache.setdefault(path, {})
+        ids = {related_record(obj, field).id for obj in nb_objects
+               if related_record(obj, field)}
+        ids.difference_update(related)
+        if ids:
+            endpoint = netbox_endpoint(netbox, path)
+            for chunk in chunks(sorted(ids), ID_CHUNK_SIZE):
+                for record in endpoint.filter(id=chunk):
+                    related[record.id] = record
+            logger.debug(f"Prefetched {len(ids)} object(s) from {path}.")
+        for obj in nb_objects:
+            if related_record(obj, field) and related_record(obj, field).id in related:
+                setattr(obj, field, related[related_record(obj, field).id])
+
+
+class RequestCounter():
+    """
+    Counts the requests which are made by pynetbox. Requests for a single
+    object are implicit: those are made by pynetbox when an attribute is
+    used which is not part of the nested representation of an object.
+    INPUT: pynetbox API class and logger
+    """
+
+    def __init__(self, netbox, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        self.total = 0
+        self.implicit = Counter()
+        self.lock = Lock()
+        netbox.http_session.hooks["response"].append(self.hook)
+
+    def hook(self, response, *args, **kwargs):
+        """Response hook for the requests session of pynetbox"""
+        # pylint: disable=unused-argument
+        match = None
+        if response.request.method == "GET":
+            match = DETAIL_URL.match(urlparse(response.request.url).path)
+        with self.lock:
+            self.total += 1
+            if match:
+                self.implicit[match.group("endpoint")] += 1
+
+    def report(self):
+        """Logs the number of requests made during this run"""
+        implicit = sum(self.implicit.values())
+        self.logger.info(f"NetBox: made {self.total} request(s) of which "
+                         f"{implicit} implicit request(s) for a single object.")
+        for endpoint, count in self.implicit.most_common():
+            self.logger.debug(f"NetBox: {count} implicit request(s) to {endpoint}.")
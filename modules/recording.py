@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation
+"""
+Record and replay of NetBox and Zabbix API traffic. A recording contains
+every request and response of a run, including the time it took, as
+gzip compressed JSON lines. A recording can be replayed without network
+access so that a slow run can be reproduced and profiled locally.
+"""
+import atexit
+import gzip
+import json
+from collections import defaultdict, deque
+from logging import getLogger
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from zabbix_utils import ZabbixAPI, APIRequestError, ProcessingError
+
+# Zabbix methods of which the parameters contain credentials
+SECRET_METHODS = ("user.login", "user.checkAuthentication")
+# Response headers which are not stored
+SKIP_HEADERS = ("set-cookie", "content-encoding", "transfer-encoding", "content-length")
+# Fields of a Zabbix API error
+ERROR_FIELDS = ("code", "message", "data", "body")
+# Type of a recorded error which is not returned by the Zabbix API, such as a
+# connection failure. Errors without type are errors of the Zabbix API.
+PROCESSING_ERROR = "processing"
+
+
+def netbox_key(method, url, body):
+    """Returns the key which identifies a NetBox request in a recording"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return json.dumps(["netbox", method, parts.path, query, body], sort_keys=True)
+
+
+def zabbix_key(method, params):
+    """Returns the key which identifies a Zabbix request in a recording"""
+    return json.dumps(["zabbix", method, params], sort_keys=True, default=str)
+
+
+def request_body(request):
+    """Returns the body of a requests PreparedRequest as JSON when possible"""
+    if not request.body:
+        return None
+    body = request.body.decode() if isinstance(request.body, bytes) else request.body
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+
+class Recorder():
+    """
+    Records all NetBox and Zabbix API requests of a run.
+    INPUT: path of the recording, NetBox and Zabbix URLs and logger
+    """
+
+    def __init__(self, filename, netbox_host, zabbix_host, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        self.file = gzip.open(filename, "wt", encoding="utf-8")
+        self.lock = Lock()
+        self.start = monotonic()
+        self.count = 0
+        self.write({"meta": {"netbox_host": netbox_host, "zabbix_host": zabbix_host}})
+        # Make sure that the recording is complete when the script exits early
+        atexit.register(self.close)
+
+    def write(self, entry):
+        """Writes a single line to the recording"""
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(json.dumps(entry, default=str) + "\n")
+
+    def add(self, key, started, response):
+        """Adds a request and its response to the recording"""
+        self.count += 1
+        self.write({"key": key, "t": round(started - self.start, 6),
+                    "elapsed": round(monotonic() - started, 6), **response})
+
+    def attach(self, netbox):
+        """Records all requests made through the pynetbox session"""
+        adapter = RecordingAdapter(self)
+        netbox.http_session.mount("http://", adapter)
+        netbox.http_session.mount("https://", adapter)
+
+    def zabbix_api(self):
+        """Returns a ZabbixAPI class of which all requests are recorded"""
+        return zabbix_api_class(self)
+
+    def zabbix_request(self, send, method, params):
+        """Sends a Zabbix API request and records it"""
+        started = monotonic()
+        key = zabbix_key(method, None if method in SECRET_METHODS else params)
+        try:
+            response = send()
+        except APIRequestError as e:
+            self.add(key, started, {"error": {item: getattr(e, item, None)
+                                              for item in ERROR_FIELDS}})
+            raise
+        except ProcessingError as e:
+            self.add(key, started, {"error": {"type": PROCESSING_ERROR, "message": str(e)}})
+            raise
+        self.add(key, started, {"result": response.get("result")})
+        return response
+
+    def close(self):
+        """Closes the recording"""
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+        self.logger.info(f"Recording: stored {self.count} request(s).")
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Requests transport adapter which records all NetBox requests"""
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(**kwargs)
+        self.recorder = recorder
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        started = monotonic()
+        response = super().send(request, *args, **kwargs)
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in SKIP_HEADERS}
+        self.recorder.add(netbox_key(request.method, request.url, request_body(request)),
+                          started, {"status": response.status_code, "headers": headers,
+                                    "response": response.text})
+        return response
+
+
+class Replayer():
+    """
+    Replays a recording instead of sending requests to NetBox and Zabbix.
+    Requests which are made more than once are answered in the recorded
+    order, after which the last response is repeated.
+    INPUT: path of the recording, latency factor and logger.
+    A latency factor of 1 waits as long as the recorded request took.
+    """
+
+    def __init__(self, filename, latency=0.0, logger=None):
+        self.logger = logger if logger else getLogger(__name__)
+        self.latency = max(0.0, latency)
+        self.meta = {}
+        self.responses = defaultdict(deque)
+        self.lock = Lock()
+        self.count = 0
+        self.missing = 0
+        with gzip.open(filename, "rt", encoding="utf-8") as file:
+            for line in file:
+                entry = json.loads(line)
+                if "meta" in entry:
+                    self.meta = entry["meta"]
+                    continue
+                self.responses[entry.pop("key")].append(entry)
+
+    def environment(self):
+        """Returns the environment variables of the recorded run"""
+        return {"NETBOX_HOST": self.meta.get("netbox_host", "http://netbox.replay"),
+                "NETBOX_TOKEN": "replay",
+                "ZABBIX_HOST": self.meta.get("zabbix_host", "http://zabbix.replay"),
+                "ZABBIX_TOKEN": "replay"}
+
+    def response(self, key):
+        """Returns the recorded response of a request or None when it was not recorded"""
+        with self.lock:
+            responses = self.responses.get(key)
+            if not responses:
+                self.missing += 1
+                return None
+            self.count += 1
+            entry = responses.popleft() if len(responses) > 1 else responses[0]
+        if self.latency:
+            sleep(entry["elapsed"] * self.latency)
+        return entry
+
+    def attach(self, netbox):
+        """Answers all requests made through the pynetbox session from the recording"""
+        adapter = ReplayAdapter(self)
+        netbox.http_session.mount("http://", adapter)
+        netbox.http_session.mount("https://", adapter)
+
+    def zabbix_api(self):
+        """Returns a ZabbixAPI class which answers all requests from the recording"""
+        return zabbix_api_class(self)
+
+    def zabbix_request(self, send, method, params):  # pylint: disable=unused-argument
+        """Returns the recorded response of a Zabbix API request"""
+        entry = self.response(zabbix_key(method, None if method in SECRET_METHODS
+                                         else params))
+        if entry is None:
+            self.logger.warning(f"Replay: Zabbix {method} request was not recorded.")
+            raise ProcessingError(f"Zabbix {method} request was not recorded.")
+        if "error" in entry:
+            if entry["error"].get("type") == PROCESSING_ERROR:
+                raise ProcessingError(entry["error"]["message"])
+            raise APIRequestError(dict(entry["error"]))
+        return {"jsonrpc": "2.0", "result": entry["result"]}
+
+    def close(self):
+        """Logs a summary of the replay"""
+        self.logger.info(f"Replay: answered {self.count} request(s), "
+                         f"{self.missing} request(s) were not recorded.")
+
+
+class ReplayAdapter(BaseAdapter):
+    """Requests transport adapter which answers NetBox requests from a recording"""
+
+    def __init__(self, replayer):
+        super().__init__()
+        self.replayer = replayer
+
+    def send(self, request, *args, **kwargs):
+        # pylint: disable=arguments-differ, unused-argument
+        entry = self.replayer.response(netbox_key(request.method, request.url,
+                                                  request_body(request)))
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = "utf-8"
+        if entry is None:
+            self.replayer.logger.warning(f"Replay: NetBox {request.method} {request.url} "
+                                         f"was not recorded.")
+            entry = {"status": 404, "headers": {"Content-Type": "application/json"},
+                     "response": json.dumps({"detail": "Request was not recorded."})}
+        response.status_code = entry["status"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = entry["response"].encode()  # pylint: disable=protected-access
+        return response
+
+    def close(self):
+        pass
+
+
+def zabbix_api_class(recording):
+    """
+    Returns a ZabbixAPI class which sends all requests through a Recorder or Replayer.
+    """
+    class RecordingZabbixAPI(ZabbixAPI):
+        """ZabbixAPI of which all requests go through the recording"""
+        # pylint: disable=too-few-public-methods
+
+        def send_api_request(self, method, params=None, need_auth=True):
+            return recording.zabbix_request(
+                lambda: ZabbixAPI.send_api_request(self, method, params, need_auth),
+                method, params or {})
+    return RecordingZabbixAPI
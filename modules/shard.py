@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, duplicate-code
+"""
+Sharding of the sync over multiple processes. Devices and VMs are
+partitioned using a hash of their NetBox ID. Every shard only syncs its
+own devices and VMs. The first shard creates the missing hostgroups of
+all shards, the other shards wait until their hostgroups exist.
+"""
+from argparse import ArgumentTypeError
+from logging import getLogger
+from os import path, sys
+from time import monotonic, sleep
+from zlib import crc32
+from modules.exceptions import SyncExternalError
+from modules.incremental import DEVICE
+from modules.options import apply_defaults
+try:
+    apply_defaults()
+    from config import (
+        shard_group_timeout
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+          "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(1)
+
+# Seconds between hostgroup lookups while waiting for the first shard
+POLL_INTERVAL = 5
+
+
+def parse_shard(value):
+    """
+    Parses the shard argument.
+    INPUT: string in the format index/count, for instance 1/4
+    OUTPUT: tuple with index and count
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError as e:
+        raise ArgumentTypeError(f"Invalid shard {value}, use the format i/N.") from e
+    if count < 1 or not 1 <= index <= count:
+        raise ArgumentTypeError(f"Invalid shard {value}, i must be between 1 and N.")
+    return index, count
+
+
+class Shard():
+    """
+    A single shard of the sync.
+    INPUT: shard index (starting at 1), number of shards and logger
+    """
+
+    def __init__(self, index, count, logger=None):
+        self.index = index
+        self.count = count
+        self.logger = logger if logger else getLogger(__name__)
+        # The first shard creates the hostgroups of all shards
+        self.creates_groups = index == 1
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def owns(self, nb_obj, object_type):
+        """
+        Returns True when a device or VM belongs to this shard.
+        All members of a virtual chassis belong to the same shard
+        so that the master is always chosen by the same process.
+        INPUT: pynetbox record or NetBox API dictionary and the object type
+        """
+        if isinstance(nb_obj, dict):
+            obj_id, chassis = nb_obj["id"], nb_obj.get("virtual_chassis")
+            chassis_id = chassis["id"] if chassis else None
+        else:
+            obj_id, chassis = nb_obj.id, None
+            if object_type == DEVICE:
+                chassis = nb_obj.virtual_chassis
+            chassis_id = chassis.id if chassis else None
+        key = f"dcim.virtualchassis:{chassis_id}" if chassis_id else f"{object_type}:{obj_id}"
+        return crc32(key.encode()) % self.count == self.index - 1
+
+    def select(self, nb_objects, object_type):
+        """Returns the devices or VMs which are synced by this shard"""
+        return [nb_obj for nb_obj in nb_objects if self.owns(nb_obj, object_type)]
+
+    def others(self, nb_objects, object_type):
+        """
+        Returns the devices or VMs of the other shards of which this shard
+        creates the hostgroups. These objects are planned, but not synced.
+        """
+        if not self.creates_groups:
+            return []
+        return [nb_obj for nb_obj in nb_objects if not self.owns(nb_obj, object_type)]
+
+    def filename(self, filename):
+        """Returns a state file name which is unique for this shard"""
+        base, extension = path.splitext(filename)
+        return f"{base}.shard-{self.index}-of-{self.count}{extension}"
+
+    def wait_for_group(self, zabbix, name, context):
+        """
+        Waits until the first shard has created a hostgroup.
+        OUTPUT: list with the hostgroup when it was not known yet
+        """
+        deadline = monotonic() + shard_group_timeout
+        while True:
+            if context.group_id(name):
+                return []
+            groups = zabbix.hostgroup.get(filter={"name": name}, output=["groupid", "name"])
+            if groups:
+                with context.hostgroup_lock:
+                    if not context.group_id(name):
+                        context.add_group(groups[0])
+                return groups[:1]
+            if monotonic() >= deadline:
+                msg = (f"Hostgroup '{name}': has not been created by shard "
+                       f"1/{self.count} within {shard_group_timeout} seconds.")
+                self.logger.warning(msg)
+                raise SyncExternalError(msg)
+            self.logger.debug(f"Hostgroup '{name}': waiting for shard 1/{self.count}.")
+            sleep(POLL_INTERVAL)
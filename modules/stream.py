@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, too-many-instance-attributes
+"""
+Streaming NetBox fetch. Devices and VMs are requested page by page in a
+producer thread and handed over through a bounded queue, so that the
+first pages are synced while the next pages are still loading and only
+a limited number of NetBox objects is kept in memory.
+"""
+from logging import getLogger
+from queue import Queue
+from threading import Thread
+from modules.prefetch import netbox_endpoint, prefetch_related
+from modules.config_context import without_config_context
+
+# Marks the end of the stream
+DONE = object()
+
+
+class NetboxStream():
+    """
+    Pages through a NetBox endpoint in a background thread.
+    Each page is prefetched with its related objects before it is queued.
+    INPUT: pynetbox API class, REST path such as dcim/devices, NetBox filter,
+    relations to prefetch, page size, maximum number of queued pages and logger.
+    """
+
+    def __init__(self, netbox, path, nb_filter, relations, page_size,
+                 queue_size=2, logger=None):
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.netbox = netbox
+        self.path = path
+        self.endpoint = netbox_endpoint(netbox, path)
+        self.nb_filter = nb_filter
+        self.relations = relations
+        self.page_size = max(1, page_size)
+        self.queue = Queue(maxsize=max(1, queue_size))
+        self.logger = logger if logger else getLogger(__name__)
+        # Related objects are shared by many hosts, keep them for the next pages
+        self.cache = {}
+        # Optional function which selects the objects of a page which are synced
+        self.select = None
+        # Optional ConfigContexts class, the config context of each page is evaluated locally
+        self.config_contexts = None
+        self.thread = None
+
+    def produce(self):
+        """Requests all pages and puts them on the queue"""
+        offset = 0
+        nb_filter = (without_config_context(self.nb_filter) if self.config_contexts
+                     else self.nb_filter)
+        try:
+            while True:
+                records = self.endpoint.filter(limit=self.page_size, offset=offset,
+                                               **nb_filter)
+                page = list(records)
+                # The total number of objects is known once the page has been requested
+                total = records.request.count
+                if offset == 0 and page and len(page) < min(self.page_size, total):
+                    # NetBox returns at most MAX_PAGE_SIZE objects per page
+                    self.logger.debug(f"Stream: NetBox limits the pages of {self.path} to "
+                                      f"{len(page)} object(s), using that page size.")
+                    self.page_size = len(page)
+                offset += len(page)
+                last_page = not page or offset >= total
+                if self.select:
+                    page = self.select(page)
+                if page:
+                    prefetch_related(self.netbox, page, self.relations,
+                                     self.logger, self.cache)
+                    if self.config_contexts:
+                        self.config_contexts.apply(page)
+                    self.queue.put(page)
+                if last_page:
+                    break
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Raised again in the consuming thread
+            self.queue.put(e)
+        self.queue.put(DONE)
+
+    def __iter__(self):
+        """Yields pages of NetBox objects as soon as they are available"""
+        self.thread = Thread(target=self.produce, daemon=True)
+        self.thread.start()
+        pages = 0
+        while True:
+            page = self.queue.get()
+            if page is DONE:
+                break
+            if isinstance(page, Exception):
+                raise page
+            pages += 1
+            self.logger.debug(f"Stream: processing page {pages} of {self.path} "
+                              f"with {len(page)} object(s).")
+            yield page
+        self.thread.join()
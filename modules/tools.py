@@ -6,22 +6,30 @@ def convert_recordset(recordset):
         recordlist.append(record.__dict__)
     return recordlist
 
-def build_path(endpoint, list_of_dicts):
+def build_path_index(list_of_dicts):
     """
-    Builds a path list of related parent/child items.
-    This can be used to generate a joinable list to
-    be used in hostgroups.
+    Builds the path of related parent/child items for every item
+    of a tree, such as NetBox regions or site groups. Items are matched
+    on their ID so that duplicate names in different branches are supported.
+    INPUT: list of dicts with the id, name and parent of each item
+    OUTPUT: dictionary with the item ID as key and the joined path as value
     """
-    item_path = []
-    itemlist = [i for i in list_of_dicts if i['name'] == endpoint]
-    item = itemlist[0] if len(itemlist) == 1 else None
-    item_path.append(item['name'])
-    while item['_depth'] > 0:
-        itemlist = [i for i in list_of_dicts if i['name'] == str(item['parent'])]
-        item = itemlist[0] if len(itemlist) == 1 else None
-        item_path.append(item['name'])
-    item_path.reverse()
-    return item_path
+    items = {item['id']: item for item in list_of_dicts}
+    paths = {}
+    for item_id in items:
+        # Walk up the tree until the root or an item with a known path is found
+        chain = []
+        current = item_id
+        while current in items and current not in paths and current not in chain:
+            chain.append(current)
+            parent = items[current]['parent']
+            current = parent.get('id') if isinstance(parent, dict) else getattr(parent, 'id', None)
+        prefix = paths.get(current)
+        for chain_id in reversed(chain):
+            name = items[chain_id]['name']
+            prefix = f"{prefix}/{name}" if prefix else name
+            paths[chain_id] = prefix
+    return paths
 
 def proxy_prepper(proxy_list, proxy_group_list):
     """
@@ -42,3 +50,13 @@ def proxy_prepper(proxy_list, proxy_group_list):
         group["monitored_by"] = 2
         output.append(group)
     return output
+
+def chunks(items, size):
+    """
+    Splits a list into chunks of a given size.
+    A size of 0 or lower returns the list as a single chunk.
+    """
+    if size <= 0:
+        size = len(items) or 1
+    for pos in range(0, len(items), size):
+        yield items[pos:pos + size]
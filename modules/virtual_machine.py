@@ -7,6 +7,7 @@ from modules.device import PhysicalDevice
 from modules.hostgroups import Hostgroup
 from modules.interface import ZabbixInterface
 from modules.exceptions import TemplateError, InterfaceConfigError, SyncInventoryError
+from modules.incremental import VM
 try:
     from config import (
         traverse_site_groups,
@@ -19,13 +20,15 @@ except ModuleNotFoundError:
 
 class VirtualMachine(PhysicalDevice):
     """Model for virtual machines"""
+    nb_object_type = VM
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.hostgroup = None
         self.zbx_template_names = None
 
-    def set_hostgroup(self, hg_format, nb_site_groups, nb_regions):
-        """Set the hostgroup for this device"""
+    def set_hostgroup(self, hg_format, nb_site_groups, nb_regions, context=None):
+        """Set the hostgroup for this VM, memoized in the SyncContext when provided"""
         # Create new Hostgroup instance
         hg = Hostgroup("vm", self.nb, self.nb_api_version, logger=self.logger,
                        nested_sitegroup_flag=traverse_site_groups,
@@ -33,17 +36,32 @@ class VirtualMachine(PhysicalDevice):
                        nb_groups=nb_site_groups,
                        nb_regions=nb_regions)
         # Generate hostgroup based on hostgroup format
-        self.hostgroup = hg.generate(hg_format)
+        if not context:
+            self.hostgroup = hg.generate(hg_format)
+            return
+        self.hostgroup = context.cached("hostgroups", hg.key(hg_format),
+                                        lambda: hg.generate(hg_format))
 
-    def set_vm_template(self):
+    def set_vm_template(self, context=None):
         """ Set Template for VMs. Overwrites default class
-        to skip a lookup of custom fields."""
+        to skip a lookup of custom fields. The templates are cached
+        per config context in the SyncContext when provided."""
+        if not context:
+            self.zbx_template_names = self._vm_template_names()
+            return True
+        self.zbx_template_names = context.cached("templates",
+                                                 ("vm", self.templates_context_key()),
+                                                 self._vm_template_names)
+        return True
+
+    def _vm_template_names(self):
+        """Returns the template names from the config context"""
         # Gather templates ONLY from the device specific context
         try:
-            self.zbx_template_names = self.get_templates_context()
+            return self.get_templates_context()
         except TemplateError as e:
             self.logger.warning(e)
-        return True
+        return None
 
     def setInterfaceDetails(self): # pylint: disable=invalid-name
         """
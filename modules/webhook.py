@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# pylint: disable=logging-fstring-interpolation, too-many-instance-attributes, duplicate-code
+"""
+Webhook listener. Receives NetBox webhooks and syncs the
+device or VM of the webhook as soon as possible.
+"""
+import hmac
+import json
+from hashlib import sha512
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from os import environ, sys
+from threading import Condition, Thread, Event
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from modules.incremental import DEVICE, VM
+from modules.options import apply_defaults
+try:
+    apply_defaults()
+    from config import (
+        nb_device_filter, nb_vm_filter,
+        sync_vms,
+        webhook_debounce,
+        webhook_refresh_interval
+    )
+except ModuleNotFoundError:
+    print("Configuration file config.py not found in main directory."
+          "Please create the file or rename the config.py.example file to config.py.")
+    sys.exit(1)
+
+# NetBox objects of which the cached hostgroups and templates depend on
+CONFIG_CONTEXT = "extras.configcontext"
+DEVICE_TYPE = "dcim.devicetype"
+# Caches of the SyncContext which are cleared when one of these objects changes
+INVALIDATED_CACHES = ("hostgroups", "templates", "template_ids")
+# Model names used by NetBox versions which do not send the object type
+MODELS = {"device": DEVICE, "virtualmachine": VM,
+          "configcontext": CONFIG_CONTEXT, "devicetype": DEVICE_TYPE}
+
+
+def parse_address(listen):
+    """
+    Parses the listen argument.
+    INPUT: string in the format [address:]port
+    OUTPUT: tuple with address and port
+    """
+    address, _, port = listen.rpartition(":")
+    return address or "0.0.0.0", int(port)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Handles the HTTP requests of the webhook listener"""
+    listener = None
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        self.listener.logger.debug(f"Webhook listener: {format % args}")
+
+    def respond(self, status, message):
+        """Sends a JSON response"""
+        body = json.dumps({"detail": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Accepts a NetBox webhook"""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.listener.verify(body, self.headers.get("X-Hook-Signature")):
+            self.respond(403, "Invalid webhook signature.")
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.respond(400, "Webhook body is not valid JSON.")
+            return
+        status, message = self.listener.receive(payload)
+        self.respond(status, message)
+
+
+class WebhookListener():
+    """
+    Listens for NetBox webhooks of devices and VMs. Webhooks of the same
+    object are coalesced: the object is synced once when no new webhook has
+    been received for webhook_debounce seconds. Zabbix hostgroups, templates
+    and proxies are cached and refreshed in the background.
+    INPUT: listen address, pynetbox API class, function which returns the
+    SyncContext, sync functions for a single device and VM,
+    number of worker threads and logger.
+    """
+
+    def __init__(self, listen, netbox, load_data, sync_device, sync_vm,
+                 workers=1, logger=None):
+        # pylint: disable=too-many-arguments, too-many-positional-arguments
+        self.address = parse_address(listen)
+        self.netbox = netbox
+        self.load_data = load_data
+        self.sync_functions = {DEVICE: sync_device, VM: sync_vm}
+        self.workers = max(1, workers)
+        self.logger = logger if logger else getLogger(__name__)
+        self.secret = environ.get("WEBHOOK_SECRET", "").encode()
+        self.context = None
+        # Objects waiting to be synced with the time they are due
+        self.pending = {}
+        # Objects which are being synced right now
+        self.running = set()
+        self.condition = Condition()
+        self.stopped = Event()
+        self.server = None
+
+    def verify(self, body, signature):
+        """Verifies the webhook signature when a secret has been configured"""
+        if not self.secret:
+            return True
+        expected = hmac.new(self.secret, body, sha512).hexdigest()
+        return bool(signature) and hmac.compare_digest(expected, signature)
+
+    def receive(self, payload):
+        """
+        Schedules the object of a webhook payload for a sync. Webhooks of config
+        contexts and device types clear the cached hostgroups and templates.
+        OUTPUT: tuple with HTTP status and message
+        """
+        data = payload.get("data") or {}
+        object_type = payload.get("object_type") or MODELS.get(payload.get("model"))
+        if object_type in (CONFIG_CONTEXT, DEVICE_TYPE):
+            self.context.invalidate(*INVALIDATED_CACHES)
+            self.logger.debug(f"Webhook: {object_type} {data.get('id')} has changed, "
+                              f"cleared the cached hostgroups and templates.")
+            return 202, "Cached hostgroups and templates have been cleared."
+        if object_type not in self.sync_functions or "id" not in data:
+            return 400, "Webhook is not for a NetBox device or virtual machine."
+        if object_type == VM and not sync_vms:
+            return 202, "Syncing of VMs is disabled, ignoring webhook."
+        if payload.get("event") == "deleted":
+            self.logger.info(f"Webhook: {object_type} {data['id']} has been deleted in "
+                             f"NetBox, the Zabbix host is not changed.")
+            return 202, "Deleted objects are not synced."
+        key = (object_type, data["id"])
+        with self.condition:
+            if key in self.pending:
+                self.logger.debug(f"Webhook: coalesced event for {object_type} {data['id']}.")
+            self.pending[key] = monotonic() + webhook_debounce
+            self.condition.notify()
+        return 202, "Webhook accepted."
+
+    def due(self):
+        """
+        Waits until one or more objects are due.
+        OUTPUT: list of object keys which can be synced.
+        """
+        with self.condition:
+            while not self.stopped.is_set():
+                now = monotonic()
+                # Objects which are being synced are postponed until the sync is done
+                ready = [key for key, due in self.pending.items()
+                         if due <= now and key not in self.running]
+                if ready:
+                    for key in ready:
+                        del self.pending[key]
+                        self.running.add(key)
+                    return ready
+                timeout = min(self.pending.values(), default=now + 1) - now
+                self.condition.wait(max(timeout, 0.05))
+        return []
+
+    def fetch(self, object_type, object_id):
+        """Gets the current state of the object from NetBox within the configured filter"""
+        if object_type == DEVICE:
+            objects = self.netbox.dcim.devices.filter(id=object_id, **nb_device_filter)
+        else:
+            objects = self.netbox.virtualization.virtual_machines.filter(
+                id=object_id, **nb_vm_filter)
+        return next(iter(objects), None)
+
+    def sync(self, key):
+        """Syncs a single object"""
+        object_type, object_id = key
+        try:
+            nb_obj = self.fetch(object_type, object_id)
+            if not nb_obj:
+                self.logger.info(f"Webhook: {object_type} {object_id} does not match "
+                                 f"the configured filter, skipping.")
+                return
+            shard = self.context.shard
+            if shard and not shard.select([nb_obj], object_type):
+                self.logger.debug(f"Webhook: {object_type} {object_id} belongs to "
+                                  f"another shard, skipping.")
+                return
+            self.sync_functions[object_type](nb_obj, self.context)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # The listener has to keep running when a single object fails
+            self.logger.error(f"Webhook: unable to sync {object_type} {object_id}: {e}")
+        finally:
+            with self.condition:
+                self.running.discard(key)
+                self.condition.notify()
+
+    def refresh(self):
+        """Refreshes the cached Zabbix and NetBox data in the background"""
+        while not self.stopped.wait(webhook_refresh_interval):
+            try:
+                self.context = self.load_data()
+                self.logger.debug("Webhook: refreshed cached Zabbix and NetBox data.")
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self.logger.warning(f"Webhook: unable to refresh cached data, "
+                                    f"using the previous data. Error: {e}")
+
+    def dispatch(self):
+        """Syncs objects once they are due"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self.stopped.is_set():
+                for key in self.due():
+                    pool.submit(self.sync, key)
+
+    def serve_forever(self):
+        """Starts the listener, runs until interrupted"""
+        self.context = self.load_data()
+        handler = type("Handler", (WebhookHandler,), {"listener": self})
+        self.server = ThreadingHTTPServer(self.address, handler)
+        Thread(target=self.refresh, daemon=True).start()
+        Thread(target=self.dispatch, daemon=True).start()
+        self.logger.info(f"Webhook listener started on {self.address[0]}:{self.address[1]}.")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("Webhook listener stopped.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stops the listener"""
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.server:
+            self.server.server_close()
@@ -4,7 +4,9 @@
 """NetBox to Zabbix sync script."""
 import logging
 import argparse
+import asyncio
 import ssl
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import environ, path, sys
 from pynetbox import api
 from pynetbox.core.query import RequestError as NBRequestError
@@ -13,8 +15,30 @@ from zabbix_utils import ZabbixAPI, APIRequestError, ProcessingError
 from modules.device import PhysicalDevice
 from modules.virtual_machine import VirtualMachine
 from modules.tools import convert_recordset, proxy_prepper
-from modules.exceptions import EnvironmentVarError, HostgroupError, SyncError
+from modules.bulk import (prefetch_zabbix_hosts, create_zabbix_hostgroups,
+                          HostCleanupBatch, HostCreateBatch, HostUpdateBatch,
+                          HostnameIndex)
+from modules.hostgroups import hostgroup_paths
+from modules.inventory import InventoryMap
+from modules.config_context import load_config_contexts, without_config_context
+from modules.context import SyncContext
+from modules.incremental import IncrementalSync, DEVICE, VM
+from modules.webhook import WebhookListener
+from modules.stream import NetboxStream
+from modules.graphql import GraphqlLoader
+from modules.shard import Shard, parse_shard
+from modules.fingerprint import FingerprintStore, linked_hostids
+from modules.recording import Recorder, Replayer
+from modules.metrics import (Metrics, CREATED, UPDATED, IN_SYNC,
+                             SKIPPED, DELETED, ERRORED)
+from modules.prefetch import (DEVICE_RELATIONS, VM_RELATIONS,
+                              RequestCounter, prefetch_related)
+from modules.exceptions import (EnvironmentVarError, HostgroupError,
+                                SyncError, SyncExternalError)
+from modules.options import apply_defaults
 try:
+    # Optional options which are missing in config.py get their default
+    apply_defaults()
     from config import (
         templates_config_context,
         templates_config_context_overrule,
@@ -26,7 +50,20 @@ try:
         vm_hostgroup_format,
         nb_device_filter,
         sync_vms,
-        nb_vm_filter
+        nb_vm_filter,
+        inventory_sync,
+        inventory_map,
+        zabbix_chunk_size,
+        zabbix_create_chunk_size,
+        device_cf,
+        netbox_page_size,
+        netbox_stream_queue,
+        incremental_state_file,
+        fingerprint_db,
+        fingerprint_verify_fraction,
+        local_config_context,
+        metrics_textfile,
+        metrics_json
     )
 except ModuleNotFoundError:
     print("Configuration file config.py not found in main directory."
@@ -49,6 +86,10 @@ logger = logging.getLogger("NetBox-Zabbix-sync")
 logger.addHandler(lgout)
 logger.addHandler(lgfile)
 logger.setLevel(logging.WARNING)
+# Hosts are prepared twice when the hostgroups and names are planned in advance.
+# Problems with a host are only logged when the host itself is synced.
+plan_logger = logging.getLogger("NetBox-Zabbix-sync.plan")
+plan_logger.disabled = True
 
 
 def main(arguments):
@@ -57,6 +98,26 @@ def main(arguments):
     # set environment variables
     if arguments.verbose:
         logger.setLevel(logging.DEBUG)
+    # Phase durations, API requests and host outcomes of this run
+    metrics = Metrics(logger)
+    # The webhook listener syncs single hosts with the threaded sync
+    if arguments.listen and arguments.use_async:
+        logger.error("The webhook listener can not be used with --async.")
+        sys.exit(1)
+    # The async engine has its own default number of workers
+    if arguments.workers is None and not arguments.use_async:
+        arguments.workers = 1
+    # Record or replay all NetBox and Zabbix API traffic
+    recording = None
+    if arguments.record or arguments.replay:
+        if arguments.use_async:
+            logger.error("Recording and replaying API traffic is not supported with --async.")
+            sys.exit(1)
+        if arguments.replay:
+            recording = Replayer(arguments.replay, arguments.replay_latency, logger)
+            # The recorded run is used, the real credentials are not needed
+            for var, value in recording.environment().items():
+                environ.setdefault(var, value)
     env_vars = ["ZABBIX_HOST", "NETBOX_HOST", "NETBOX_TOKEN"]
     if "ZABBIX_TOKEN" in environ:
         env_vars.append("ZABBIX_TOKEN")
@@ -82,6 +143,13 @@ def main(arguments):
     netbox_token = environ.get("NETBOX_TOKEN")
     # Set NetBox API
     netbox = api(netbox_host, token=netbox_token, threading=True)
+    if arguments.record:
+        recording = Recorder(arguments.record, netbox_host, zabbix_host, logger)
+    if recording:
+        recording.attach(netbox)
+    # Keep track of implicit requests made by pynetbox
+    nb_requests = RequestCounter(netbox, logger)
+    metrics.attach_netbox(netbox)
     # Check if the provided Hostgroup layout is valid
     hg_objects = hostgroup_format.split("/")
     allowed_objects = ["location", "role", "manufacturer", "region",
@@ -105,175 +173,511 @@ def main(arguments):
                  " use valid items and seperate them with '/'.")
             logger.error(e)
             raise HostgroupError(e)
+    # Get NetBox API version
+    nb_version = netbox.version
+    # Only sync a part of all devices and VMs when running multiple shards
+    shard = None
+    state_file, db_file = incremental_state_file, fingerprint_db
+    if arguments.shard:
+        shard = Shard(*arguments.shard, logger=logger)
+        logger.info(f"Running as shard {shard}.")
+        # Every shard keeps its own state
+        state_file = shard.filename(incremental_state_file)
+        db_file = shard.filename(fingerprint_db) if fingerprint_db else None
+    # Determine which hosts have changed since the previous run
+    incremental = None
+    if arguments.incremental:
+        incremental = IncrementalSync(netbox, nb_version, state_file, logger)
+        incremental.plan(force_full=arguments.full)
+    # Hosts with an unchanged desired state are not checked against Zabbix
+    fingerprints = None
+    if db_file and not arguments.listen:
+        fingerprints = FingerprintStore(db_file, fingerprint_verify_fraction, logger)
+    ssl_ctx = ssl.create_default_context()
+    # If a custom CA bundle is set for pynetbox (requests), also use it for the Zabbix API
+    if environ.get("REQUESTS_CA_BUNDLE", None):
+        ssl_ctx.load_verify_locations(environ["REQUESTS_CA_BUNDLE"])
+    # Use the asynchronous NetBox and Zabbix clients
+    if arguments.use_async:
+        # pylint: disable=import-outside-toplevel
+        from modules.async_engine import AsyncSyncEngine
+        engine = AsyncSyncEngine(netbox, ssl_ctx, arguments.requests,
+                                 arguments.workers, logger, metrics)
+        zabbix_settings = {"url": zabbix_host, "token": zabbix_token,
+                           "user": zabbix_user, "password": zabbix_pass}
+        try:
+            asyncio.run(engine.run(zabbix_settings, sync_vm, sync_device,
+                                   incremental, fingerprints, shard, plan_hosts))
+        except SyncExternalError as e:
+            logger.error(e)
+            sys.exit(1)
+        if incremental:
+            incremental.save()
+        if fingerprints:
+            fingerprints.save()
+        nb_requests.report()
+        metrics.write(metrics_textfile, metrics_json)
+        return
     # Set Zabbix API
+    zabbix_api = recording.zabbix_api() if recording else ZabbixAPI
     try:
-        ssl_ctx = ssl.create_default_context()
-
-        # If a custom CA bundle is set for pynetbox (requests), also use it for the Zabbix API
-        if environ.get("REQUESTS_CA_BUNDLE", None):
-            ssl_ctx.load_verify_locations(environ["REQUESTS_CA_BUNDLE"])
-
         if not zabbix_token:
-            zabbix = ZabbixAPI(zabbix_host, user=zabbix_user,
+            zabbix = zabbix_api(zabbix_host, user=zabbix_user,
                                password=zabbix_pass, ssl_context=ssl_ctx)
         else:
-            zabbix = ZabbixAPI(
+            zabbix = zabbix_api(
                 zabbix_host, token=zabbix_token, ssl_context=ssl_ctx)
+        metrics.attach_zabbix(zabbix)
         zabbix.check_auth()
     except (APIRequestError, ProcessingError) as e:
         e = f"Zabbix returned the following error: {str(e)}"
         logger.error(e)
         sys.exit(1)
-    # Set API parameter mapping based on API version
-    if not str(zabbix.version).startswith('7'):
-        proxy_name = "host"
+    # Run as webhook listener, hosts are synced when NetBox sends a webhook
+    if arguments.listen:
+        listener = WebhookListener(arguments.listen, netbox,
+                                   lambda: get_shared_data(netbox, zabbix, nb_version, shard),
+                                   sync_device, sync_vm, arguments.workers, logger)
+        listener.serve_forever()
+        return
+    context = get_shared_data(netbox, zabbix, nb_version, shard, metrics)
+    # Changes of existing hosts are collected and pushed to Zabbix in batches
+    context.update_batch = HostUpdateBatch(context, zabbix_chunk_size, logger)
+    context.hostnames = HostnameIndex(zabbix, zabbix_chunk_size, logger)
+    context.cleanup_batch = HostCleanupBatch(context, device_cf, zabbix_chunk_size, logger)
+    # New hosts are created in batches as well, unless disabled
+    if zabbix_create_chunk_size:
+        context.create_batch = HostCreateBatch(context, device_cf,
+                                               zabbix_create_chunk_size, logger)
+    context.incremental = incremental
+    context.fingerprints = fingerprints
+    # Related objects which are used by the inventory_map are prefetched as well
+    device_relations = {**DEVICE_RELATIONS, **context.inventory.relations}
+    stream = arguments.stream
+    if stream and incremental and not incremental.full:
+        # Only the changed objects are loaded, those are not loaded page by page
+        logger.warning("Streaming is not used for an incremental sync, only the changed "
+                       "devices and VMs are loaded. It is used when a full sync runs.")
+        stream = False
+    if stream:
+        # Sync NetBox objects page by page while the next pages are loading
+        streams = [(sync_device, DEVICE, NetboxStream(
+            netbox, "dcim/devices", nb_device_filter, device_relations,
+            netbox_page_size, netbox_stream_queue, logger))]
+        if sync_vms:
+            streams.insert(0, (sync_vm, VM, NetboxStream(
+                netbox, "virtualization/virtual-machines", nb_vm_filter, VM_RELATIONS,
+                netbox_page_size, netbox_stream_queue, logger)))
+        # The first shard needs all objects to plan the hostgroups of all shards
+        if shard and not shard.creates_groups:
+            for _, object_type, stream in streams:
+                stream.select = lambda page, object_type=object_type: shard.select(page,
+                                                                                   object_type)
+        try:
+            if local_config_context:
+                with metrics.phase("netbox_fetch"):
+                    config_contexts = load_config_contexts(netbox, logger)
+                for _, _, stream in streams:
+                    stream.config_contexts = config_contexts
+            for sync_function, object_type, stream in streams:
+                run_stream(sync_function, stream, object_type, context, arguments.workers)
+        except NBRequestError as e:
+            logger.error(f"NetBox error: {e}")
+            sys.exit(1)
+    else:
+        # Get all NetBox data
+        try:
+            with metrics.phase("netbox_fetch"):
+                netbox_devices, netbox_vms, others = get_netbox_objects(
+                    netbox, nb_version, incremental, arguments.graphql, shard,
+                    device_relations)
+        except (NBRequestError, SyncExternalError) as e:
+            logger.error(f"NetBox error: {e}")
+            sys.exit(1)
+        # Get the Zabbix data of all hosts which are already linked to a NetBox object.
+        # Uses a limited amount of API calls instead of one call per host.
+        with metrics.phase("zabbix_fetch"):
+            context.hosts = prefetch_zabbix_hosts(
+                zabbix, linked_hostids(netbox_devices, netbox_vms, fingerprints),
+                inventory_map.values(), zabbix_chunk_size, logger)
+        # Create all missing hostgroups and check the names of all
+        # new hosts before the hosts are processed
+        with metrics.phase("plan"):
+            plan_hosts(netbox_devices + others[0], netbox_vms + others[1], context)
+        # Go through all NetBox VMs and devices
+        run_sync(sync_vm, netbox_vms, context, arguments.workers)
+        run_sync(sync_device, netbox_devices, context, arguments.workers)
+        # Push all collected new hosts and changes to Zabbix
+        flush_batches(context)
+    # Store the high-water mark for the next incremental run
+    if incremental:
+        incremental.save()
+    if fingerprints:
+        fingerprints.save()
+    nb_requests.report()
+    metrics.write(metrics_textfile, metrics_json)
+    if recording:
+        recording.close()
+
+
+def get_netbox_objects(netbox, nb_version, incremental=None, use_graphql=False, shard=None,
+                       device_relations=None):
+    """
+    Gets all NetBox devices and VMs which are synced during this run
+    including the related objects which are used by the hosts.
+    OUTPUT: tuple with the list of devices, the list of VMs and a tuple with the
+    devices and VMs of other shards of which only the hostgroups are created
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    device_ids, vm_ids = None, None
+    if incremental and not incremental.full:
+        device_ids, vm_ids = incremental.device_ids, incremental.vm_ids
+    # GraphQL returns the devices and VMs including all related fields
+    if use_graphql:
+        loader = GraphqlLoader(netbox, nb_version, netbox_page_size, logger)
+        netbox_devices = loader.devices(nb_device_filter, device_ids)
+        netbox_vms = loader.vms(nb_vm_filter, vm_ids) if sync_vms else []
+        if shard:
+            return (shard.select(netbox_devices, DEVICE), shard.select(netbox_vms, VM),
+                    (shard.others(netbox_devices, DEVICE), shard.others(netbox_vms, VM)))
+        return netbox_devices, netbox_vms, ([], [])
+    # Config contexts are evaluated locally instead of being rendered by NetBox
+    device_filter, vm_filter, config_contexts = nb_device_filter, nb_vm_filter, None
+    if local_config_context:
+        config_contexts = load_config_contexts(netbox, logger)
+        device_filter = without_config_context(nb_device_filter)
+        vm_filter = without_config_context(nb_vm_filter)
+    if device_ids is not None:
+        netbox_devices = incremental.devices(device_filter)
     else:
-        proxy_name = "name"
-    # Get all Zabbix and NetBox data
-    netbox_devices = list(netbox.dcim.devices.filter(**nb_device_filter))
+        netbox_devices = list(netbox.dcim.devices.filter(**device_filter))
     netbox_vms = []
-    if sync_vms:
+    if sync_vms and vm_ids is not None:
+        netbox_vms = incremental.vms(vm_filter)
+    elif sync_vms:
         netbox_vms = list(
-            netbox.virtualization.virtual_machines.filter(**nb_vm_filter))
-    netbox_site_groups = convert_recordset((netbox.dcim.site_groups.all()))
-    netbox_regions = convert_recordset(netbox.dcim.regions.all())
-    netbox_journals = netbox.extras.journal_entries
-    zabbix_groups = zabbix.hostgroup.get(output=['groupid', 'name'])
-    zabbix_templates = zabbix.template.get(output=['templateid', 'name'])
-    zabbix_proxies = zabbix.proxy.get(output=['proxyid', proxy_name])
-    # Set empty list for proxy processing Zabbix <= 6
-    zabbix_proxygroups = []
-    if str(zabbix.version).startswith('7'):
-        zabbix_proxygroups = zabbix.proxygroup.get(
-            output=["proxy_groupid", "name"])
-    # Sanitize proxy data
-    if proxy_name == "host":
-        for proxy in zabbix_proxies:
-            proxy['name'] = proxy.pop('host')
-    # Prepare list of all proxy and proxy_groups
-    zabbix_proxy_list = proxy_prepper(zabbix_proxies, zabbix_proxygroups)
+            netbox.virtualization.virtual_machines.filter(**vm_filter))
+    others = ([], [])
+    if shard:
+        others = (shard.others(netbox_devices, DEVICE), shard.others(netbox_vms, VM))
+        netbox_devices = shard.select(netbox_devices, DEVICE)
+        netbox_vms = shard.select(netbox_vms, VM)
+    # Get all related objects which are used by the hosts in bulk
+    prefetch_related(netbox, netbox_devices + others[0],
+                     device_relations or DEVICE_RELATIONS, logger)
+    prefetch_related(netbox, netbox_vms + others[1], VM_RELATIONS, logger)
+    if config_contexts:
+        config_contexts.apply(netbox_devices + others[0])
+        config_contexts.apply(netbox_vms + others[1])
+    return netbox_devices, netbox_vms, others
 
-    # Get NetBox API version
-    nb_version = netbox.version
 
-    # Go through all NetBox devices
-    for nb_vm in netbox_vms:
-        try:
-            vm = VirtualMachine(nb_vm, zabbix, netbox_journals, nb_version,
-                                create_journal, logger)
-            logger.debug(f"Host {vm.name}: started operations on VM.")
-            vm.set_vm_template()
-            # Check if a valid template has been found for this VM.
-            if not vm.zbx_template_names:
-                continue
-            vm.set_hostgroup(vm_hostgroup_format,
-                             netbox_site_groups, netbox_regions)
-            # Check if a valid hostgroup has been found for this VM.
-            if not vm.hostgroup:
+def get_shared_data(netbox, zabbix, nb_version, shard=None, metrics=None):
+    """
+    Gets the NetBox and Zabbix data which is shared by all hosts.
+    OUTPUT: SyncContext which is passed to the sync functions.
+    """
+    # pylint: disable=too-many-arguments, too-many-positional-arguments
+    metrics = metrics if metrics else Metrics(logger)
+    with metrics.phase("zabbix_fetch"):
+        # Set API parameter mapping based on API version
+        if not str(zabbix.version).startswith('7'):
+            proxy_name = "host"
+        else:
+            proxy_name = "name"
+        zabbix_proxies = zabbix.proxy.get(output=['proxyid', proxy_name])
+        # Set empty list for proxy processing Zabbix <= 6
+        zabbix_proxygroups = []
+        if str(zabbix.version).startswith('7'):
+            zabbix_proxygroups = zabbix.proxygroup.get(
+                output=["proxy_groupid", "name"])
+        # Sanitize proxy data
+        if proxy_name == "host":
+            for proxy in zabbix_proxies:
+                proxy['name'] = proxy.pop('host')
+        zabbix_groups = zabbix.hostgroup.get(output=['groupid', 'name'])
+        zabbix_templates = zabbix.template.get(output=['templateid', 'name'])
+    with metrics.phase("netbox_fetch"):
+        site_groups = convert_recordset(netbox.dcim.site_groups.all())
+        regions = convert_recordset(netbox.dcim.regions.all())
+    context = SyncContext(zabbix, netbox.extras.journal_entries, nb_version,
+                          site_groups, regions, zabbix_groups, zabbix_templates,
+                          # Prepare list of all proxy and proxy_groups
+                          proxy_prepper(zabbix_proxies, zabbix_proxygroups))
+    context.shard = shard
+    context.metrics = metrics
+    # The inventory_map is compiled once for all hosts of this run
+    context.inventory = InventoryMap(inventory_map if inventory_sync else {}, logger)
+    return context
+
+
+def run_sync(sync_function, nb_objects, context, workers=1):
+    """
+    Runs the sync function for each NetBox object.
+    Uses a pool of worker threads when more than one worker is requested.
+    """
+    if workers <= 1:
+        for nb_obj in nb_objects:
+            sync_function(nb_obj, context)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(sync_function, nb_obj, context)
+                   for nb_obj in nb_objects]
+        # Raise unexpected exceptions, SyncErrors are handled per host
+        for future in as_completed(futures):
+            future.result()
+
+
+def run_stream(sync_function, stream, object_type, context, workers=1):
+    """
+    Runs the sync function for each page of a NetBoxStream.
+    The Zabbix data of the hosts is fetched per page and
+    all collected changes are pushed to Zabbix after each page.
+    When sharding, the page of the first shard contains the objects of
+    all shards, of which the objects of the other shards are only planned.
+    """
+    pages = iter(stream)
+    while True:
+        # Time spent waiting for the next page
+        with context.metrics.phase("netbox_fetch"):
+            page = next(pages, None)
+        if page is None:
+            break
+        owned = context.shard.select(page, object_type) if context.shard else page
+        linked = (owned, []) if object_type == DEVICE else ([], owned)
+        with context.metrics.phase("zabbix_fetch"):
+            context.hosts = prefetch_zabbix_hosts(
+                context.zabbix, linked_hostids(*linked, context.fingerprints),
+                inventory_map.values(), zabbix_chunk_size, logger)
+        with context.metrics.phase("plan"):
+            planned = (page, []) if object_type == DEVICE else ([], page)
+            plan_hosts(*planned, context)
+        run_sync(sync_function, owned, context, workers)
+        flush_batches(context)
+
+
+def flush_batches(context):
+    """
+    Removes the collected removed hosts, creates the collected
+    new hosts and pushes the collected changes to Zabbix
+    """
+    if context.cleanup_batch:
+        with context.metrics.phase("cleanup"):
+            context.cleanup_batch.flush()
+    if context.create_batch:
+        with context.metrics.phase("create"):
+            context.create_batch.flush()
+    with context.metrics.phase("zabbix_update"):
+        context.update_batch.flush()
+
+
+def planned_host(host_class, nb_obj, context):
+    """
+    Returns a device or VM with its hostgroup set
+    or None when the host will not be created or updated.
+    """
+    host = host_class(nb_obj, context.zabbix, context.journals,
+                      context.nb_version, logger=plan_logger)
+    if host.status in zabbix_device_removal:
+        return None
+    if host_class is VirtualMachine:
+        host.set_vm_template(context)
+        host_format = vm_hostgroup_format
+    else:
+        host.set_template(templates_config_context, templates_config_context_overrule,
+                          context)
+        # Secondary cluster members are not synced
+        if host.isCluster() and clustering and not host.promoteMasterDevice():
+            return None
+        host_format = hostgroup_format
+    if not host.zbx_template_names:
+        return None
+    host.set_hostgroup(host_format, context.site_group_paths, context.region_paths, context)
+    return host if host.hostgroup else None
+
+
+def plan_hosts(nb_devices, nb_vms, context):
+    """
+    Prepares all devices and VMs before the hosts are processed.
+    All missing hostgroups and parent groups are created and the names of
+    all new hosts are checked in Zabbix with a few batched API calls,
+    instead of doing so for each host separately.
+    """
+    # When sharding, the hostgroups are created by the first shard
+    plan_groups = create_hostgroups and not (context.shard and
+                                             not context.shard.creates_groups)
+    if not plan_groups and context.hostnames is None:
+        return
+    required = set()
+    new_hosts = []
+    for host_class, nb_objects in ((PhysicalDevice, nb_devices), (VirtualMachine, nb_vms)):
+        for nb_obj in nb_objects:
+            try:
+                host = planned_host(host_class, nb_obj, context)
+            except SyncError:
+                # Reported when the host itself is synced
                 continue
-            # Checks if device is in cleanup state
-            if vm.status in zabbix_device_removal:
-                if vm.zabbix_id:
-                    # Delete device from Zabbix
-                    # and remove hostID from NetBox.
-                    vm.cleanup()
-                    logger.info(f"VM {vm.name}: cleanup complete")
-                    continue
-                # Device has been added to NetBox
-                # but is not in Activate state
-                logger.info(f"VM {vm.name}: skipping since this VM is "
-                            f"not in the active state.")
+            if not host:
                 continue
-            # Check if the VM is in the disabled state
-            if vm.status in zabbix_device_disable:
-                vm.zabbix_state = 1
-            # Check if VM is already in Zabbix
+            if plan_groups:
+                required.update(hostgroup_paths(host.hostgroup))
+            if not host.zabbix_id and (not context.shard or
+                                       context.shard.owns(host.nb, host.nb_object_type)):
+                new_hosts.append(host)
+    # Parents are sorted before their nested groups
+    missing = sorted(name for name in required if not context.group_id(name))
+    if missing:
+        with context.hostgroup_lock:
+            created, _ = create_zabbix_hostgroups(context.zabbix, missing, context,
+                                                  zabbix_chunk_size, logger)
+        logger.info(f"Hostgroups: created {len(created)} of {len(missing)} missing "
+                    f"hostgroup(s) for {len(nb_devices) + len(nb_vms)} host(s).")
+    if context.hostnames is None or not new_hosts:
+        return
+    in_use = context.hostnames.check([host.hostname() for host in new_hosts])
+    if in_use:
+        names = ", ".join(name for _, name in in_use[:20])
+        more = f" and {len(in_use) - 20} more" if len(in_use) > 20 else ""
+        logger.warning(f"{len(in_use)} new host(s) can not be added to Zabbix since "
+                       f"the name is already in use: {names}{more}.")
+
+
+def sync_vm(nb_vm, context):
+    """
+    Sync a single NetBox VM to Zabbix.
+    OUTPUT: outcome of the VM, such as created or in_sync
+    """
+    # pylint: disable=too-many-branches, too-many-return-statements
+    stopwatch = context.metrics.stopwatch("compute")
+    try:
+        vm = VirtualMachine(nb_vm, context.zabbix, context.journals,
+                            context.nb_version, create_journal, logger)
+        logger.debug(f"Host {vm.name}: started operations on VM.")
+        vm.set_vm_template(context)
+        # Check if a valid template has been found for this VM.
+        if not vm.zbx_template_names:
+            return stopwatch.stop(SKIPPED)
+        vm.set_hostgroup(vm_hostgroup_format,
+                         context.site_group_paths, context.region_paths, context)
+        # Check if a valid hostgroup has been found for this VM.
+        if not vm.hostgroup:
+            return stopwatch.stop(SKIPPED)
+        # Checks if device is in cleanup state
+        if vm.status in zabbix_device_removal:
             if vm.zabbix_id:
-                vm.ConsistencyCheck(zabbix_groups, zabbix_templates,
-                                    zabbix_proxy_list, full_proxy_sync,
-                                    create_hostgroups)
-                continue
-            # Add hostgroup is config is set
-            if create_hostgroups:
-                # Create new hostgroup. Potentially multiple groups if nested
-                hostgroups = vm.createZabbixHostgroup(zabbix_groups)
-                # go through all newly created hostgroups
-                for group in hostgroups:
-                    # Add new hostgroups to zabbix group list
-                    zabbix_groups.append(group)
-            # Add VM to Zabbix
-            vm.createInZabbix(zabbix_groups, zabbix_templates,
-                              zabbix_proxy_list)
-        except SyncError:
-            pass
+                # Delete device from Zabbix
+                # and remove hostID from NetBox.
+                stopwatch.next("cleanup")
+                if context.cleanup_batch is not None:
+                    # Removed together with all other removed hosts
+                    context.cleanup_batch.add(vm)
+                    return stopwatch.stop(DELETED)
+                vm.cleanup()
+                logger.info(f"VM {vm.name}: cleanup complete")
+                return stopwatch.stop(DELETED)
+            # Device has been added to NetBox
+            # but is not in Activate state
+            logger.info(f"VM {vm.name}: skipping since this VM is "
+                        f"not in the active state.")
+            return stopwatch.stop(SKIPPED)
+        # Check if the VM is in the disabled state
+        if vm.status in zabbix_device_disable:
+            vm.zabbix_state = 1
+        # Check if VM is already in Zabbix
+        if vm.zabbix_id:
+            stopwatch.next("consistency_check")
+            changed = vm.ConsistencyCheck(context, full_proxy_sync, create_hostgroups)
+            return stopwatch.stop(UPDATED if changed else IN_SYNC)
+        stopwatch.next("create")
+        # Add hostgroup is config is set
+        if create_hostgroups:
+            # Create new hostgroup. Potentially multiple groups if nested
+            vm.createZabbixHostgroup(context)
+        # Add VM to Zabbix
+        return stopwatch.stop(CREATED if vm.createInZabbix(context) else SKIPPED)
+    except SyncError:
+        # Retry this VM during the next incremental run
+        if context.incremental:
+            context.incremental.retry(VM, nb_vm.id)
+        return stopwatch.stop(ERRORED)
 
-    for nb_device in netbox_devices:
-        try:
-            # Set device instance set data such as hostgroup and template information.
-            device = PhysicalDevice(nb_device, zabbix, netbox_journals, nb_version,
-                                    create_journal, logger)
-            logger.debug(f"Host {device.name}: started operations on device.")
-            device.set_template(templates_config_context,
-                                templates_config_context_overrule)
-            # Check if a valid template has been found for this VM.
-            if not device.zbx_template_names:
-                continue
-            device.set_hostgroup(
-                hostgroup_format, netbox_site_groups, netbox_regions)
-            # Check if a valid hostgroup has been found for this VM.
-            if not device.hostgroup:
-                continue
-            device.set_inventory(nb_device)
-            # Checks if device is part of cluster.
-            # Requires clustering variable
-            if device.isCluster() and clustering:
-                # Check if device is primary or secondary
-                if device.promoteMasterDevice():
-                    e = (f"Device {device.name}: is "
-                         f"part of cluster and primary.")
-                    logger.info(e)
-                else:
-                    # Device is secondary in cluster.
-                    # Don't continue with this device.
-                    e = (f"Device {device.name}: is part of cluster "
-                         f"but not primary. Skipping this host...")
-                    logger.info(e)
-                    continue
-            # Checks if device is in cleanup state
-            if device.status in zabbix_device_removal:
-                if device.zabbix_id:
-                    # Delete device from Zabbix
-                    # and remove hostID from NetBox.
-                    device.cleanup()
-                    logger.info(f"Device {device.name}: cleanup complete")
-                    continue
-                # Device has been added to NetBox
-                # but is not in Activate state
-                logger.info(f"Device {device.name}: skipping since this device is "
-                            f"not in the active state.")
-                continue
-            # Check if the device is in the disabled state
-            if device.status in zabbix_device_disable:
-                device.zabbix_state = 1
-            # Check if device is already in Zabbix
+
+def sync_device(nb_device, context):
+    """
+    Sync a single NetBox device to Zabbix.
+    OUTPUT: outcome of the device, such as created or in_sync
+    """
+    # pylint: disable=too-many-branches, too-many-return-statements
+    stopwatch = context.metrics.stopwatch("compute")
+    try:
+        # Set device instance set data such as hostgroup and template information.
+        device = PhysicalDevice(nb_device, context.zabbix, context.journals,
+                                context.nb_version, create_journal, logger)
+        logger.debug(f"Host {device.name}: started operations on device.")
+        device.set_template(templates_config_context,
+                            templates_config_context_overrule, context)
+        # Check if a valid template has been found for this VM.
+        if not device.zbx_template_names:
+            return stopwatch.stop(SKIPPED)
+        device.set_hostgroup(
+            hostgroup_format, context.site_group_paths, context.region_paths, context)
+        # Check if a valid hostgroup has been found for this VM.
+        if not device.hostgroup:
+            return stopwatch.stop(SKIPPED)
+        device.set_inventory(nb_device, context)
+        # Checks if device is part of cluster.
+        # Requires clustering variable
+        if device.isCluster() and clustering:
+            # Check if device is primary or secondary
+            if device.promoteMasterDevice():
+                e = (f"Device {device.name}: is "
+                     f"part of cluster and primary.")
+                logger.info(e)
+            else:
+                # Device is secondary in cluster.
+                # Don't continue with this device.
+                e = (f"Device {device.name}: is part of cluster "
+                     f"but not primary. Skipping this host...")
+                logger.info(e)
+                return stopwatch.stop(SKIPPED)
+        # Checks if device is in cleanup state
+        if device.status in zabbix_device_removal:
             if device.zabbix_id:
-                device.ConsistencyCheck(zabbix_groups, zabbix_templates,
-                                        zabbix_proxy_list, full_proxy_sync,
-                                        create_hostgroups)
-                continue
-            # Add hostgroup is config is set
-            if create_hostgroups:
-                # Create new hostgroup. Potentially multiple groups if nested
-                hostgroups = device.createZabbixHostgroup(zabbix_groups)
-                # go through all newly created hostgroups
-                for group in hostgroups:
-                    # Add new hostgroups to zabbix group list
-                    zabbix_groups.append(group)
-            # Add device to Zabbix
-            device.createInZabbix(zabbix_groups, zabbix_templates,
-                                  zabbix_proxy_list)
-        except SyncError:
-            pass
+                # Delete device from Zabbix
+                # and remove hostID from NetBox.
+                stopwatch.next("cleanup")
+                if context.cleanup_batch is not None:
+                    # Removed together with all other removed hosts
+                    context.cleanup_batch.add(device)
+                    return stopwatch.stop(DELETED)
+                device.cleanup()
+                logger.info(f"Device {device.name}: cleanup complete")
+                return stopwatch.stop(DELETED)
+            # Device has been added to NetBox
+            # but is not in Activate state
+            logger.info(f"Device {device.name}: skipping since this device is "
+                        f"not in the active state.")
+            return stopwatch.stop(SKIPPED)
+        # Check if the device is in the disabled state
+        if device.status in zabbix_device_disable:
+            device.zabbix_state = 1
+        # Check if device is already in Zabbix
+        if device.zabbix_id:
+            stopwatch.next("consistency_check")
+            changed = device.ConsistencyCheck(context, full_proxy_sync, create_hostgroups)
+            return stopwatch.stop(UPDATED if changed else IN_SYNC)
+        stopwatch.next("create")
+        # Add hostgroup is config is set
+        if create_hostgroups:
+            # Create new hostgroup. Potentially multiple groups if nested
+            device.createZabbixHostgroup(context)
+        # Add device to Zabbix
+        return stopwatch.stop(CREATED if device.createInZabbix(context) else SKIPPED)
+    except SyncError:
+        # Retry this device during the next incremental run
+        if context.incremental:
+            context.incremental.retry(DEVICE, nb_device.id)
+        return stopwatch.stop(ERRORED)
 
 
 if __name__ == "__main__":
@@ -282,5 +686,39 @@ if __name__ == "__main__":
     )
     parser.add_argument("-v", "--verbose", help="Turn on debugging.",
                         action="store_true")
+    parser.add_argument("-w", "--workers", type=int,
+                        help="Number of hosts to process in parallel. Defaults to 1, "
+                        "or 8 when using --async.")
+    loaders = parser.add_mutually_exclusive_group()
+    loaders.add_argument("-a", "--async", dest="use_async", action="store_true",
+                         help="Use asynchronous NetBox and Zabbix clients.")
+    parser.add_argument("-r", "--requests", type=int, default=100,
+                        help="Maximum number of API requests in flight when using "
+                        "--async. Defaults to 100.")
+    parser.add_argument("-i", "--incremental", action="store_true",
+                        help="Only sync devices and VMs which changed since the last run.")
+    parser.add_argument("-f", "--full", action="store_true",
+                        help="Force a full sync when using --incremental.")
+    parser.add_argument("-l", "--listen", metavar="[ADDRESS:]PORT",
+                        help="Run as webhook listener and sync devices and VMs "
+                        "as soon as NetBox sends a webhook.")
+    loaders.add_argument("-s", "--stream", action="store_true",
+                         help="Sync NetBox devices and VMs page by page "
+                         "while the next pages are loading.")
+    loaders.add_argument("-g", "--graphql", action="store_true",
+                         help="Load NetBox devices and VMs using the GraphQL API.")
+    parser.add_argument("--shard", metavar="I/N", type=parse_shard,
+                        help="Only sync shard I of N, for instance 1/4. "
+                        "Shard 1 creates the hostgroups of all shards.")
+    recordings = parser.add_mutually_exclusive_group()
+    recordings.add_argument("--record", metavar="FILE",
+                            help="Record all NetBox and Zabbix API traffic to a "
+                            "compressed file.")
+    recordings.add_argument("--replay", metavar="FILE",
+                            help="Replay a recording instead of connecting to "
+                            "NetBox and Zabbix.")
+    parser.add_argument("--replay-latency", metavar="FACTOR", type=float, default=0.0,
+                        help="Wait FACTOR times the recorded duration of every request "
+                        "when using --replay. Defaults to 0.")
     args = parser.parse_args()
     main(args)
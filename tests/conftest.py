@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Shared test setup. The modules import their options from config.py,
+the tests use the defaults of config.py.example instead. Full syncs
+run against the NetBox and Zabbix stand-ins of the benchmark.
+"""
+import json
+import sys
+import types
+from argparse import Namespace
+from os import path
+
+import pytest
+
+REPO = path.dirname(path.dirname(path.abspath(__file__)))
+FIXTURES = path.join(REPO, "tests", "fixtures")
+
+
+def load_config():
+    """Loads config.py.example as the config module"""
+    config = types.ModuleType("config")
+    with open(path.join(REPO, "config.py.example"), encoding="utf-8") as file:
+        exec(compile(file.read(), "config.py", "exec"), config.__dict__)  # pylint: disable=exec-used
+    sys.modules["config"] = config
+
+
+load_config()
+sys.path.insert(0, REPO)
+
+
+def load_fixture(*names):
+    """Returns the contents of a JSON file in the fixtures directory"""
+    with open(path.join(FIXTURES, *names), encoding="utf-8") as file:
+        return json.load(file)
+
+
+@pytest.fixture(name="fixture")
+def fixture_loader():
+    """Loads recorded data from the fixtures directory"""
+    return load_fixture
+
+
+@pytest.fixture(name="standins")
+def standin_servers(monkeypatch):
+    """Runs empty NetBox and Zabbix stand-ins, returns their data"""
+    # pylint: disable=import-outside-toplevel
+    from benchmark.standins import NetBoxData, ZabbixData, netbox_standin, zabbix_standin
+    netbox, zabbix = NetBoxData(), ZabbixData()
+    servers = (netbox_standin(netbox).start(), zabbix_standin(zabbix).start())
+    monkeypatch.setenv("NETBOX_HOST", servers[0].url)
+    monkeypatch.setenv("NETBOX_TOKEN", "netbox-token")
+    monkeypatch.setenv("ZABBIX_HOST", f"{servers[1].url}/api_jsonrpc.php")
+    monkeypatch.setenv("ZABBIX_TOKEN", "zabbix-token")
+    yield netbox, zabbix
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture(name="sync")
+def sync_runner(standins, monkeypatch, tmp_path):
+    """
+    Returns a function which runs a full sync against the stand-ins with
+    command line arguments as keywords and returns the metrics of the run.
+    """
+    # pylint: disable=import-outside-toplevel
+    import netbox_zabbix_sync
+    metrics_file = tmp_path / "metrics.json"
+    monkeypatch.setattr(netbox_zabbix_sync, "metrics_json", str(metrics_file))
+    monkeypatch.setattr(netbox_zabbix_sync, "incremental_state_file",
+                        str(tmp_path / "incremental_state.json"))
+
+    def run(**arguments):
+        defaults = {"verbose": False, "workers": 1, "use_async": False, "requests": 100,
+                    "incremental": False, "full": False, "listen": None, "stream": False,
+                    "graphql": False, "shard": None, "record": None, "replay": None,
+                    "replay_latency": 0.0}
+        netbox_zabbix_sync.main(Namespace(**{**defaults, **arguments}))
+        with open(metrics_file, encoding="utf-8") as file:
+            return json.load(file)
+    run.standins = standins
+    return run
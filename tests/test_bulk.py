@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Tests of the batched Zabbix operations"""
+from unittest.mock import MagicMock
+
+from modules.bulk import HostnameIndex
+
+
+def zabbix_with_hosts(*names):
+    """Returns a Zabbix API mock which filters host names exactly, like Zabbix"""
+    zabbix = MagicMock()
+
+    def host_get(filter, **_):  # pylint: disable=redefined-builtin
+        return [{"host": name} for name in names if name in filter["host"]]
+    zabbix.host.get.side_effect = host_get
+    return zabbix
+
+
+def test_hostname_index_is_case_sensitive():
+    """Names which only differ in case from an existing host are not in use"""
+    index = HostnameIndex(zabbix_with_hosts("Host1", "router1"), 100)
+    in_use = index.check([("host", "Host1"), ("host", "host1"), ("host", "Router1")])
+    assert in_use == [("host", "Host1")]
+    assert index.exists("host", "Host1")
+    assert index.exists("host", "host1") is False
+    assert index.exists("host", "Router1") is False
+    assert index.exists("host", "unknown") is None
+    index.add("host", "host1")
+    assert index.exists("host", "host1")
+    assert index.exists("host", "HOST1") is None
+
+
+def test_hostname_index_checks_names_once():
+    """Names are only requested once"""
+    zabbix = zabbix_with_hosts("Host1")
+    index = HostnameIndex(zabbix, 100)
+    index.check([("host", "Host1"), ("host", "host1")])
+    assert index.check([("host", "Host1"), ("host", "host1")]) == []
+    assert zabbix.host.get.call_count == 1
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests of the local evaluation of config contexts. The fixtures are synthetic:
+they use the format of the NetBox API, but were not captured from NetBox and
+their expected config contexts were written for these tests.
+"""
+import random
+from os import environ
+
+import pynetbox
+import pytest
+
+from benchmark.inventory import seed
+from benchmark.standins import Ref
+from modules.config_context import ConfigContexts, load_config_contexts
+from modules.interface import ZabbixInterface
+from modules.prefetch import DEVICE_RELATIONS, VM_RELATIONS, prefetch_related
+
+# Objects which are needed to evaluate the synthetic config contexts
+TABLES = {"dcim/regions": "regions.json",
+          "dcim/site-groups": "site_groups.json",
+          "dcim/locations": "locations.json",
+          "tenancy/tenant-groups": "tenant_groups.json",
+          "virtualization/clusters": "clusters.json"}
+
+
+def synthetic(fixture, name):
+    """Returns the results of a synthetic NetBox API response"""
+    return fixture("synthetic_config_contexts", name)["results"]
+
+
+def synthetic_contexts(fixture):
+    """Returns the synthetic config contexts with the objects they need"""
+    contexts = ConfigContexts(synthetic(fixture, "config_contexts.json"))
+    for table in contexts.tables:
+        contexts.add_table(table, synthetic(fixture, TABLES[table]))
+    return contexts
+
+
+def synthetic_objects(fixture, name):
+    """
+    Returns the synthetic devices or VMs as pynetbox records with their
+    expected config context, with the full sites and tenants like the sync.
+    """
+    netbox = pynetbox.api("https://netbox.example.com", token="netbox-token")
+    endpoint = netbox.dcim.devices if name == "devices.json" \
+        else netbox.virtualization.virtual_machines
+    sites = {site["id"]: site for site in synthetic(fixture, "sites.json")}
+    tenants = {tenant["id"]: tenant for tenant in synthetic(fixture, "tenants.json")}
+    objects = []
+    for obj in synthetic(fixture, name):
+        expected = obj.pop("expected_config_context")
+        if obj["site"]:
+            obj["site"] = sites[obj["site"]["id"]]
+        if obj["tenant"]:
+            obj["tenant"] = tenants[obj["tenant"]["id"]]
+        objects.append((endpoint.return_obj(obj, netbox, endpoint), expected))
+    return objects
+
+
+def zabbix_context(config_context):
+    """Returns the part of a config context which is evaluated locally"""
+    return {"zabbix": config_context["zabbix"]} if "zabbix" in config_context else {}
+
+
+@pytest.mark.parametrize("name", ["devices.json", "virtual_machines.json"])
+def test_synthetic_config_contexts(fixture, name):
+    """The config context of each synthetic object is the expected one"""
+    contexts = synthetic_contexts(fixture)
+    for record, expected in synthetic_objects(fixture, name):
+        assert contexts.config_context(record) == zabbix_context(expected), record.name
+
+
+def test_objects_do_not_share_config_context(fixture):
+    """Changes to the config context of one object do not change that of another"""
+    contexts = synthetic_contexts(fixture)
+    objects = {record.name: record for record, _ in synthetic_objects(fixture, "devices.json")}
+    # Two objects with the same assignments, without and with local context data
+    for name in ("nyc1-rtr-02", "nyc1-sw-01"):
+        first = contexts.config_context(objects[name])
+        first["zabbix"]["snmp"].clear()
+        first["zabbix"].pop("interface_type")
+        second = contexts.config_context(objects[name])
+        assert second["zabbix"]["interface_type"] == 2
+        interface = ZabbixInterface(second, "192.0.2.1")
+        assert interface.get_context()
+        interface.set_snmp()
+        assert interface.interface["details"]["version"] in ("2", "3")
+
+
+def add_random_contexts(netbox_data, rng, count):
+    """Adds config contexts with random assignments and tags to the devices"""
+    tables = {"regions": "dcim/regions", "site_groups": "dcim/site-groups",
+              "sites": "dcim/sites", "device_types": "dcim/device-types",
+              "roles": "dcim/device-roles", "platforms": "dcim/platforms",
+              "clusters": "virtualization/clusters", "tenant_groups": "tenancy/tenant-groups",
+              "tenants": "tenancy/tenants"}
+    tags = [netbox_data.add("extras/tags", {"name": slug, "slug": slug})["id"]
+            for slug in ("gold", "silver", "bronze")]
+    for device in netbox_data.tables["dcim/devices"].values():
+        device["tags"] = [Ref("extras/tags", tag) for tag in rng.sample(tags, rng.randint(0, 2))]
+    for i in range(count):
+        assigned = {criterion: [Ref(path, obj_id) for obj_id in rng.sample(
+            sorted(netbox_data.tables[path]), min(2, len(netbox_data.tables[path])))]
+                    for criterion, path in tables.items() if rng.random() < 0.15}
+        assigned["tags"] = [Ref("extras/tags", rng.choice(tags))] if rng.random() < 0.2 else []
+        data = {"zabbix": rng.choice([{"proxy": f"proxy-{i}"}, {"templates": [f"Template {i}"]},
+                                      {"snmp": {"community": f"community-{i}"}}, {}])}
+        netbox_data.add("extras/config-contexts", {
+            "name": f"Context {i % 7}", "weight": rng.choice([900, 1000, 1100]),
+            "is_active": rng.random() < 0.9, "data": data, **assigned})
+
+
+def test_local_matches_standin(standins):
+    """The config context of every object is the same as the one of the NetBox stand-in"""
+    netbox_data, zabbix_data = standins
+    seed(netbox_data, zabbix_data, devices=150, vms=60, templates=10, hostgroups=1, sites=8)
+    add_random_contexts(netbox_data, random.Random(3), 40)
+    netbox = pynetbox.api(environ["NETBOX_HOST"], token=environ["NETBOX_TOKEN"])
+    contexts = load_config_contexts(netbox)
+    for endpoint, relations in ((netbox.dcim.devices, DEVICE_RELATIONS),
+                                (netbox.virtualization.virtual_machines, VM_RELATIONS)):
+        rendered = {obj.id: obj.config_context for obj in endpoint.all()}
+        objects = list(endpoint.filter(exclude="config_context"))
+        prefetch_related(netbox, objects, relations)
+        contexts.apply(objects)
+        assert len(objects) == len(rendered)
+        for obj in objects:
+            assert obj.config_context == zabbix_context(rendered[obj.id]), obj.name
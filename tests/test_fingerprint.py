@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""Tests of the fingerprint store with full syncs against the stand-ins"""
+import netbox_zabbix_sync
+from benchmark.inventory import seed
+from modules.interface import ZabbixInterface
+
+
+def snmp_context():
+    """Returns a config context with an SNMPv2 interface"""
+    return {"zabbix": {"interface_type": 2,
+                       "snmp": {"version": 2, "bulk": 0, "community": "public"}}}
+
+
+def test_set_snmp_keeps_config_context():
+    """The interface can be set more than once from the same config context"""
+    context = snmp_context()
+    for _ in range(2):
+        interface = ZabbixInterface(context, "10.0.0.1")
+        assert interface.get_context()
+        interface.set_snmp()
+        assert interface.interface["details"] == {"bulk": "0", "version": "2",
+                                                  "community": "public"}
+    assert context == snmp_context()
+
+
+def test_two_syncs_with_fingerprints(sync, monkeypatch, tmp_path):
+    """SNMP hosts are in sync on the next run when the fingerprint store is used"""
+    monkeypatch.setattr(netbox_zabbix_sync, "fingerprint_db", str(tmp_path / "fp.db"))
+    # Verify every host against Zabbix, so the consistency check runs for all hosts
+    monkeypatch.setattr(netbox_zabbix_sync, "fingerprint_verify_fraction", 1)
+    netbox, zabbix = sync.standins
+    seed(netbox, zabbix, devices=60, templates=10, hostgroups=5, sites=5)
+    snmp_devices = [device for device in netbox.tables["dcim/devices"].values()
+                    if netbox.config_context(device).get("zabbix", {}).get("interface_type") == 2]
+    assert snmp_devices
+    first = sync()
+    assert first["hosts"]["errored"] == 0
+    assert first["hosts"]["created"]
+    second = sync()
+    assert second["hosts"]["errored"] == 0
+    assert second["hosts"]["in_sync"] == first["hosts"]["created"]
+    snmp_hosts = [host for host in zabbix.hosts.values()
+                  if host["interfaces"][0]["type"] == "2"]
+    assert {host["interfaces"][0]["details"]["version"] for host in snmp_hosts} == {"2"}
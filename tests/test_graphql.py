@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Tests of the GraphQL loader against the NetBox stand-in"""
+from os import environ
+
+import pynetbox
+import pytest
+from pynetbox.core.endpoint import Endpoint
+
+import netbox_zabbix_sync
+from benchmark.inventory import seed
+from modules import graphql as graphql_module
+from modules.graphql import GraphqlLoader, graphql_value, lookup_filter
+
+# REST filters which can be converted to GraphQL filters of every NetBox version
+FILTERS = [{},
+           {"name__n": "null"},
+           {"site": ["site1", "site2"]},
+           {"site_id": [1, 3], "name__ic": "DEVICE-1"},
+           {"role": "role2", "name__nisw": "device-2"},
+           {"tenant": "tenant3", "platform": ["platform1", "platform2"]}]
+
+
+def test_lookup_filter():
+    """REST filters are converted to the lookups of NetBox 4.3 and newer"""
+    assert lookup_filter({"name__n": "null"}) == {"NOT": {"name": {"in_list": ["null"]}}}
+    assert lookup_filter({"site": ["ams", "fra"], "tag": "zabbix"}) == \
+        {"site": {"slug": {"in_list": ["ams", "fra"]}},
+         "tags": {"slug": {"in_list": ["zabbix"]}}}
+    assert lookup_filter({"role_id": 4, "serial__ie": "SN1"}) == \
+        {"role": {"id": {"in_list": ["4"]}}, "serial": {"i_exact": "SN1"}}
+    assert graphql_value({"NOT": {"name": {"in_list": ["null"]}}}) == \
+        '{NOT: {name: {in_list: ["null"]}}}'
+
+
+@pytest.mark.parametrize("base_filter", [{"status": "active"},
+                                         {"has_primary_ip": True},
+                                         {"name__ic": ["a", "b"]},
+                                         {"name__n": "a", "serial__n": "b"},
+                                         {"site": "ams", "site_id": 1}])
+def test_lookup_filter_unsupported(base_filter):
+    """Filters without GraphQL lookup are not converted"""
+    assert lookup_filter(base_filter) is None
+
+
+def loader(standins, version, page_size=25, max_page_size=1000):
+    """Seeds the stand-in and returns a GraphQL loader and the pynetbox API"""
+    netbox_data, zabbix_data = standins
+    netbox_data.version = version
+    netbox_data.max_page_size = max_page_size
+    seed(netbox_data, zabbix_data, devices=80, templates=1, hostgroups=1, sites=4)
+    netbox = pynetbox.api(environ["NETBOX_HOST"], token=environ["NETBOX_TOKEN"])
+    return GraphqlLoader(netbox, version, page_size), netbox
+
+
+@pytest.mark.parametrize("version", ["4.1", "4.4"])
+@pytest.mark.parametrize("base_filter", FILTERS)
+def test_filter_in_graphql(standins, monkeypatch, version, base_filter):
+    """The REST filter is part of the GraphQL query and selects the same devices"""
+    graphql, netbox = loader(standins, version)
+    expected = sorted(device.id for device in netbox.dcim.devices.filter(**base_filter))
+
+    def no_rest(*_, **__):
+        raise AssertionError("The REST API is used to apply the filter.")
+    monkeypatch.setattr(Endpoint, "filter", no_rest)
+    assert sorted(device.id for device in graphql.devices(base_filter)) == expected
+    subset = expected[::3] + [max(standins[0].tables["dcim/devices"])]
+    assert sorted(device.id for device in graphql.devices(base_filter, subset)) == \
+        sorted(set(subset).intersection(expected))
+
+
+def test_unsupported_filter(standins):
+    """Filters which can not be used with GraphQL are applied with the REST API"""
+    graphql, netbox = loader(standins, "4.4")
+    base_filter = {"status": "active"}
+    assert sorted(device.id for device in graphql.devices(base_filter)) == \
+        sorted(device.id for device in netbox.dcim.devices.filter(**base_filter))
+
+
+@pytest.mark.parametrize("version", ["4.1", "4.4"])
+@pytest.mark.parametrize("page_size, max_page_size", [(25, 10), (10, 10), (80, 1000),
+                                                      (1000, 30)])
+def test_all_pages(standins, version, page_size, max_page_size):
+    """All objects are loaded, also when NetBox returns smaller pages"""
+    graphql, _ = loader(standins, version, page_size, max_page_size)
+    devices = standins[0].tables["dcim/devices"]
+    assert sorted(device.id for device in graphql.devices({})) == sorted(devices)
+    ids = sorted(devices)[5:70]
+    assert sorted(device.id for device in graphql.devices({}, ids)) == ids
+
+
+@pytest.mark.parametrize("graphql", [False, True])
+def test_device_type_without_template(sync, monkeypatch, graphql):
+    """
+    Devices of a device type without template fail, the other devices are
+    synced. Also when the hostgroup format does not use the manufacturer.
+    """
+    monkeypatch.setattr(netbox_zabbix_sync, "hostgroup_format", "site/role")
+    monkeypatch.setattr(graphql_module, "hostgroup_format", "site/role")
+    netbox, zabbix = sync.standins
+    netbox.version = "4.4"
+    seed(netbox, zabbix, devices=40, templates=5, hostgroups=1, sites=3)
+    netbox.tables["dcim/device-types"][1]["custom_fields"] = {}
+    metrics = sync(graphql=graphql)
+    assert metrics["hosts"]["created"]
+    assert metrics["hosts"]["errored"]
+    for device in netbox.tables["dcim/devices"].values():
+        if device["device_type"].id == 1:
+            assert device["custom_fields"]["zabbix_hostid"] is None
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""Tests of the compiled inventory_map"""
+import logging
+
+from modules.inventory import InventoryMap
+
+
+def test_paths_are_evaluated_for_every_host(caplog):
+    """A path which fails for one host is still used for the other hosts"""
+    inventory = InventoryMap({"device_type/model": "model", "tags": "notes"})
+    with caplog.at_level(logging.ERROR):
+        assert not inventory.inventory({"name": "vm1"}, "vm1")
+        assert not inventory.inventory({"name": "vm2"}, "vm2")
+        assert inventory.inventory({"device_type": {"model": "MX204"}, "tags": ["core"]},
+                                   "router1") == {"model": "MX204"}
+        assert inventory.inventory({"device_type": {"model": "MX480"}, "tags": ["edge"]},
+                                   "router2") == {"model": "MX480"}
+    # Each kind of problem with a path is only reported once
+    assert len(caplog.records) == 3
+    assert "unexpected type for host router1" in caplog.records[-1].message
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Tests of the recording and replay of API traffic"""
+import pytest
+from zabbix_utils import APIRequestError, ProcessingError
+
+from modules.recording import Recorder, Replayer
+
+
+def failing(error):
+    """Returns a request which fails with an error"""
+    def send():
+        raise error
+    return send
+
+
+def test_replay_zabbix_errors(tmp_path):
+    """Errors of Zabbix requests are replayed, including connection failures"""
+    filename = tmp_path / "run.jsonl.gz"
+    recorder = Recorder(filename, "http://netbox", "http://zabbix")
+    api_error = APIRequestError({"code": -32602, "message": "Invalid params.",
+                                 "data": "Host \"sw01\" already exists.",
+                                 "body": {"method": "host.create", "params": {"host": "sw01"}}})
+    requests = [("host.get", {"hostids": ["1"]}, lambda: {"result": [{"hostid": "1"}]}),
+                ("host.create", {"host": "sw01"}, failing(api_error)),
+                ("host.update", {"hostid": "1"},
+                 failing(ProcessingError("Unable to connect to http://zabbix")))]
+    for method, params, send in requests:
+        try:
+            recorder.zabbix_request(send, method, params)
+        except (APIRequestError, ProcessingError):
+            pass
+    recorder.close()
+    replayer = Replayer(filename)
+    assert replayer.zabbix_request(None, "host.get", {"hostids": ["1"]}) == \
+        {"jsonrpc": "2.0", "result": [{"hostid": "1"}]}
+    with pytest.raises(APIRequestError, match="already exists"):
+        replayer.zabbix_request(None, "host.create", {"host": "sw01"})
+    with pytest.raises(ProcessingError, match="Unable to connect"):
+        replayer.zabbix_request(None, "host.update", {"hostid": "1"})
+    assert replayer.missing == 0
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Tests of sharded syncs against the stand-ins"""
+import pytest
+
+import netbox_zabbix_sync
+from benchmark.inventory import seed
+from modules import shard as shard_module
+from modules.incremental import DEVICE
+from modules.shard import Shard, parse_shard
+
+SHARDS = 3
+
+
+def test_parse_shard():
+    """Shards are numbered from 1 to N"""
+    assert parse_shard("2/4") == (2, 4)
+    for value in ("0/4", "5/4", "1/0", "a/4", "1"):
+        with pytest.raises(Exception):
+            parse_shard(value)
+
+
+def test_every_object_has_one_shard():
+    """Every object belongs to exactly one shard, virtual chassis members to the same"""
+    shards = [Shard(index, SHARDS) for index in range(1, SHARDS + 1)]
+    for obj_id in range(200):
+        device = {"id": obj_id, "virtual_chassis": None}
+        assert sum(shard.owns(device, DEVICE) for shard in shards) == 1
+        assert [shard.select([device], DEVICE) for shard in shards].count([]) == SHARDS - 1
+    members = [{"id": obj_id, "virtual_chassis": {"id": 7}} for obj_id in range(10)]
+    for shard in shards:
+        assert shard.select(members, DEVICE) in ([], members)
+    assert not shards[1].others(members, DEVICE)
+    assert len(shards[0].select(members, DEVICE) + shards[0].others(members, DEVICE)) == 10
+
+
+def owner(nb_obj):
+    """Returns the index of the shard which owns a device of the NetBox stand-in"""
+    chassis = nb_obj["virtual_chassis"]
+    device = {"id": nb_obj["id"], "virtual_chassis": {"id": chassis.id} if chassis else None}
+    return next(index for index in range(1, SHARDS + 1)
+                if Shard(index, SHARDS).owns(device, DEVICE))
+
+
+@pytest.mark.parametrize("arguments", [{}, {"stream": True}, {"graphql": True},
+                                       {"use_async": True, "workers": 4}])
+def test_shards_sync_their_own_hosts(sync, monkeypatch, arguments):
+    """
+    Each shard only creates its own hosts. The first shard creates the
+    hostgroups of all shards, so the other shards do not have to wait.
+    """
+    monkeypatch.setattr(shard_module, "shard_group_timeout", 0)
+    netbox, zabbix = sync.standins
+    seed(netbox, zabbix, devices=90, templates=5, hostgroups=5, sites=6)
+    devices = netbox.tables["dcim/devices"].values()
+    groups = None
+    for index in range(1, SHARDS + 1):
+        linked = {device["id"] for device in devices
+                  if device["custom_fields"]["zabbix_hostid"]}
+        metrics = sync(shard=(index, SHARDS), **arguments)
+        assert metrics["hosts"]["errored"] == 0
+        created = {device["id"] for device in devices
+                   if device["custom_fields"]["zabbix_hostid"]} - linked
+        assert created
+        assert {owner(device) for device in devices if device["id"] in created} == {index}
+        groups = groups or len(zabbix.groups)
+    # The other shards did not need to create any hostgroup
+    assert len(zabbix.groups) == groups
+    # All hosts have been created by one of the shards
+    metrics = sync(**arguments)
+    assert metrics["hosts"]["created"] == 0
+    assert metrics["hosts"]["errored"] == 0
+
+
+@pytest.mark.parametrize("arguments", [{}, {"stream": True}])
+def test_first_shard_prefetches_own_hosts(sync, monkeypatch, arguments):
+    """The first shard only requests the Zabbix hosts of its own devices"""
+    netbox, zabbix = sync.standins
+    seed(netbox, zabbix, devices=60, templates=5, hostgroups=5, sites=6)
+    sync(**arguments)
+    prefetched = []
+    prefetch = netbox_zabbix_sync.prefetch_zabbix_hosts
+
+    def record(zbx, hostids, *args):
+        prefetched.extend(hostids)
+        return prefetch(zbx, hostids, *args)
+    monkeypatch.setattr(netbox_zabbix_sync, "prefetch_zabbix_hosts", record)
+    metrics = sync(shard=(1, SHARDS), **arguments)
+    assert metrics["hosts"]["errored"] == 0
+    owned = {device["custom_fields"]["zabbix_hostid"] for device
+             in netbox.tables["dcim/devices"].values() if owner(device) == 1}
+    assert prefetched
+    assert set(prefetched) <= owned
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Tests of the streaming NetBox fetch against the NetBox stand-in"""
+import logging
+from os import environ
+
+import pynetbox
+import pytest
+
+from benchmark.inventory import seed
+from modules.stream import NetboxStream
+
+
+@pytest.mark.parametrize("page_size, max_page_size", [(10, 0), (25, 10), (7, 1000),
+                                                      (1000, 1000)])
+def test_all_pages(standins, page_size, max_page_size):
+    """All objects are streamed, also when NetBox limits the page size"""
+    netbox_data, zabbix_data = standins
+    seed(netbox_data, zabbix_data, devices=53, templates=1, hostgroups=1, sites=2)
+    netbox_data.max_page_size = max_page_size
+    netbox = pynetbox.api(environ["NETBOX_HOST"], token=environ["NETBOX_TOKEN"])
+    stream = NetboxStream(netbox, "dcim/devices", {}, {}, page_size)
+    pages = list(stream)
+    assert sorted(device.id for page in pages for device in page) == \
+        sorted(netbox_data.tables["dcim/devices"])
+    assert not max_page_size or max(len(page) for page in pages) <= max_page_size
+
+
+def test_incremental_stream_warns(sync, caplog):
+    """A warning is logged when an incremental sync is not streamed"""
+    netbox, zabbix = sync.standins
+    seed(netbox, zabbix, devices=20, templates=1, hostgroups=1, sites=2)
+    with caplog.at_level(logging.WARNING):
+        first = sync(stream=True, incremental=True)
+        assert "Streaming is not used" not in caplog.text
+        second = sync(stream=True, incremental=True)
+        assert "Streaming is not used for an incremental sync" in caplog.text
+    assert first["hosts"]["created"]
+    assert second["hosts"]["errored"] == 0
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Tests of the webhook listener using recorded NetBox webhook bodies"""
+import hmac
+import json
+from hashlib import sha512
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from threading import Event, Thread
+from unittest.mock import MagicMock
+
+import pytest
+
+from modules import webhook
+from modules.context import SyncContext
+from modules.incremental import DEVICE, VM
+from modules.webhook import WebhookHandler, WebhookListener, parse_address
+
+SECRET = "7b1d5c0e9f3a"
+
+
+def sync_context():
+    """Returns an empty SyncContext"""
+    return SyncContext(MagicMock(), MagicMock(), "4.1", [], [], [], [], [])
+
+
+def signature(body, secret=SECRET):
+    """Returns the signature NetBox sends in the X-Hook-Signature header"""
+    return hmac.new(secret.encode(), body, sha512).hexdigest()
+
+
+@pytest.fixture(name="listener")
+def webhook_listener(monkeypatch):
+    """Returns a listener with a mocked NetBox API and sync functions"""
+    monkeypatch.setenv("WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(webhook, "webhook_debounce", 0.05)
+    monkeypatch.setattr(webhook, "sync_vms", True)
+    listener = WebhookListener("127.0.0.1:0", MagicMock(), sync_context,
+                               MagicMock(), MagicMock(), workers=2)
+    listener.context = sync_context()
+    yield listener
+    listener.stop()
+
+
+@pytest.fixture(name="server")
+def webhook_server(listener):
+    """Runs the HTTP server of a listener on a free port"""
+    handler = type("Handler", (WebhookHandler,), {"listener": listener})
+    listener.server = ThreadingHTTPServer(listener.address, handler)
+    thread = Thread(target=listener.server.serve_forever, daemon=True)
+    thread.start()
+    yield listener.server
+    listener.server.shutdown()
+
+
+def post(server, body, headers=None):
+    """Posts a webhook body to the listener, returns the status and response"""
+    connection = HTTPConnection(*server.server_address, timeout=5)
+    connection.request("POST", "/", body, {"Content-Type": "application/json",
+                                           **(headers or {})})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())["detail"]
+    connection.close()
+    return result
+
+
+def test_parse_address():
+    """The address of the listener defaults to all interfaces"""
+    assert parse_address("8080") == ("0.0.0.0", 8080)
+    assert parse_address("127.0.0.1:8080") == ("127.0.0.1", 8080)
+    assert parse_address("[::1]:8080") == ("[::1]", 8080)
+
+
+def test_valid_signature(listener, server, fixture):
+    """Webhooks signed with the secret are accepted"""
+    body = json.dumps(fixture("webhooks", "device_updated.json")).encode()
+    status, _ = post(server, body, {"X-Hook-Signature": signature(body)})
+    assert status == 202
+    assert (DEVICE, 42) in listener.pending
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Hook-Signature": "0" * 128},
+                                     {"X-Hook-Signature": "invalid"}])
+def test_invalid_signature(listener, server, fixture, headers):
+    """Webhooks without a valid signature are rejected"""
+    body = json.dumps(fixture("webhooks", "device_updated.json")).encode()
+    status, message = post(server, body, headers)
+    assert status == 403
+    assert message == "Invalid webhook signature."
+    assert not listener.pending
+
+
+def test_signature_of_other_secret(listener, fixture):
+    """A signature made with another secret is rejected"""
+    body = json.dumps(fixture("webhooks", "device_updated.json")).encode()
+    assert listener.verify(body, signature(body))
+    assert not listener.verify(body, signature(body, "other"))
+    assert not listener.verify(body + b" ", signature(body))
+
+
+def test_without_secret(monkeypatch):
+    """All webhooks are accepted when no secret has been configured"""
+    monkeypatch.delenv("WEBHOOK_SECRET", raising=False)
+    listener = WebhookListener("8080", MagicMock(), sync_context, MagicMock(), MagicMock())
+    assert listener.verify(b"{}", None)
+
+
+def test_invalid_json(server):
+    """Bodies which are not JSON are rejected"""
+    body = b"event=updated"
+    assert post(server, body, {"X-Hook-Signature": signature(body)})[0] == 400
+
+
+@pytest.mark.parametrize("name, key", [("device_updated.json", (DEVICE, 42)),
+                                       ("device_updated_v3.json", (DEVICE, 42)),
+                                       ("vm_created.json", (VM, 7))])
+def test_receive(listener, fixture, name, key):
+    """Devices and VMs are scheduled for a sync, also from NetBox 3 webhooks"""
+    assert listener.receive(fixture("webhooks", name))[0] == 202
+    assert list(listener.pending) == [key]
+
+
+def test_receive_ignored(listener, monkeypatch, fixture):
+    """Deleted objects and VMs are not synced when VMs are not synced"""
+    assert listener.receive(fixture("webhooks", "device_deleted.json"))[0] == 202
+    monkeypatch.setattr(webhook, "sync_vms", False)
+    assert listener.receive(fixture("webhooks", "vm_created.json"))[0] == 202
+    assert listener.receive({"object_type": "dcim.site", "data": {"id": 1}})[0] == 400
+    assert listener.receive({"object_type": "dcim.device", "data": {}})[0] == 400
+    assert not listener.pending
+
+
+def test_debounce(listener, fixture):
+    """Webhooks of the same object are coalesced into a single sync"""
+    payload = fixture("webhooks", "device_updated.json")
+    listener.receive(payload)
+    first = listener.pending[(DEVICE, 42)]
+    listener.receive(payload)
+    assert len(listener.pending) == 1
+    # Every webhook postpones the sync
+    assert listener.pending[(DEVICE, 42)] > first
+    assert listener.due() == [(DEVICE, 42)]
+    assert not listener.pending
+    assert listener.running == {(DEVICE, 42)}
+
+
+def test_running_object_is_postponed(listener, fixture):
+    """An object which is being synced is not synced again at the same time"""
+    payload = fixture("webhooks", "device_updated.json")
+    listener.receive(payload)
+    assert listener.due() == [(DEVICE, 42)]
+    listener.receive(payload)
+    listener.receive(fixture("webhooks", "vm_created.json"))
+    assert listener.due() == [(VM, 7)]
+    assert (DEVICE, 42) in listener.pending
+    listener.running.discard((DEVICE, 42))
+    assert listener.due() == [(DEVICE, 42)]
+
+
+def run_dispatch(listener, payloads, synced):
+    """Receives webhooks and dispatches them until synced is set"""
+    thread = Thread(target=listener.dispatch, daemon=True)
+    thread.start()
+    for payload in payloads:
+        listener.receive(payload)
+    assert synced.wait(5)
+    listener.stop()
+    thread.join(5)
+
+
+def test_dispatch(listener, fixture):
+    """Due objects are fetched from NetBox and synced with the cached context"""
+    synced = Event()
+    device = MagicMock()
+    listener.netbox.dcim.devices.filter.return_value = [device]
+    listener.sync_functions[DEVICE].side_effect = lambda *_: synced.set()
+    payload = fixture("webhooks", "device_updated.json")
+    run_dispatch(listener, [payload, payload, payload], synced)
+    listener.netbox.dcim.devices.filter.assert_called_once_with(
+        id=42, **webhook.nb_device_filter)
+    listener.sync_functions[DEVICE].assert_called_once_with(device, listener.context)
+    listener.sync_functions[VM].assert_not_called()
+    assert not listener.running
+
+
+def test_dispatch_filtered(listener, fixture):
+    """Objects outside of the configured filter are not synced"""
+    synced = Event()
+    listener.netbox.virtualization.virtual_machines.filter.side_effect = \
+        lambda **_: synced.set() or []
+    run_dispatch(listener, [fixture("webhooks", "vm_created.json")], synced)
+    listener.sync_functions[VM].assert_not_called()
+
+
+def test_dispatch_error(listener, fixture):
+    """A failing sync does not stop the listener"""
+    synced = Event()
+    listener.netbox.dcim.devices.filter.return_value = [MagicMock()]
+    listener.sync_functions[DEVICE].side_effect = RuntimeError("Zabbix is down")
+    listener.logger = MagicMock()
+    listener.logger.error.side_effect = lambda *_: synced.set()
+    run_dispatch(listener, [fixture("webhooks", "device_updated.json")], synced)
+    assert not listener.running
+
+
+@pytest.mark.parametrize("name", ["configcontext_updated.json",
+                                  "devicetype_updated_v3.json"])
+def test_invalidate_caches(listener, fixture, name):
+    """Config context and device type webhooks clear the cached hostgroups and templates"""
+    context = listener.context
+    context.cached("hostgroups", (1,), lambda: "Switch/HQ-AMS")
+    context.cached("templates", (3, False, False, None), lambda: ["Generic by SNMP"])
+    context.cached("template_ids", ("Generic by SNMP",), lambda: [{"templateid": "1"}])
+    assert listener.receive(fixture("webhooks", name))[0] == 202
+    assert not listener.pending
+    resolve = MagicMock(return_value=["Juniper by SNMP"])
+    assert context.cached("templates", (3, False, False, None), resolve) == \
+        ["Juniper by SNMP"]
+    resolve.assert_called_once()
+    assert "hostgroups" not in context.cache
+    assert "template_ids" not in context.cache